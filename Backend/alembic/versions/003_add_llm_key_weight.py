@@ -0,0 +1,26 @@
+"""add weight to llm_key for weighted round-robin
+
+Revision ID: 003_add_llm_key_weight
+Revises: 002_complete_category_migration
+Create Date: 2026-10-17 09:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision: str = '003_add_llm_key_weight'
+down_revision: Union[str, None] = '002_complete_category_migration'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # Thêm cột weight (mặc định 1 → các key hiện có giữ round-robin đều)
+    op.add_column('llm_key', sa.Column('weight', sa.Integer(), nullable=False, server_default='1'))
+
+
+def downgrade() -> None:
+    op.drop_column('llm_key', 'weight')
@@ -1,16 +1,19 @@
 import os
 import asyncio
+import time
 import google.generativeai as genai
 from typing import List, Union
-from openai import AsyncOpenAI
+from config.llm_clients import get_openai_client, get_gemini_client
+from llm.help_key_health import record_key_success, record_key_failure
 import numpy as np
 
 async def get_embedding_gemini(
     text_input: Union[str, List[str]], 
     api_key: str
 ) -> Union[List[float], List[List[float]]]:
+    started = time.perf_counter()
     try:
-        genai.configure(api_key=api_key)
+        client = get_gemini_client(api_key)
         loop = asyncio.get_event_loop()
         is_single = isinstance(text_input, str)
         text_list = [text_input] if is_single else text_input
@@ -22,7 +25,8 @@ async def get_embedding_gemini(
             def embed_call(content_batch):
                 return genai.embed_content(
                     model="models/text-embedding-001", 
-                    content=content_batch
+                    content=content_batch,
+                    client=client
                 )
 
             response = await loop.run_in_executor(None, embed_call, batch)
@@ -34,6 +38,8 @@ async def get_embedding_gemini(
             
             print(f"Đã gửi batch {i+1}/{len(batches)}, số vector nhận được: {len(all_embeddings)}")
 
+        await record_key_success(api_key, (time.perf_counter() - started) * 1000)
+
         if is_single:
             return all_embeddings[0] if all_embeddings else []
         
@@ -41,6 +47,7 @@ async def get_embedding_gemini(
 
     except Exception as e:
         print(f"❌ Gemini embedding error: {e}")
+        await record_key_failure(api_key, e, (time.perf_counter() - started) * 1000)
         return [] if isinstance(text_input, list) else []
 
 
@@ -49,8 +56,9 @@ async def get_embedding_chatgpt(
     api_key: str
 ) -> Union[List[float], List[List[float]]]:
 
+    started = time.perf_counter()
     try:
-        client = AsyncOpenAI(api_key=api_key)
+        client = get_openai_client(api_key)
 
         is_single = isinstance(text_input, str)
         text_list = [text_input] if is_single else text_input
@@ -67,10 +75,13 @@ async def get_embedding_chatgpt(
             all_embeddings.extend([list(item.embedding) for item in response.data])
             print(f"Đã gửi batch, số vector nhận được: {len(all_embeddings)}")
 
+        await record_key_success(api_key, (time.perf_counter() - started) * 1000)
+
         if is_single:
             return all_embeddings[0] if all_embeddings else []
         return all_embeddings
 
     except Exception as e:
         print(f"❌ ChatGPT embedding error: {e}")
+        await record_key_failure(api_key, e, (time.perf_counter() - started) * 1000)
         return [] if isinstance(text_input, list) else []
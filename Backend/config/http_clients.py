@@ -0,0 +1,118 @@
+"""
+HTTP client dùng chung để gửi tin nhắn ra Facebook / Telegram / Zalo
+- Mỗi nền tảng 1 httpx.AsyncClient (connection pool keep-alive theo host), không block event loop
+- Timeout rõ ràng cho connect / read / write / lấy connection từ pool
+- Retry với backoff lũy thừa + jitter khi gặp 429 / 5xx, hoặc lỗi kết nối khi request chưa được gửi
+  (không retry khi đã gửi xong mà timeout đọc response, tránh gửi trùng tin nhắn)
+"""
+
+import asyncio
+import logging
+import os
+import random
+from typing import Dict, Optional
+import httpx
+
+logger = logging.getLogger(__name__)
+
+
+# Base URL theo nền tảng (đổi được để test với mock server)
+FACEBOOK_GRAPH_URL = os.getenv("FACEBOOK_GRAPH_URL", "https://graph.facebook.com")
+TELEGRAM_API_URL = os.getenv("TELEGRAM_API_URL", "https://api.telegram.org")
+ZALO_API_URL = os.getenv("ZALO_API_URL", "https://openapi.zalo.me")
+
+SOCIAL_HTTP_CONNECT_TIMEOUT = float(os.getenv("SOCIAL_HTTP_CONNECT_TIMEOUT", 5))
+SOCIAL_HTTP_READ_TIMEOUT = float(os.getenv("SOCIAL_HTTP_READ_TIMEOUT", 15))
+SOCIAL_HTTP_MAX_CONNECTIONS = int(os.getenv("SOCIAL_HTTP_MAX_CONNECTIONS", 50))
+SOCIAL_HTTP_MAX_KEEPALIVE = int(os.getenv("SOCIAL_HTTP_MAX_KEEPALIVE", 20))
+# Số lần thử lại và thời gian chờ cơ sở / tối đa (giây) giữa các lần
+SOCIAL_HTTP_MAX_RETRIES = int(os.getenv("SOCIAL_HTTP_MAX_RETRIES", 3))
+SOCIAL_HTTP_BACKOFF_BASE = float(os.getenv("SOCIAL_HTTP_BACKOFF_BASE", 0.5))
+SOCIAL_HTTP_BACKOFF_MAX = float(os.getenv("SOCIAL_HTTP_BACKOFF_MAX", 8))
+
+RETRY_STATUS_CODES = {429, 500, 502, 503, 504}
+# Lỗi xảy ra trước khi request tới được server → retry an toàn
+RETRY_EXCEPTIONS = (httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout)
+
+_clients: Dict[str, httpx.AsyncClient] = {}
+
+
+def get_platform_client(platform: str) -> httpx.AsyncClient:
+    """
+    Client theo nền tảng ("facebook", "telegram", "zalo", "media" cho tải ảnh từ URL bất kỳ)
+    """
+    client = _clients.get(platform)
+    if client is None or client.is_closed:
+        client = httpx.AsyncClient(
+            timeout=httpx.Timeout(
+                SOCIAL_HTTP_READ_TIMEOUT,
+                connect=SOCIAL_HTTP_CONNECT_TIMEOUT,
+                pool=SOCIAL_HTTP_CONNECT_TIMEOUT
+            ),
+            limits=httpx.Limits(
+                max_connections=SOCIAL_HTTP_MAX_CONNECTIONS,
+                max_keepalive_connections=SOCIAL_HTTP_MAX_KEEPALIVE
+            ),
+            follow_redirects=(platform == "media")
+        )
+        _clients[platform] = client
+    return client
+
+
+def _retry_delay(attempt: int, response: Optional[httpx.Response] = None) -> float:
+    # Tôn trọng Retry-After (giây) nếu server trả về
+    if response is not None:
+        retry_after = response.headers.get("retry-after")
+        if retry_after and retry_after.isdigit():
+            return min(float(retry_after), SOCIAL_HTTP_BACKOFF_MAX)
+    # Full jitter
+    return random.uniform(0, min(SOCIAL_HTTP_BACKOFF_MAX, SOCIAL_HTTP_BACKOFF_BASE * 2 ** attempt))
+
+
+async def request_with_retry(
+    platform: str,
+    method: str,
+    url: str,
+    max_retries: Optional[int] = None,
+    **kwargs
+) -> httpx.Response:
+    """
+    Gửi request qua client của nền tảng, retry khi 429 / 5xx / lỗi kết nối
+
+    Returns:
+        httpx.Response: response cuối cùng (có thể vẫn là lỗi sau khi hết số lần retry)
+
+    Raises:
+        httpx.HTTPError: lỗi mạng không retry được hoặc đã hết số lần retry
+    """
+    client = get_platform_client(platform)
+    max_retries = SOCIAL_HTTP_MAX_RETRIES if max_retries is None else max_retries
+
+    attempt = 0
+    while True:
+        try:
+            response = await client.request(method, url, **kwargs)
+        except RETRY_EXCEPTIONS as e:
+            if attempt >= max_retries:
+                raise
+            delay = _retry_delay(attempt)
+            logger.warning(f"[{platform}] {type(e).__name__}, retry {attempt + 1}/{max_retries} sau {delay:.2f}s")
+        else:
+            if response.status_code not in RETRY_STATUS_CODES or attempt >= max_retries:
+                return response
+            delay = _retry_delay(attempt, response)
+            logger.warning(
+                f"[{platform}] HTTP {response.status_code}, retry {attempt + 1}/{max_retries} sau {delay:.2f}s"
+            )
+
+        attempt += 1
+        await asyncio.sleep(delay)
+
+
+async def close_all() -> None:
+    for client in _clients.values():
+        try:
+            await client.aclose()
+        except Exception as e:
+            logger.error(f"Error closing HTTP client: {e}")
+    _clients.clear()
@@ -0,0 +1,157 @@
+"""
+Registry client LLM / embedding dùng chung
+- Key = (provider, api_key), client được tạo lazy và dùng lại giữa các request
+  → giữ connection pool keep-alive / phiên TLS thay vì tạo mới mỗi tin nhắn
+- Không dùng genai.configure (thay đổi state global, race khi xoay vòng key)
+- Client không được dùng quá LLM_CLIENT_IDLE_TTL giây sẽ bị đóng và xóa khỏi registry
+"""
+
+import asyncio
+import logging
+import os
+import time
+from typing import Any, Dict, Tuple
+import httpx
+from openai import AsyncOpenAI
+from google.ai import generativelanguage as glm
+from google.api_core import client_options as client_options_lib
+
+logger = logging.getLogger(__name__)
+
+
+# Thời gian (giây) client không được dùng trước khi bị đóng
+LLM_CLIENT_IDLE_TTL = int(os.getenv("LLM_CLIENT_IDLE_TTL", 900))
+# Chu kỳ (giây) quét client idle
+LLM_CLIENT_SWEEP_INTERVAL = int(os.getenv("LLM_CLIENT_SWEEP_INTERVAL", 60))
+# Connection pool cho OpenAI
+OPENAI_MAX_CONNECTIONS = int(os.getenv("OPENAI_MAX_CONNECTIONS", 100))
+OPENAI_MAX_KEEPALIVE = int(os.getenv("OPENAI_MAX_KEEPALIVE", 20))
+OPENAI_TIMEOUT = float(os.getenv("OPENAI_TIMEOUT", 60))
+
+
+class LLMClientRegistry:
+    _instance = None
+
+    def __new__(cls):
+        if cls._instance is None:
+            cls._instance = super(LLMClientRegistry, cls).__new__(cls)
+            cls._instance._initialized = False
+        return cls._instance
+
+    def __init__(self):
+        if self._initialized:
+            return
+        # key = (provider, api_key), value = {"client", "last_used"}
+        self._clients: Dict[Tuple[str, str], Dict[str, Any]] = {}
+        self._last_sweep = time.monotonic()
+        self._initialized = True
+
+    # ================== FACTORIES ==================
+    @staticmethod
+    def _create_openai(api_key: str) -> AsyncOpenAI:
+        http_client = httpx.AsyncClient(
+            limits=httpx.Limits(
+                max_connections=OPENAI_MAX_CONNECTIONS,
+                max_keepalive_connections=OPENAI_MAX_KEEPALIVE,
+            ),
+            timeout=OPENAI_TIMEOUT,
+        )
+        return AsyncOpenAI(api_key=api_key, http_client=http_client)
+
+    @staticmethod
+    def _create_gemini_async(api_key: str):
+        return glm.GenerativeServiceAsyncClient(
+            client_options=client_options_lib.ClientOptions(api_key=api_key)
+        )
+
+    @staticmethod
+    def _create_gemini_sync(api_key: str):
+        return glm.GenerativeServiceClient(
+            client_options=client_options_lib.ClientOptions(api_key=api_key)
+        )
+
+    # ================== REGISTRY ==================
+    def _get(self, provider: str, api_key: str, factory):
+        self._maybe_sweep()
+
+        cache_key = (provider, api_key)
+        entry = self._clients.get(cache_key)
+        if entry is None:
+            entry = {"client": factory(api_key), "last_used": time.monotonic()}
+            self._clients[cache_key] = entry
+            logger.info(f"Created {provider} client (total clients: {len(self._clients)})")
+        entry["last_used"] = time.monotonic()
+        return entry["client"]
+
+    def get_openai(self, api_key: str) -> AsyncOpenAI:
+        return self._get("openai", api_key, self._create_openai)
+
+    def get_gemini_async(self, api_key: str):
+        return self._get("gemini_async", api_key, self._create_gemini_async)
+
+    def get_gemini_sync(self, api_key: str):
+        return self._get("gemini_sync", api_key, self._create_gemini_sync)
+
+    def _maybe_sweep(self) -> None:
+        now = time.monotonic()
+        if now - self._last_sweep < LLM_CLIENT_SWEEP_INTERVAL:
+            return
+        self._last_sweep = now
+
+        idle = [k for k, e in self._clients.items() if now - e["last_used"] > LLM_CLIENT_IDLE_TTL]
+        for cache_key in idle:
+            entry = self._clients.pop(cache_key)
+            self._close(cache_key[0], entry["client"])
+        if idle:
+            logger.info(f"Evicted {len(idle)} idle LLM clients")
+
+    @staticmethod
+    def _close(provider: str, client) -> None:
+        try:
+            if provider == "gemini_sync":
+                client.transport.close()
+                return
+
+            coro = client.close() if provider == "openai" else client.transport.close()
+            try:
+                asyncio.get_running_loop().create_task(coro)
+            except RuntimeError:
+                coro.close()
+        except Exception as e:
+            logger.error(f"Error closing {provider} client: {e}")
+
+    async def close_all(self) -> None:
+        for (provider, _), entry in list(self._clients.items()):
+            client = entry["client"]
+            try:
+                if provider == "gemini_sync":
+                    client.transport.close()
+                elif provider == "openai":
+                    await client.close()
+                else:
+                    await client.transport.close()
+            except Exception as e:
+                logger.error(f"Error closing {provider} client: {e}")
+        self._clients.clear()
+
+    def stats(self) -> dict:
+        counts: Dict[str, int] = {}
+        for provider, _ in self._clients:
+            counts[provider] = counts.get(provider, 0) + 1
+        return {"total": len(self._clients), "by_provider": counts}
+
+
+# ================== SINGLETON + HELPERS ==================
+llm_clients = LLMClientRegistry()
+
+
+def get_openai_client(api_key: str) -> AsyncOpenAI:
+    return llm_clients.get_openai(api_key)
+
+
+def get_gemini_async_client(api_key: str):
+    return llm_clients.get_gemini_async(api_key)
+
+
+def get_gemini_client(api_key: str):
+    return llm_clients.get_gemini_sync(api_key)
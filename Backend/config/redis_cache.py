@@ -2,7 +2,7 @@ import redis
 import json
 import asyncio
 from redis import asyncio as aioredis
-from typing import Any, Optional
+from typing import Any, Dict, List, Optional
 from dotenv import load_dotenv
 import os
 import logging
@@ -24,6 +24,8 @@ class RedisCache:
         self._sync_client: Optional[redis.Redis] = None
         # Async Redis client
         self._async_client: Optional[aioredis.Redis] = None
+        # Async Redis client không decode (dùng cho dữ liệu nhị phân, vd: vector embedding)
+        self._async_binary_client: Optional[aioredis.Redis] = None
 
         # Default TTL (Time To Live) - 1 hour
         self.default_ttl = int(os.getenv("REDIS_DEFAULT_TTL", 3600))
@@ -72,6 +74,25 @@ class RedisCache:
                 self._async_client = None
         return self._async_client
 
+    async def get_async_binary_client(self) -> aioredis.Redis:
+        if self._async_binary_client is None:
+            try:
+                self._async_binary_client = aioredis.from_url(
+                    self.redis_url,
+                    password=self.redis_password,
+                    decode_responses=False,
+                    socket_connect_timeout=5,
+                    socket_timeout=5,
+                    retry_on_timeout=True,
+                    health_check_interval=30,
+                )
+                await self._async_binary_client.ping()
+                logger.info("Redis async binary connection established successfully")
+            except Exception as e:
+                logger.error(f"Failed to connect to Redis async binary: {e}")
+                self._async_binary_client = None
+        return self._async_binary_client
+
     # ================== SYNC OPERATIONS ==================
     def set(self, key: str, value: Any, ttl: Optional[int] = None) -> bool:
         try:
@@ -182,6 +203,47 @@ class RedisCache:
             logger.error(f"Error async checking cache key {key}: {e}")
             return False
 
+    async def async_get_many(self, keys: List[str]) -> List[Optional[Any]]:
+        """MGET nhiều key trong 1 round-trip, key không có trả về None"""
+        if not keys:
+            return []
+        try:
+            client = await self.get_async_client()
+            if client is None:
+                return [None] * len(keys)
+
+            values = []
+            for value in await client.mget(keys):
+                try:
+                    values.append(json.loads(value) if value is not None else None)
+                except json.JSONDecodeError:
+                    values.append(value)
+            return values
+        except Exception as e:
+            logger.error(f"Error async getting {len(keys)} cache keys: {e}")
+            return [None] * len(keys)
+
+    async def async_set_many(self, mapping: Dict[str, Any], ttl: Optional[int] = None) -> bool:
+        """SETEX nhiều key trong 1 pipeline"""
+        if not mapping:
+            return True
+        try:
+            client = await self.get_async_client()
+            if client is None:
+                return False
+
+            ttl = ttl or self.default_ttl
+            pipe = client.pipeline(transaction=False)
+            for key, value in mapping.items():
+                if not isinstance(value, str):
+                    value = json.dumps(value, ensure_ascii=False)
+                pipe.setex(key, ttl, value)
+            await pipe.execute()
+            return True
+        except Exception as e:
+            logger.error(f"Error async setting {len(mapping)} cache keys: {e}")
+            return False
+
 
 # ================== SINGLETON + HELPERS ==================
 redis_cache = RedisCache()
@@ -218,6 +280,14 @@ async def async_cache_delete(key: str) -> bool:
 async def async_cache_exists(key: str) -> bool:
     return await redis_cache.async_exists(key)
 
+
+async def async_cache_get_many(keys: List[str]) -> List[Optional[Any]]:
+    return await redis_cache.async_get_many(keys)
+
+
+async def async_cache_set_many(mapping: Dict[str, Any], ttl: Optional[int] = None) -> bool:
+    return await redis_cache.async_set_many(mapping, ttl)
+
 async def async_cache_delete_pattern(pattern: str) -> bool:
     """
     Xóa tất cả key match pattern (dùng scan để không block Redis)
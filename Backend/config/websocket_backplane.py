@@ -0,0 +1,228 @@
+"""
+Backplane Redis pub/sub cho WebSocket khi chạy nhiều worker / container
+- ConnectionManager gửi tới socket ở worker hiện tại, rồi publish lên Redis:
+  tin cho admin → kênh ws:admins, tin cho customer → kênh ws:session:{id}
+- Mỗi worker subscribe ws:admins và relay tới socket của mình
+  (bỏ qua tin do chính worker publish vì đã gửi trực tiếp) → không cần sticky routing
+- Kênh ws:session:{id} chỉ được subscribe khi session có socket customer đầu tiên ở worker,
+  unsubscribe khi mất socket cuối → worker không phải nhận / parse tin của mọi session
+- Đo độ trễ end-to-end: từ lúc publish tới lúc worker nhận đã gửi xong tới socket
+- Redis lỗi → vẫn gửi được trong worker hiện tại, listener tự kết nối lại
+"""
+
+import asyncio
+import logging
+import os
+import socket
+import time
+import uuid
+import orjson
+from collections import deque
+from typing import Optional, Set
+from config.redis_cache import redis_cache
+from config.websocket_manager import ConnectionManager, encode_json
+
+logger = logging.getLogger(__name__)
+
+
+WS_BACKPLANE_ENABLED = os.getenv("WS_BACKPLANE_ENABLED", "true").lower() == "true"
+
+ADMIN_CHANNEL = "ws:admins"
+SESSION_CHANNEL_PREFIX = "ws:session:"
+
+
+def get_session_channel(session_id: int) -> str:
+    return f"{SESSION_CHANNEL_PREFIX}{session_id}"
+
+
+class WebSocketBackplane:
+
+    def __init__(self, manager: ConnectionManager):
+        self.manager = manager
+        self.worker_id = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:6]}"
+        self._listener: Optional[asyncio.Task] = None
+        self._ready = asyncio.Event()
+        # Pubsub của listener hiện tại + các session đang subscribe trên đó
+        self._pubsub = None
+        self._session_channels: Set[int] = set()
+        # Subscribe / unsubscribe tuần tự, mỗi lần đối chiếu với manager.customers lúc chạy
+        self._subscription_lock = asyncio.Lock()
+        self._unwatch_tasks: Set[asyncio.Task] = set()
+        # Độ trễ publish → gửi xong tới socket ở worker khác (ms) của các tin gần nhất
+        self._latencies = deque(maxlen=1000)
+        self._stats = {
+            "published": 0,
+            "publish_errors": 0,
+            "relayed": 0,
+            "skipped_own": 0,
+            "skipped_no_socket": 0,
+            "subscribe_errors": 0
+        }
+
+    async def start(self) -> None:
+        if not WS_BACKPLANE_ENABLED or self._listener is not None:
+            return
+        self.manager.backplane = self
+        self._listener = asyncio.create_task(self._listen())
+
+    async def stop(self) -> None:
+        if self.manager.backplane is self:
+            self.manager.backplane = None
+        if self._listener is not None:
+            self._listener.cancel()
+            await asyncio.gather(self._listener, return_exceptions=True)
+            self._listener = None
+        self._ready.clear()
+        self._pubsub = None
+        self._session_channels.clear()
+
+    async def wait_ready(self, timeout: float = 5.0) -> bool:
+        try:
+            await asyncio.wait_for(self._ready.wait(), timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+
+    async def _publish(self, pubsub_channel: str, message, stream_only: bool, channel: Optional[str] = None) -> None:
+        try:
+            client = await redis_cache.get_async_client()
+            if client is None:
+                self._stats["publish_errors"] += 1
+                return
+            envelope = encode_json({
+                "origin": self.worker_id,
+                "sent_at": time.time(),
+                "stream_only": stream_only,
+                # Kênh của session (web / facebook / ...) để worker nhận lọc theo topic admin
+                "channel": channel,
+                "message": message
+            })
+            await client.publish(pubsub_channel, envelope)
+            self._stats["published"] += 1
+        except Exception as e:
+            self._stats["publish_errors"] += 1
+            logger.error(f"Error publishing WebSocket message to {pubsub_channel}: {e}")
+
+    async def publish_to_admins(self, message, stream_only: bool = False, channel: Optional[str] = None) -> None:
+        await self._publish(ADMIN_CHANNEL, message, stream_only, channel=channel)
+
+    async def publish_to_session(self, session_id: int, message, stream_only: bool = False) -> None:
+        await self._publish(get_session_channel(session_id), message, stream_only)
+
+    async def watch_session(self, session_id: int) -> None:
+        """
+        Gọi khi session có socket customer đầu tiên ở worker này
+        """
+        await self._sync_session(session_id)
+
+    def unwatch_session(self, session_id: int) -> None:
+        """
+        Gọi khi session mất socket customer cuối ở worker này (chạy nền)
+        """
+        task = asyncio.create_task(self._sync_session(session_id))
+        self._unwatch_tasks.add(task)
+        task.add_done_callback(self._unwatch_tasks.discard)
+
+    async def _sync_session(self, session_id: int) -> None:
+        async with self._subscription_lock:
+            pubsub = self._pubsub
+            if pubsub is None:
+                # Listener đang kết nối lại, sẽ subscribe theo manager.customers
+                return
+            wanted = session_id in self.manager.customers
+            if wanted == (session_id in self._session_channels):
+                return
+            try:
+                if wanted:
+                    await pubsub.subscribe(get_session_channel(session_id))
+                    self._session_channels.add(session_id)
+                else:
+                    await pubsub.unsubscribe(get_session_channel(session_id))
+                    self._session_channels.discard(session_id)
+            except Exception as e:
+                self._stats["subscribe_errors"] += 1
+                logger.error(f"[backplane] Error updating subscription of session {session_id}: {e}")
+
+    async def _relay(self, channel: str, data: str) -> None:
+        envelope = orjson.loads(data)
+        if envelope.get("origin") == self.worker_id:
+            self._stats["skipped_own"] += 1
+            return
+
+        message = envelope.get("message")
+        stream_only = bool(envelope.get("stream_only"))
+        if channel == ADMIN_CHANNEL:
+            if not self.manager.admins:
+                self._stats["skipped_no_socket"] += 1
+                return
+            await self.manager.deliver_local_admins(message, stream_only=stream_only, channel=envelope.get("channel"))
+        else:
+            session_id = int(channel[len(SESSION_CHANNEL_PREFIX):])
+            if session_id not in self.manager.customers:
+                self._stats["skipped_no_socket"] += 1
+                return
+            await self.manager.deliver_local_customer(session_id, message, stream_only=stream_only)
+
+        self._stats["relayed"] += 1
+        self._latencies.append((time.time() - float(envelope.get("sent_at") or 0)) * 1000)
+
+    async def _listen(self) -> None:
+        while True:
+            pubsub = None
+            try:
+                client = await redis_cache.get_async_client()
+                if client is None:
+                    await asyncio.sleep(1)
+                    continue
+                pubsub = client.pubsub()
+                async with self._subscription_lock:
+                    sessions = set(self.manager.customers)
+                    await pubsub.subscribe(ADMIN_CHANNEL, *[get_session_channel(sid) for sid in sessions])
+                    self._pubsub = pubsub
+                    self._session_channels = sessions
+                self._ready.set()
+                logger.info(f"[backplane] Worker {self.worker_id} subscribed")
+
+                while True:
+                    item = await pubsub.get_message(ignore_subscribe_messages=True, timeout=1.0)
+                    if item is None:
+                        continue
+                    try:
+                        # Relay tuần tự để giữ thứ tự tin nhắn
+                        await self._relay(item["channel"], item["data"])
+                    except Exception as e:
+                        logger.error(f"[backplane] Error relaying message from {item.get('channel')}: {e}")
+
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"[backplane] Listener error, reconnecting: {e}")
+                self._ready.clear()
+                await asyncio.sleep(1)
+            finally:
+                if self._pubsub is pubsub:
+                    self._pubsub = None
+                    self._session_channels = set()
+                if pubsub is not None:
+                    try:
+                        await pubsub.aclose()
+                    except Exception:
+                        pass
+
+    def get_stats(self) -> dict:
+        latencies = sorted(self._latencies)
+        return {
+            **self._stats,
+            "enabled": WS_BACKPLANE_ENABLED,
+            "worker_id": self.worker_id,
+            "subscribed": self._ready.is_set(),
+            "subscribed_sessions": len(self._session_channels),
+            "latency_ms": {
+                "p50": round(latencies[len(latencies) // 2], 2) if latencies else None,
+                "p95": round(latencies[int(len(latencies) * 0.95) - 1], 2) if len(latencies) >= 20 else None,
+                "max": round(latencies[-1], 2) if latencies else None
+            }
+        }
+
+
+websocket_backplane = WebSocketBackplane(ConnectionManager())
@@ -1,8 +1,232 @@
 from fastapi import WebSocket
-from typing import Dict, List
+from typing import Callable, Deque, Dict, List, Optional, Set
+from collections import deque
+import asyncio
+import os
 import json
+import time
+import orjson
+from decimal import Decimal
 from datetime import datetime
 
+
+# Số frame tối đa chờ gửi cho mỗi kết nối
+WS_SEND_QUEUE_SIZE = int(os.getenv("WS_SEND_QUEUE_SIZE", 256))
+# Thời gian tối đa (giây) cho 1 lần gửi, quá thì coi là client chậm
+WS_SEND_TIMEOUT = float(os.getenv("WS_SEND_TIMEOUT", 10))
+# Xử lý client chậm khi hàng đợi đầy:
+# - coalesce: gộp frame bot_delta cùng stream đang chờ, vẫn đầy thì ngắt kết nối
+# - drop: ngắt kết nối ngay
+WS_SLOW_CONSUMER_POLICY = os.getenv("WS_SLOW_CONSUMER_POLICY", "coalesce").lower()
+
+# Code đóng WebSocket khi client chậm (1013 = Try Again Later)
+SLOW_CONSUMER_CLOSE_CODE = 1013
+
+# Chu kỳ gửi frame {"type": "ping"} (giây), 0 = tắt heartbeat
+WS_HEARTBEAT_INTERVAL = float(os.getenv("WS_HEARTBEAT_INTERVAL", 25))
+# Kết nối dùng heartbeat không gửi gì (pong / tin nhắn) quá thời gian này (giây) → ngắt kết nối
+WS_IDLE_TIMEOUT = float(os.getenv("WS_IDLE_TIMEOUT", 75))
+# Code đóng WebSocket khi client không phản hồi (1001 = Going Away)
+IDLE_CLOSE_CODE = 1001
+# Số session nhiều kết nối nhất trả về trong thống kê
+WS_STATS_TOP_SESSIONS = int(os.getenv("WS_STATS_TOP_SESSIONS", 20))
+
+# Topic admin đăng ký trên /chat/ws/admin:
+# - "*": mọi tin (mặc định khi mới kết nối, giữ tương thích client cũ)
+# - "session:{id}" / "channel:{web|facebook|telegram|zalo}": mọi tin của session / kênh
+# - "summary": bản tóm tắt tin nhắn + sự kiện session (cho danh sách hội thoại)
+ALL_TOPIC = "*"
+SUMMARY_TOPIC = "summary"
+ADMIN_CHANNELS = ("web", "facebook", "telegram", "zalo")
+# Số ký tự nội dung giữ lại trong frame tóm tắt
+SUMMARY_PREVIEW_CHARS = int(os.getenv("WS_SUMMARY_PREVIEW_CHARS", 120))
+
+
+def session_topic(session_id: int) -> str:
+    return f"session:{session_id}"
+
+
+def channel_topic(channel: str) -> str:
+    return f"channel:{channel}"
+
+
+def _parse_session_id(value) -> Optional[int]:
+    """Session id từ frame của admin: số nguyên dương hoặc chuỗi số, còn lại → None"""
+    if isinstance(value, bool):
+        return None
+    if isinstance(value, str) and value.strip().isdigit():
+        value = int(value)
+    if isinstance(value, int) and value > 0:
+        return value
+    return None
+
+
+def build_summary_frame(message: dict, channel: Optional[str]) -> dict:
+    """Tin nhắn → frame tóm tắt; sự kiện session (update / xóa) gửi nguyên vẹn vì đã gọn"""
+    if "sender_type" not in message:
+        return message
+    content = message.get("content")
+    return {
+        "type": "session_summary",
+        "chat_session_id": message.get("chat_session_id"),
+        "session_name": message.get("session_name"),
+        "session_status": message.get("session_status"),
+        "channel": channel,
+        "sender_type": message.get("sender_type"),
+        "last_message": content[:SUMMARY_PREVIEW_CHARS] if isinstance(content, str) else content,
+        "created_at": message.get("created_at")
+    }
+
+
+# Thời gian mã hóa JSON các frame gửi qua WebSocket (mỗi frame chỉ mã hóa 1 lần)
+encode_stats = {
+    "frames": 0,
+    "ms_total": 0.0
+}
+
+
+def _json_default(value):
+    # orjson tự xử lý datetime / date / UUID; Decimal → số, kiểu khác → chuỗi
+    if isinstance(value, Decimal):
+        return float(value)
+    return str(value)
+
+
+def encode_json(data) -> str:
+    """
+    Mã hóa JSON như WebSocket.send_json (UTF-8, giữ nguyên tiếng Việt) nhưng nhanh hơn,
+    datetime → chuỗi ISO 8601 giống datetime.isoformat()
+    """
+    return orjson.dumps(data, default=_json_default, option=orjson.OPT_NON_STR_KEYS).decode()
+
+
+class EncodedFrame:
+    """
+    1 tin gửi cho nhiều kết nối: mã hóa JSON 1 lần khi writer đầu tiên gửi,
+    các kết nối còn lại dùng lại chuỗi đã mã hóa
+    """
+    __slots__ = ("message", "_text")
+
+    def __init__(self, message, text: Optional[str] = None):
+        self.message = message
+        # Frame đọc lại từ replay buffer đã có sẵn JSON
+        self._text = text
+
+    @property
+    def text(self) -> str:
+        if self._text is None:
+            started = time.perf_counter()
+            self._text = encode_json(self.message)
+            encode_stats["frames"] += 1
+            encode_stats["ms_total"] += (time.perf_counter() - started) * 1000
+        return self._text
+
+
+class SocketSender:
+    """
+    Hàng đợi gửi + writer task riêng cho 1 kết nối
+    - Gửi tới nhiều kết nối chỉ là đưa frame vào hàng đợi → 1 client chậm không làm chậm client khác
+    - Giữ thứ tự frame trong từng kết nối
+    """
+
+    def __init__(self, websocket: WebSocket, on_drop: Callable[[WebSocket], None], stats: dict, paused: bool = False):
+        self.websocket = websocket
+        self.queue: Deque[EncodedFrame] = deque()
+        self.closed = False
+        self._on_drop = on_drop
+        self._stats = stats
+        self._slow = False
+        # Tạm giữ frame mới trong lúc đọc replay buffer, gửi sau các frame replay
+        self._paused = paused
+        self._wakeup = asyncio.Event()
+        self._task = asyncio.create_task(self._run())
+
+    def enqueue(self, frame: EncodedFrame) -> None:
+        if self.closed:
+            return
+        if self._coalesce(frame.message):
+            self._stats["coalesced"] += 1
+            return
+        if len(self.queue) >= WS_SEND_QUEUE_SIZE:
+            self._mark_slow()
+            return
+        self.queue.append(frame)
+        self._stats["queued"] += 1
+        self._stats["max_queue_depth"] = max(self._stats["max_queue_depth"], len(self.queue))
+        if not self._paused:
+            self._wakeup.set()
+
+    def resume(self, replay: List[EncodedFrame], last_seq: int) -> None:
+        """Gửi các frame replay trước, bỏ frame mới đã có trong phần replay (session_seq <= last_seq)"""
+        def replayed(frame: EncodedFrame) -> bool:
+            seq = frame.message.get("session_seq") if isinstance(frame.message, dict) else None
+            return seq is not None and seq <= last_seq
+
+        self.queue = deque(replay + [frame for frame in self.queue if not replayed(frame)])
+        self._paused = False
+        self._wakeup.set()
+
+    def _coalesce(self, message) -> bool:
+        """Gộp frame bot_delta vào frame cùng stream đang chờ ở cuối hàng đợi"""
+        if WS_SLOW_CONSUMER_POLICY != "coalesce" or not self.queue:
+            return False
+        last = self.queue[-1].message
+        if not (isinstance(message, dict) and isinstance(last, dict)):
+            return False
+        if message.get("type") != "bot_delta" or last.get("type") != "bot_delta" \
+                or message.get("stream_id") != last.get("stream_id"):
+            return False
+        # seq lấy theo frame mới nhất, delta nối tiếp nên client vẫn ghép đúng nội dung
+        self.queue[-1] = EncodedFrame({**last, "seq": message.get("seq"), "delta": last.get("delta", "") + message.get("delta", "")})
+        return True
+
+    def _mark_slow(self) -> None:
+        self.closed = True
+        self._slow = True
+        self.queue.clear()
+        self._wakeup.set()
+
+    async def _run(self) -> None:
+        try:
+            while True:
+                await self._wakeup.wait()
+                self._wakeup.clear()
+                while self.queue:
+                    frame = self.queue.popleft()
+                    try:
+                        await asyncio.wait_for(self.websocket.send_text(frame.text), WS_SEND_TIMEOUT)
+                        self._stats["sent"] += 1
+                    except asyncio.TimeoutError:
+                        self._slow = True
+                        break
+                    except Exception:
+                        self._stats["send_errors"] += 1
+                        self._drop()
+                        return
+                if self._slow:
+                    self._stats["slow_consumers_dropped"] += 1
+                    print(f"⚠️ WebSocket client chậm (hàng đợi đầy / gửi quá {WS_SEND_TIMEOUT}s), ngắt kết nối")
+                    self._drop()
+                    try:
+                        await self.websocket.close(code=SLOW_CONSUMER_CLOSE_CODE)
+                    except Exception:
+                        pass
+                    return
+        except asyncio.CancelledError:
+            pass
+
+    def _drop(self) -> None:
+        self.closed = True
+        self.queue.clear()
+        self._on_drop(self.websocket)
+
+    def close(self) -> None:
+        self.closed = True
+        self.queue.clear()
+        if self._task is not asyncio.current_task():
+            self._task.cancel()
+
+
 class ConnectionManager:
     """
     ✅ Singleton ConnectionManager để quản lý tất cả WebSocket connections
@@ -20,82 +244,369 @@ class ConnectionManager:
     def __init__(self):
         if self._initialized:
             return
-        # Key = session_id, value =  dict list các websocket của customer trong session
-        self.customers: Dict[int, List[WebSocket]] = {}
-        # Admin có thể xem tất cả session  --> danh sách các kết nối websocket của admin
-        self.admins: List[WebSocket] = []
+        # Key = session_id, value = set các websocket của customer trong session
+        # (set / dict → thêm, bỏ kết nối O(1), kể cả khi hàng nghìn widget ngắt cùng lúc)
+        self.customers: Dict[int, Set[WebSocket]] = {}
+        # Admin có thể xem tất cả session  --> set các kết nối websocket của admin
+        self.admins: Set[WebSocket] = set()
+        # Các kết nối đăng ký nhận frame stream (bot_delta), client cũ không nhận
+        self.stream_sockets: Set[WebSocket] = set()
         self.active_connections: list[WebSocket] = []
+        # Hàng đợi gửi của từng kết nối customer / admin
+        self.senders: Dict[WebSocket, SocketSender] = {}
+        # Index ngược: kết nối → session của customer (None = admin)
+        self.socket_sessions: Dict[WebSocket, Optional[int]] = {}
+        # Topic → các admin đăng ký, và chiều ngược lại để hủy đăng ký khi ngắt kết nối
+        self.admin_topics: Dict[str, Set[WebSocket]] = {}
+        self.admin_subscriptions: Dict[WebSocket, Set[str]] = {}
+        # Kết nối dùng heartbeat (?heartbeat=1 hoặc tự gửi ping) → lần cuối nhận được frame
+        # Client cũ không nhận frame ping (sẽ hiện thành tin nhắn) và chỉ bị bỏ khi gửi lỗi
+        self.last_seen: Dict[WebSocket, float] = {}
+        self._heartbeat_task: Optional[asyncio.Task] = None
+        self.heartbeat_stats = {
+            "pings_sent": 0,
+            "idle_evicted": 0
+        }
+        self.send_stats = {
+            "queued": 0,
+            "sent": 0,
+            "coalesced": 0,
+            "send_errors": 0,
+            "slow_consumers_dropped": 0,
+            "max_queue_depth": 0
+        }
+        # Backplane Redis pub/sub (config/websocket_backplane.py) để gửi tới socket ở worker khác
+        self.backplane = None
+        # Replay buffer (config/websocket_replay.py): đánh số frame theo session, gửi lại khi kết nối lại
+        self.replay_buffer = None
         self._initialized = True
 
-    async def connect_customer(self, websocket: WebSocket, session_id : int):
+    async def connect_customer(
+        self,
+        websocket: WebSocket,
+        session_id : int,
+        stream: bool = False,
+        heartbeat: bool = False,
+        since: Optional[int] = None
+    ):
+        """
+        since: session_seq cuối client đã nhận → gửi lại các frame bị lỡ trước frame mới
+        """
         await websocket.accept()
-        if session_id not in self.customers:
-            self.customers[session_id] = []
-        self.customers[session_id].append(websocket)
+        if self.replay_buffer is not None:
+            # Từ đây frame của session mới được đánh số / lưu để gửi lại
+            await self.replay_buffer.track_session(session_id)
+        if since is not None:
+            # Tạo hàng đợi tạm dừng trước khi đăng ký để không mất / đảo thứ tự frame mới
+            self.senders[websocket] = SocketSender(websocket, self._drop_socket, self.send_stats, paused=True)
+        sockets = self.customers.setdefault(session_id, set())
+        sockets.add(websocket)
+        self.socket_sessions[websocket] = session_id
+        if len(sockets) == 1 and self.backplane is not None:
+            # Socket đầu tiên của session ở worker này → nhận tin của session từ worker khác
+            await self.backplane.watch_session(session_id)
+        if heartbeat:
+            self._track_heartbeat(websocket)
+        if stream:
+            self.stream_sockets.add(websocket)
+        if since is not None:
+            await self._replay_missed_frames(websocket, session_id, since)
+
+    async def _replay_missed_frames(self, websocket: WebSocket, session_id: int, since: int):
+        replay, last_seq = [], since
+        try:
+            if self.replay_buffer is None:
+                replay = [EncodedFrame({"type": "replay_gap", "chat_session_id": session_id, "since": since, "latest_seq": None})]
+            else:
+                frames, gap = await self.replay_buffer.frames_since(session_id, since)
+                if gap is not None:
+                    replay = [EncodedFrame(gap)]
+                else:
+                    replay = [EncodedFrame(orjson.loads(text), text) for text in frames]
+                    if replay:
+                        last_seq = replay[-1].message["session_seq"]
+        finally:
+            sender = self.senders.get(websocket)
+            if sender is not None:
+                sender.resume(replay, last_seq)
 
-    async def connect_admin(self, websocket: WebSocket):
+    async def connect_admin(self, websocket: WebSocket, stream: bool = False, heartbeat: bool = False):
         await websocket.accept()
-        self.admins.append(websocket)
+        self.admins.add(websocket)
+        self.socket_sessions[websocket] = None
+        if heartbeat:
+            self._track_heartbeat(websocket)
+        self.subscribe_admin(websocket, [ALL_TOPIC])
+        if stream:
+            self.stream_sockets.add(websocket)
 
     def disconnect_customer(self, websocket: WebSocket, session_id: int):
-        if session_id in self.customers and websocket in self.customers[session_id]:
-            self.customers[session_id].remove(websocket)
-            if not self.customers[session_id]:
+        self._close_sender(websocket)
+        self.stream_sockets.discard(websocket)
+        sockets = self.customers.get(session_id)
+        if sockets is not None:
+            sockets.discard(websocket)
+            if not sockets:
                 del self.customers[session_id]
+                if self.backplane is not None:
+                    self.backplane.unwatch_session(session_id)
 
     def disconnect_admin(self, websocket: WebSocket):
-        if websocket in self.admins:
-            self.admins.remove(websocket)
-
-    async def send_to_customer(self, session_id: int, message):
-        if session_id in self.customers:
-            disconnected = []
-            for ws in self.customers[session_id]:
-                try:
-                    await ws.send_json(message)
-                except Exception as e:
-                    disconnected.append(ws)
-            for ws in disconnected:
-                self.customers[session_id].remove(ws)
-
-
-    async def broadcast_to_admins(self, message): 
+        self._close_sender(websocket)
+        self.stream_sockets.discard(websocket)
+        self.unsubscribe_admin(websocket, list(self.admin_subscriptions.get(websocket, ())))
+        self.admin_subscriptions.pop(websocket, None)
+        self.admins.discard(websocket)
+
+    def subscribe_admin(self, websocket: WebSocket, topics: List[str]):
+        subscriptions = self.admin_subscriptions.setdefault(websocket, set())
+        if ALL_TOPIC in subscriptions and ALL_TOPIC not in topics:
+            # Đăng ký topic cụ thể → thôi nhận mọi tin
+            self.unsubscribe_admin(websocket, [ALL_TOPIC])
+        for topic in topics:
+            subscriptions.add(topic)
+            self.admin_topics.setdefault(topic, set()).add(websocket)
+
+    def unsubscribe_admin(self, websocket: WebSocket, topics: List[str]):
+        subscriptions = self.admin_subscriptions.get(websocket)
+        if subscriptions is None:
+            return
+        for topic in topics:
+            subscriptions.discard(topic)
+            sockets = self.admin_topics.get(topic)
+            if sockets is not None:
+                sockets.discard(websocket)
+                if not sockets:
+                    del self.admin_topics[topic]
+
+    def handle_admin_subscription(self, websocket: WebSocket, data: dict) -> Optional[dict]:
         """
-        ✅ Gửi tin nhắn đến tất cả admin đang online
-        - Xử lý lỗi khi admin disconnect
+        Xử lý frame đăng ký của admin, trả về frame xác nhận (None nếu không phải frame đăng ký,
+        frame subscription_error nếu dữ liệu không hợp lệ)
+
+            {"type": "subscribe", "sessions": [12], "channels": ["facebook"], "summary": true}
+            {"type": "unsubscribe", "sessions": [12]}
+            {"type": "subscribe", "all": true}
         """
-        disconnected = []
-        for admin in self.admins:
-            try:
-                await admin.send_json(message)
-            except Exception as e:
-                print(f"⚠️ Admin disconnect, removing from list")
-                disconnected.append(admin)
-        
-        # Xóa các admin đã disconnect
-        for admin in disconnected:
-            self.admins.remove(admin)
+        action = data.get("type")
+        if action not in ("subscribe", "unsubscribe"):
+            return None
+        session_ids = data.get("sessions") or []
+        channels = data.get("channels") or []
+        if not isinstance(session_ids, list) or not isinstance(channels, list):
+            return {"type": "subscription_error", "action": action, "error": "sessions / channels phải là danh sách"}
+        # Frame lỗi thì không áp dụng phần nào, admin vẫn giữ kết nối
+        invalid = [session_id for session_id in session_ids if _parse_session_id(session_id) is None]
+        if invalid:
+            return {"type": "subscription_error", "action": action, "error": "session id không hợp lệ", "invalid": invalid}
+        topics = [session_topic(_parse_session_id(session_id)) for session_id in session_ids]
+        topics += [channel_topic(channel) for channel in channels if channel in ADMIN_CHANNELS]
+        if data.get("summary"):
+            topics.append(SUMMARY_TOPIC)
+        if data.get("all"):
+            topics.append(ALL_TOPIC)
+
+        if action == "subscribe":
+            self.subscribe_admin(websocket, topics)
+        else:
+            self.unsubscribe_admin(websocket, topics)
+        return {"type": "subscriptions", "topics": sorted(self.admin_subscriptions.get(websocket, ()))}
+
+    def _close_sender(self, websocket: WebSocket):
+        self.socket_sessions.pop(websocket, None)
+        self.last_seen.pop(websocket, None)
+        sender = self.senders.pop(websocket, None)
+        if sender is not None:
+            sender.close()
+
+    def _drop_socket(self, websocket: WebSocket):
+        """Writer task báo kết nối lỗi / quá chậm → bỏ khỏi danh sách"""
+        session_id = self.socket_sessions.get(websocket)
+        if session_id is None:
+            self.disconnect_admin(websocket)
+        else:
+            self.disconnect_customer(websocket, session_id)
+
+    def handle_heartbeat(self, websocket: WebSocket, data) -> bool:
+        """
+        Ghi nhận kết nối còn sống khi nhận bất kỳ frame nào từ client
+        Returns:
+            bool: True nếu là frame heartbeat (ping / pong), không cần xử lý tiếp
+        """
+        if websocket in self.last_seen:
+            self.last_seen[websocket] = time.monotonic()
+        frame_type = data.get("type") if isinstance(data, dict) else None
+        if frame_type not in ("ping", "pong"):
+            return False
+        if websocket not in self.last_seen and websocket in self.socket_sessions:
+            # Client tự gửi heartbeat → hiểu được frame ping
+            self._track_heartbeat(websocket)
+        if frame_type == "ping":
+            self.send_to_socket(websocket, {"type": "pong"})
+        return True
+
+    def _track_heartbeat(self, websocket: WebSocket):
+        self.last_seen[websocket] = time.monotonic()
+        if WS_HEARTBEAT_INTERVAL > 0 and (self._heartbeat_task is None or self._heartbeat_task.done()):
+            self._heartbeat_task = asyncio.create_task(self._heartbeat())
+
+    async def stop_heartbeat(self):
+        if self._heartbeat_task is not None:
+            self._heartbeat_task.cancel()
+            await asyncio.gather(self._heartbeat_task, return_exceptions=True)
+            self._heartbeat_task = None
+
+    async def _heartbeat(self):
+        """
+        Mỗi WS_HEARTBEAT_INTERVAL giây:
+        - Ngắt kết nối dùng heartbeat im lặng quá WS_IDLE_TIMEOUT
+        - Gửi ping cho các kết nối còn lại: socket đã chết sẽ gửi lỗi và bị bỏ khỏi danh sách
+        """
+        while True:
+            await asyncio.sleep(WS_HEARTBEAT_INTERVAL)
+            now = time.monotonic()
+            ping = EncodedFrame({"type": "ping", "ts": time.time()})
+            for websocket, seen in list(self.last_seen.items()):
+                if now - seen > WS_IDLE_TIMEOUT:
+                    self._evict_idle(websocket)
+                    continue
+                self._enqueue(websocket, ping)
+                self.heartbeat_stats["pings_sent"] += 1
+
+    def _evict_idle(self, websocket: WebSocket):
+        self.heartbeat_stats["idle_evicted"] += 1
+        print(f"⚠️ WebSocket không phản hồi quá {WS_IDLE_TIMEOUT}s, ngắt kết nối")
+        self._drop_socket(websocket)
+        asyncio.create_task(self._close_quietly(websocket, IDLE_CLOSE_CODE))
+
+    @staticmethod
+    async def _close_quietly(websocket: WebSocket, code: int):
+        try:
+            await websocket.close(code=code)
+        except Exception:
+            pass
+
+    def get_connection_stats(self) -> dict:
+        """Số kết nối hiện tại: customer, admin, stream và các session nhiều kết nối nhất"""
+        per_session = sorted(
+            ((session_id, len(sockets)) for session_id, sockets in self.customers.items()),
+            key=lambda item: item[1],
+            reverse=True
+        )
+        return {
+            "customers": sum(count for _, count in per_session),
+            "customer_sessions": len(per_session),
+            "admins": len(self.admins),
+            "stream_sockets": len(self.stream_sockets),
+            "heartbeat_sockets": len(self.last_seen),
+            "sockets_per_session": {session_id: count for session_id, count in per_session[:WS_STATS_TOP_SESSIONS]},
+            "heartbeat_interval": WS_HEARTBEAT_INTERVAL,
+            "idle_timeout": WS_IDLE_TIMEOUT,
+            **self.heartbeat_stats
+        }
+
+    def _enqueue(self, websocket: WebSocket, frame: EncodedFrame):
+        sender = self.senders.get(websocket)
+        if sender is None:
+            sender = SocketSender(websocket, self._drop_socket, self.send_stats)
+            self.senders[websocket] = sender
+        sender.enqueue(frame)
+
+    def send_to_socket(self, websocket: WebSocket, message):
+        """Gửi cho đúng 1 kết nối, qua hàng đợi để giữ thứ tự với các frame khác"""
+        self._enqueue(websocket, EncodedFrame(message))
+
+    def get_send_stats(self) -> dict:
+        return {
+            **self.send_stats,
+            "policy": WS_SLOW_CONSUMER_POLICY,
+            "queue_size": WS_SEND_QUEUE_SIZE,
+            "pending": sum(len(sender.queue) for sender in self.senders.values()),
+            "admin_topics": len(self.admin_topics),
+            "encoded_frames": encode_stats["frames"],
+            "encode_ms_total": round(encode_stats["ms_total"], 2)
+        }
+
+    def has_stream_listeners(self, session_id: int) -> bool:
+        """Có customer của session hoặc admin nào đăng ký nhận stream không"""
+        if not self.stream_sockets:
+            return False
+        if any(ws in self.stream_sockets for ws in self.customers.get(session_id, ())):
+            return True
+        # Admin theo dõi session: đăng ký mọi tin, session này hoặc 1 kênh (chưa biết kênh của session)
+        topics = [ALL_TOPIC, session_topic(session_id)] + [channel_topic(channel) for channel in ADMIN_CHANNELS]
+        return any(ws in self.stream_sockets for topic in topics for ws in self.admin_topics.get(topic, ()))
+
+    async def send_to_customer(self, session_id: int, message, stream_only: bool = False, channel: Optional[str] = None):
+        """
+        Gửi tới customer của session ở worker này, rồi publish cho các worker khác
+        stream_only=True: chỉ gửi cho kết nối đã đăng ký stream (frame bot_delta)
+        Frame thường được gắn session_seq và lưu vào replay buffer (nếu bật)
+        channel: kênh của session nếu biết, chỉ kênh web mới có widget → kênh khác bỏ qua replay
+        ngay tại đây (không tốn round trip Redis)
+        """
+        if self.replay_buffer is not None and not stream_only and channel in (None, "web"):
+            message = await self.replay_buffer.record(session_id, message)
+        await self.deliver_local_customer(session_id, message, stream_only=stream_only)
+        if self.backplane is not None:
+            await self.backplane.publish_to_session(session_id, message, stream_only=stream_only)
+
+    async def deliver_local_customer(self, session_id: int, message, stream_only: bool = False):
+        frame = EncodedFrame(message)
+        for ws in self.customers.get(session_id, ()):
+            if stream_only and ws not in self.stream_sockets:
+                continue
+            self._enqueue(ws, frame)
+
+
+    async def broadcast_to_admins(self, message, stream_only: bool = False, channel: Optional[str] = None): 
+        """
+        ✅ Gửi tin nhắn đến các admin đăng ký topic của tin (mọi worker qua backplane)
+        - Chỉ duyệt admin đăng ký "*", session, kênh của tin và "summary"
+        - Đưa vào hàng đợi của từng admin, writer task gửi song song
+        - Admin lỗi / quá chậm bị ngắt kết nối theo WS_SLOW_CONSUMER_POLICY
+        - stream_only=True: chỉ gửi cho admin đã đăng ký stream (frame bot_delta)
+        - channel: kênh của session, không truyền thì lấy theo "platform" / "channel" trong tin
+        """
+        await self.deliver_local_admins(message, stream_only=stream_only, channel=channel)
+        if self.backplane is not None:
+            await self.backplane.publish_to_admins(message, stream_only=stream_only, channel=channel)
+
+    async def deliver_local_admins(self, message, stream_only: bool = False, channel: Optional[str] = None):
+        fields = message if isinstance(message, dict) else {}
+        if channel is None:
+            channel = fields.get("platform") or fields.get("channel")
+
+        recipients = set(self.admin_topics.get(ALL_TOPIC, ()))
+        if fields.get("chat_session_id") is not None:
+            recipients.update(self.admin_topics.get(session_topic(fields["chat_session_id"]), ()))
+        if channel:
+            recipients.update(self.admin_topics.get(channel_topic(channel), ()))
+        # Mọi admin dùng chung 1 frame → chỉ mã hóa JSON 1 lần
+        frame = EncodedFrame(message)
+        for admin in recipients:
+            if stream_only and admin not in self.stream_sockets:
+                continue
+            self._enqueue(admin, frame)
+
+        summary_admins = self.admin_topics.get(SUMMARY_TOPIC)
+        if summary_admins and fields and not stream_only:
+            summary = EncodedFrame(build_summary_frame(message, channel))
+            for admin in summary_admins:
+                if admin not in recipients:
+                    self._enqueue(admin, summary)
 
     async def broadcast_to_other_admins(self, sender_websocket: WebSocket, message): 
         """
         ✅ Gửi tin nhắn đến TẤT CẢ admin KHÁC (trừ admin đang gửi)
         - Tránh duplicate message khi admin gửi tin nhắn
         """
-        disconnected = []
+        frame = EncodedFrame(message)
         for admin in self.admins:
             # ✅ Bỏ qua admin đang gửi tin nhắn
             if admin == sender_websocket:
                 continue
-                
-            try:
-                await admin.send_json(message)
-            except Exception as e:
-                print(f"⚠️ Admin disconnect, removing from list")
-                disconnected.append(admin)
-        
-        # Xóa các admin đã disconnect
-        for admin in disconnected:
-            self.admins.remove(admin)
+            self._enqueue(admin, frame)
 
 
 
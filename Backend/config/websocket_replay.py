@@ -0,0 +1,169 @@
+"""
+Gửi lại frame WebSocket bị lỡ khi widget customer kết nối lại
+- Mỗi frame gửi cho customer của session được gắn session_seq tăng dần (Redis INCR, đúng giữa các worker)
+- Giữ WS_REPLAY_MAX_FRAMES frame gần nhất của session trong Redis (sorted set, score = session_seq)
+- /chat/ws/customer?since=<seq> → gửi lại các frame có session_seq > since trước frame mới
+- Không còn đủ frame (buffer đã cắt / hết hạn / Redis lỗi) → gửi frame replay_gap để client tải lại lịch sử
+- Frame stream (bot_delta) không đánh số: câu trả lời đầy đủ vẫn được gửi lại
+- Chỉ ghi cho session đã từng có widget customer kết nối (bộ đếm được tạo khi kết nối),
+  session Facebook / Telegram / Zalo không tốn lệnh Redis / key nào
+"""
+
+import logging
+import os
+from typing import Dict, List, Optional, Tuple
+from config.redis_cache import redis_cache
+from config.websocket_manager import ConnectionManager, encode_json
+
+logger = logging.getLogger(__name__)
+
+
+WS_REPLAY_ENABLED = os.getenv("WS_REPLAY_ENABLED", "true").lower() == "true"
+# Số frame gần nhất giữ lại cho mỗi session
+WS_REPLAY_MAX_FRAMES = int(os.getenv("WS_REPLAY_MAX_FRAMES", 200))
+# Thời gian giữ buffer (giây) kể từ frame cuối
+WS_REPLAY_TTL = int(os.getenv("WS_REPLAY_TTL", 600))
+# Thời gian giữ bộ đếm session_seq (giây), dài hơn buffer để số thứ tự không bị đếm lại từ đầu
+WS_SEQ_TTL = int(os.getenv("WS_SEQ_TTL", 7 * 24 * 3600))
+
+# KEYS[1] = bộ đếm, KEYS[2] = buffer
+# ARGV[1] = frame JSON (object), ARGV[2] = số frame giữ lại, ARGV[3] = TTL buffer, ARGV[4] = TTL bộ đếm
+# Gắn session_seq vào đầu object JSON để lưu frame đúng như frame gửi đi, trong 1 lần gọi
+# Chưa có bộ đếm (session chưa từng có widget kết nối) → không ghi, trả về nil
+RECORD_SCRIPT = """
+if redis.call('EXISTS', KEYS[1]) == 0 then
+    return false
+end
+local seq = redis.call('INCR', KEYS[1])
+redis.call('EXPIRE', KEYS[1], ARGV[4])
+local frame
+if ARGV[1] == '{}' then
+    frame = '{"session_seq":' .. seq .. '}'
+else
+    frame = '{"session_seq":' .. seq .. ',' .. string.sub(ARGV[1], 2)
+end
+redis.call('ZADD', KEYS[2], seq, frame)
+redis.call('ZREMRANGEBYRANK', KEYS[2], 0, -(tonumber(ARGV[2]) + 1))
+redis.call('EXPIRE', KEYS[2], ARGV[3])
+return seq
+"""
+
+
+def get_seq_key(session_id: int) -> str:
+    return f"ws:seq:{session_id}"
+
+
+def get_replay_key(session_id: int) -> str:
+    return f"ws:replay:{session_id}"
+
+
+class WebSocketReplayBuffer:
+
+    def __init__(self, manager: ConnectionManager):
+        self.manager = manager
+        self._scripts: Dict[int, object] = {}
+        self._stats = {
+            "recorded": 0,
+            "skipped": 0,
+            "record_errors": 0,
+            "replays": 0,
+            "replayed_frames": 0,
+            "gaps": 0
+        }
+
+    async def start(self) -> None:
+        if WS_REPLAY_ENABLED:
+            self.manager.replay_buffer = self
+
+    async def stop(self) -> None:
+        if self.manager.replay_buffer is self:
+            self.manager.replay_buffer = None
+
+    def _get_script(self, client):
+        script = self._scripts.get(id(client))
+        if script is None:
+            script = client.register_script(RECORD_SCRIPT)
+            self._scripts[id(client)] = script
+        return script
+
+    async def track_session(self, session_id: int) -> None:
+        """
+        Gọi khi widget customer kết nối: tạo bộ đếm để các frame sau được đánh số và lưu lại
+        """
+        try:
+            client = await redis_cache.get_async_client()
+            if client is not None:
+                await client.set(get_seq_key(session_id), 0, nx=True, ex=WS_SEQ_TTL)
+        except Exception as e:
+            logger.error(f"Error tracking WebSocket replay for session {session_id}: {e}")
+
+    async def record(self, session_id: int, message):
+        """
+        Gắn session_seq và lưu frame vào buffer của session
+        Returns:
+            frame đã gắn session_seq (session chưa có widget / Redis lỗi → frame gốc, không đánh số)
+        """
+        if not isinstance(message, dict):
+            return message
+        try:
+            client = await redis_cache.get_async_client()
+            if client is None:
+                self._stats["record_errors"] += 1
+                return message
+            seq = await self._get_script(client)(
+                keys=[get_seq_key(session_id), get_replay_key(session_id)],
+                args=[encode_json(message), WS_REPLAY_MAX_FRAMES, WS_REPLAY_TTL, WS_SEQ_TTL]
+            )
+            if seq is None:
+                self._stats["skipped"] += 1
+                return message
+            self._stats["recorded"] += 1
+            return {"session_seq": int(seq), **message}
+        except Exception as e:
+            self._stats["record_errors"] += 1
+            logger.error(f"Error recording WebSocket frame for session {session_id}: {e}")
+            return message
+
+    async def frames_since(self, session_id: int, since: int) -> Tuple[List[str], Optional[dict]]:
+        """
+        Returns:
+            (frames, gap): các frame JSON có session_seq > since theo thứ tự,
+            hoặc gap (frame replay_gap) nếu không gửi lại đủ được
+        """
+        self._stats["replays"] += 1
+        latest = None
+        try:
+            client = await redis_cache.get_async_client()
+            if client is not None:
+                async with client.pipeline(transaction=False) as pipe:
+                    pipe.get(get_seq_key(session_id))
+                    pipe.zrangebyscore(get_replay_key(session_id), f"({since}", "+inf", withscores=True)
+                    latest, entries = await pipe.execute()
+                latest = int(latest or 0)
+                # since > latest: bộ đếm đã hết hạn và đếm lại → không so được
+                if since == latest or (since < latest and entries and int(entries[0][1]) == since + 1):
+                    frames = [frame for frame, _ in entries]
+                    self._stats["replayed_frames"] += len(frames)
+                    return frames, None
+        except Exception as e:
+            logger.error(f"Error reading WebSocket replay buffer for session {session_id}: {e}")
+
+        self._stats["gaps"] += 1
+        return [], {
+            "type": "replay_gap",
+            "chat_session_id": session_id,
+            "since": since,
+            "latest_seq": latest
+        }
+
+    def get_stats(self) -> dict:
+        return {
+            **self._stats,
+            "enabled": WS_REPLAY_ENABLED,
+            "attached": self.manager.replay_buffer is self,
+            "max_frames": WS_REPLAY_MAX_FRAMES,
+            "ttl": WS_REPLAY_TTL
+        }
+
+
+websocket_replay = WebSocketReplayBuffer(ConnectionManager())
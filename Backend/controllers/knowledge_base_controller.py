@@ -3,6 +3,10 @@ from sqlalchemy.ext.asyncio import AsyncSession
 from fastapi import UploadFile, HTTPException # Thêm HTTPException
 from typing import Optional, List
 import logging
+from helper.help_catalog_cache import get_catalog_cache_stats
+from llm.help_local_router import get_local_router_stats
+from helper.help_embedding_cache import get_embedding_cache_stats
+from helper.help_semantic_cache import get_semantic_cache_stats
 
 logger = logging.getLogger(__name__)
 
@@ -111,6 +115,30 @@ async def delete_multiple_kb_details_controller(data: dict, db: AsyncSession):
 async def search_kb_controller(query: str, db: AsyncSession):
     return await knowledge_base_service.search_kb_service(query, db)
 
+async def get_catalog_cache_stats_controller():
+    """
+    Controller trả về hit/miss của cache catalog category/file
+    """
+    return get_catalog_cache_stats()
+
+async def get_local_router_stats_controller():
+    """
+    Controller trả về thống kê định tuyến cục bộ (tỉ lệ fallback sang LLM)
+    """
+    return get_local_router_stats()
+
+async def get_embedding_cache_stats_controller():
+    """
+    Controller trả về thống kê cache embedding câu hỏi
+    """
+    return get_embedding_cache_stats()
+
+async def get_semantic_cache_stats_controller():
+    """
+    Controller trả về thống kê cache câu trả lời theo ngữ nghĩa
+    """
+    return get_semantic_cache_stats()
+
 async def get_all_categories_controller(db: AsyncSession):
     """
     Controller lấy tất cả các knowledge categories
@@ -1,3 +1,4 @@
+from fastapi import HTTPException
 from sqlalchemy.ext.asyncio import AsyncSession
 from services.llm_service import (
     create_llm_key_service,
@@ -6,9 +7,15 @@ from services.llm_service import (
     get_llm_keys_by_detail_id_service
 )
 from llm.help_llm import clear_llm_keys_cache
+from llm.help_key_health import get_keys_health
+from llm.help_rate_limiter import get_rate_limiter_stats
 
 async def create_llm_key_controller(llm_detail_id: int, data: dict, db: AsyncSession):
-    llm_key = await create_llm_key_service(llm_detail_id, data, db)
+    try:
+        llm_key = await create_llm_key_service(llm_detail_id, data, db)
+    except ValueError as e:
+        # Trọng số không hợp lệ / tên key trùng
+        raise HTTPException(status_code=400, detail=str(e))
     
     # Xóa cache để force reload danh sách keys mới
     await clear_llm_keys_cache()
@@ -18,6 +25,7 @@ async def create_llm_key_controller(llm_detail_id: int, data: dict, db: AsyncSes
             "name": llm_key.name,
             "key": llm_key.key,
             "type": llm_key.type,
+            "weight": llm_key.weight,
             "llm_detail_id": llm_key.llm_detail_id,
             "created_at": llm_key.created_at,
             "updated_at": llm_key.updated_at
@@ -26,7 +34,10 @@ async def create_llm_key_controller(llm_detail_id: int, data: dict, db: AsyncSes
 
 async def update_llm_key_controller(key_id: int, data: dict, db: AsyncSession):
     """Cập nhật key"""
-    llm_key = await update_llm_key_service(key_id, data, db)
+    try:
+        llm_key = await update_llm_key_service(key_id, data, db)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     if not llm_key:
         return {"message": "LLM key not found"}
     
@@ -38,6 +49,7 @@ async def update_llm_key_controller(key_id: int, data: dict, db: AsyncSession):
             "name": llm_key.name,
             "key": llm_key.key,
             "type": llm_key.type,
+            "weight": llm_key.weight,
             "llm_detail_id": llm_key.llm_detail_id,
             "created_at": llm_key.created_at,
             "updated_at": llm_key.updated_at
@@ -66,9 +78,24 @@ async def get_llm_keys_controller(llm_detail_id: int, db: AsyncSession):
             "name": k.name,
             "key": k.key,
             "type": k.type,
+            "weight": k.weight,
             "llm_detail_id": k.llm_detail_id,
             "created_at": k.created_at,
             "updated_at": k.updated_at
         }
         for k in llm_keys
     ]
+
+
+async def get_llm_keys_health_controller(llm_detail_id: int, db: AsyncSession):
+    """Sức khỏe từng key: latency, tỉ lệ lỗi, rate limit, thời gian cooldown còn lại"""
+    llm_keys = await get_llm_keys_by_detail_id_service(llm_detail_id, db)
+    return await get_keys_health([
+        {"id": k.id, "name": k.name, "key": k.key, "type": k.type, "weight": k.weight}
+        for k in llm_keys
+    ])
+
+
+async def get_rate_limiter_stats_controller():
+    """Thống kê rate limiter LLM của worker: số lượt chờ / bị từ chối, gặp key hết budget, Redis lỗi"""
+    return get_rate_limiter_stats()
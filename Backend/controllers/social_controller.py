@@ -1,5 +1,6 @@
 from services.social_service import (
     send_message_page_service,
+    send_message_page_batch_service,
     send_message_fast_service
 )
 from fastapi import WebSocket, WebSocketDisconnect
@@ -10,16 +11,25 @@ from config.websocket_manager import ConnectionManager
 import datetime
 import json
 import asyncio
+from helper.help_outbox import get_outbox_stats
+from helper.help_webhook_queue import get_webhook_queue_stats
+from helper.help_webhook_dedup import get_webhook_dedup_stats
+from helper.help_debounce import get_debounce_stats
+from helper.help_session_lock import get_session_lock_stats
+from config.websocket_backplane import websocket_backplane
+from config.websocket_replay import websocket_replay
 manager = ConnectionManager()
 
 
 
-async def customer_chat(websocket: WebSocket, session_id: int):
-    await manager.connect_customer(websocket, session_id)
+async def customer_chat(websocket: WebSocket, session_id: int, stream: bool = False, heartbeat: bool = False, since: int = None):
+    await manager.connect_customer(websocket, session_id, stream=stream, heartbeat=heartbeat, since=since)
     
     try:
         while True:
             data = await websocket.receive_json()
+            if manager.handle_heartbeat(websocket, data):
+                continue
             
             print(data)
             
@@ -38,12 +48,20 @@ async def customer_chat(websocket: WebSocket, session_id: int):
         manager.disconnect_customer(websocket, session_id)
 
 
-async def admin_chat(websocket: WebSocket, user: dict):
-    await manager.connect_admin(websocket)
+async def admin_chat(websocket: WebSocket, user: dict, stream: bool = False, heartbeat: bool = False):
+    await manager.connect_admin(websocket, stream=stream, heartbeat=heartbeat)
     
     try:
         while True:
             data = await websocket.receive_json()
+            if manager.handle_heartbeat(websocket, data):
+                continue
+            
+            # Frame đăng ký topic (session / kênh / summary), không phải tin nhắn
+            subscriptions = manager.handle_admin_subscription(websocket, data)
+            if subscriptions is not None:
+                manager.send_to_socket(websocket, subscriptions)
+                continue
             
             from config.database import AsyncSessionLocal
             async with AsyncSessionLocal() as db:
@@ -79,11 +97,24 @@ def parse_telegram(body: dict):
     }
     
 
-def parse_facebook(body: dict):
-    entry = body.get("entry", [])[0]
-    page_id = entry.get("id")
-
-    messaging_event = entry.get("messaging", [])[0]
+def parse_facebook_events(body: dict) -> list:
+    """
+    Tách mọi messaging event có tin nhắn trong webhook Facebook
+    (Facebook gom nhiều entry / event trong 1 request khi tải cao)
+    """
+    events = []
+    for entry in body.get("entry") or []:
+        page_id = entry.get("id")
+        for messaging_event in entry.get("messaging") or []:
+            message = messaging_event.get("message")
+            # Bỏ delivery / read / echo tin nhắn do chính page gửi
+            if message is None or message.get("is_echo"):
+                continue
+            events.append(parse_facebook_event(page_id, messaging_event))
+    return events
+
+
+def parse_facebook_event(page_id: str, messaging_event: dict):
     sender_id = messaging_event["sender"]["id"]
     timestamp = messaging_event.get("timestamp")
 
@@ -135,7 +166,10 @@ async def chat_platform(channel, body: dict, db: AsyncSession):
         print("ok")
     
     elif channel == "fb":
-        data = parse_facebook(body)
+        events = parse_facebook_events(body)
+        if events:
+            await send_message_page_batch_service(events, db)
+        return
      
     elif channel == "zalo":
         data = parse_zalo(body)
@@ -150,3 +184,51 @@ async def chat_platform(channel, body: dict, db: AsyncSession):
         await manager.broadcast_to_admins(msg)
 
 
+async def get_outbox_stats_controller():
+    """
+    Controller trả về độ sâu hàng đợi outbox, dead-letter và độ trễ gửi tin ra nền tảng
+    """
+    return await get_outbox_stats()
+
+
+async def get_webhook_queue_stats_controller():
+    """
+    Controller trả về backlog hàng đợi webhook, số event lỗi, độ trễ xử lý và số webhook trùng đã bỏ
+    """
+    return {
+        **await get_webhook_queue_stats(),
+        "dedup": await get_webhook_dedup_stats()
+    }
+
+
+async def get_debounce_stats_controller():
+    """
+    Controller trả về số tin nhắn được gộp và số lượt sinh câu trả lời bị hủy do debounce
+    """
+    return get_debounce_stats()
+
+
+async def get_session_lock_stats_controller():
+    """
+    Controller trả về thời gian chờ hàng đợi sinh câu trả lời theo session
+    """
+    return get_session_lock_stats()
+
+
+async def get_backplane_stats_controller():
+    """
+    Controller trả về số tin relay qua Redis pub/sub giữa các worker và độ trễ end-to-end
+    """
+    return websocket_backplane.get_stats()
+
+
+async def get_websocket_stats_controller():
+    """
+    Controller trả về số kết nối WebSocket hiện tại, số frame đã gửi / gộp,
+    số kết nối bị ngắt do quá chậm / không phản hồi heartbeat và số frame đã gửi lại khi kết nối lại
+    """
+    return {
+        **manager.get_send_stats(),
+        "connections": manager.get_connection_stats(),
+        "replay": websocket_replay.get_stats()
+    }
@@ -0,0 +1,194 @@
+"""
+Cache catalog category/file dùng cho search_metadata (định tuyến metadata bằng LLM)
+- Snapshot được giữ in-process kèm version, không query Postgres mỗi lượt chat
+- Version + snapshot được chia sẻ giữa các worker qua Redis
+- Các write path của knowledge base gọi invalidate_catalog_cache() để bump version
+"""
+
+import asyncio
+import json
+import logging
+import os
+import time
+from collections import defaultdict
+from sqlalchemy import select
+from config.database import AsyncSessionLocal
+from config.redis_cache import redis_cache, async_cache_get, async_cache_set
+from models.knowledge_base import KnowledgeBaseDetail, KnowledgeCategory
+
+logger = logging.getLogger(__name__)
+
+
+CATALOG_VERSION_KEY = "kb_catalog:version"
+CATALOG_SNAPSHOT_KEY = "kb_catalog:snapshot"
+
+# TTL của snapshot trên Redis (giây)
+CATALOG_CACHE_TTL = int(os.getenv("CATALOG_CACHE_TTL", 3600))
+# Khoảng thời gian (giây) giữa 2 lần kiểm tra version trên Redis
+CATALOG_VERSION_CHECK_INTERVAL = float(os.getenv("CATALOG_VERSION_CHECK_INTERVAL", 5))
+
+
+_catalog = {
+    "version": None,
+    "categories": None,
+    "categories_json": None,
+    "checked_at": 0.0
+}
+
+_stats = {
+    "hits": 0,
+    "redis_hits": 0,
+    "misses": 0,
+    "invalidations": 0
+}
+
+_lock = asyncio.Lock()
+
+
+async def load_catalog_from_db() -> list:
+    """
+    Query catalog category + file (outer join) từ Postgres
+    Chỉ giữ lại các category có ít nhất 1 file
+    """
+    async with AsyncSessionLocal() as session:
+        result = await session.execute(
+            select(
+                KnowledgeCategory.id,
+                KnowledgeCategory.name,
+                KnowledgeCategory.description,
+                KnowledgeBaseDetail.file_name,
+                KnowledgeBaseDetail.description
+            ).outerjoin(KnowledgeBaseDetail, KnowledgeCategory.id == KnowledgeBaseDetail.category_id)
+        )
+        rows = result.all()
+
+    category_dict = defaultdict(lambda: {"file_list": [], "category_description": None})
+
+    for cat_id, cat_name, cat_desc, file_name, file_desc in rows:
+        key = (cat_id, cat_name)
+        category_dict[key]["category_description"] = cat_desc
+
+        if file_name:
+            category_dict[key]["file_list"].append({
+                "file_name": file_name,
+                "summary": file_desc
+            })
+
+    formatted_categories = []
+    for (cat_id, cat_name), data in category_dict.items():
+        if not data["file_list"]:
+            continue
+
+        formatted_categories.append({
+            "category_id": cat_id,
+            "category_name": cat_name,
+            "category_description": data["category_description"],
+            "file_list": data["file_list"]
+        })
+
+    return formatted_categories
+
+
+async def _get_remote_version() -> int:
+    """
+    Lấy version hiện tại trên Redis, trả về None nếu Redis không khả dụng
+    """
+    try:
+        client = await redis_cache.get_async_client()
+        if client is None:
+            return None
+        value = await client.get(CATALOG_VERSION_KEY)
+        return int(value) if value is not None else 0
+    except Exception as e:
+        logger.error(f"Error getting catalog version: {e}")
+        return None
+
+
+def _set_local_snapshot(version: int, categories: list) -> None:
+    _catalog["version"] = version
+    _catalog["categories"] = categories
+    # Serialize 1 lần cho mỗi version, prompt routing dùng lại chuỗi này
+    _catalog["categories_json"] = json.dumps(categories, ensure_ascii=False)
+    _catalog["checked_at"] = time.monotonic()
+
+
+async def get_catalog_snapshot() -> dict:
+    """
+    Lấy snapshot catalog hiện tại
+
+    Returns:
+        dict: {"version", "categories", "categories_json"}
+    """
+    now = time.monotonic()
+
+    # 1. Snapshot local còn mới → dùng luôn, không tốn round trip nào
+    if _catalog["categories"] is not None and now - _catalog["checked_at"] < CATALOG_VERSION_CHECK_INTERVAL:
+        _stats["hits"] += 1
+        return _catalog
+
+    # 2. So sánh version local với Redis (worker khác có thể đã invalidate)
+    remote_version = await _get_remote_version()
+    if _catalog["categories"] is not None and remote_version in (None, _catalog["version"]):
+        _catalog["checked_at"] = now
+        _stats["hits"] += 1
+        return _catalog
+
+    async with _lock:
+        # Coroutine khác có thể đã nạp xong trong lúc chờ lock
+        if _catalog["categories"] is not None and _catalog["version"] == remote_version:
+            _stats["hits"] += 1
+            return _catalog
+
+        # 3. Thử snapshot dùng chung trên Redis
+        if remote_version is not None:
+            snapshot = await async_cache_get(CATALOG_SNAPSHOT_KEY)
+            if isinstance(snapshot, dict) and snapshot.get("version") == remote_version:
+                _set_local_snapshot(remote_version, snapshot.get("categories", []))
+                _stats["redis_hits"] += 1
+                return _catalog
+
+        # 4. Miss → query Postgres, version được đọc TRƯỚC khi query
+        #    nên nếu có write xen giữa, lần đọc sau sẽ thấy version mới và nạp lại
+        _stats["misses"] += 1
+        categories = await load_catalog_from_db()
+        version = remote_version if remote_version is not None else 0
+        _set_local_snapshot(version, categories)
+
+        if remote_version is not None:
+            await async_cache_set(
+                CATALOG_SNAPSHOT_KEY,
+                {"version": version, "categories": categories},
+                ttl=CATALOG_CACHE_TTL
+            )
+
+        return _catalog
+
+
+async def invalidate_catalog_cache() -> bool:
+    """
+    Bump version catalog, gọi sau khi commit thay đổi category/file
+    """
+    _stats["invalidations"] += 1
+    _catalog["categories"] = None
+    _catalog["categories_json"] = None
+    _catalog["version"] = None
+    _catalog["checked_at"] = 0.0
+
+    try:
+        client = await redis_cache.get_async_client()
+        if client is None:
+            return False
+        await client.incr(CATALOG_VERSION_KEY)
+        return True
+    except Exception as e:
+        logger.error(f"Error invalidating catalog cache: {e}")
+        return False
+
+
+def get_catalog_cache_stats() -> dict:
+    total = _stats["hits"] + _stats["redis_hits"] + _stats["misses"]
+    return {
+        **_stats,
+        "version": _catalog["version"],
+        "hit_ratio": round((_stats["hits"] + _stats["redis_hits"]) / total, 4) if total else None
+    }
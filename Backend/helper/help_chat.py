@@ -20,7 +20,9 @@ from helper.help_redis import (
     update_session_cache,
     session_to_dict,  # Import session_to_dict từ help_redis
     get_cached_page_active_status,
-    cache_page_active_status
+    cache_page_active_status,
+    get_cached_sessions_by_names,
+    cache_sessions_data
 )
 
 
@@ -80,6 +82,45 @@ async def get_or_create_session_by_name_cached(session_name: str, platform: str,
     return session_data
 
 
+async def get_or_create_sessions_by_names_cached(sessions: dict, db) -> dict:
+    """
+    Bản bulk của get_or_create_session_by_name_cached cho webhook gom nhiều tin nhắn:
+    2 lần MGET cache, 1 query IN cho phần còn thiếu, tạo mới các session chưa có trong 1 commit
+    
+    Args:
+        sessions: {session_name: (platform, page_id)}
+        
+    Returns:
+        dict: {session_name: session_data}
+    """
+    session_names = list(sessions)
+    result = await get_cached_sessions_by_names(session_names)
+    missing = [name for name in session_names if name not in result]
+    if not missing:
+        return result
+    
+    query = await db.execute(select(ChatSession).filter(ChatSession.name.in_(missing)))
+    found = {session.name: session for session in query.scalars().all()}
+    
+    new_sessions = [
+        ChatSession(
+            name=name,
+            channel=sessions[name][0],
+            page_id=sessions[name][1],
+            url_channel=None
+        )
+        for name in missing if name not in found
+    ]
+    if new_sessions:
+        db.add_all(new_sessions)
+        await db.commit()
+    
+    loaded = [session_to_dict(session) for session in [*found.values(), *new_sessions]]
+    await cache_sessions_data(loaded, ttl=300)
+    result.update({session_data["name"]: session_data for session_data in loaded})
+    return result
+
+
 def get_platform_prefix(platform: str) -> str:
     """
     Lấy prefix cho session name dựa trên platform
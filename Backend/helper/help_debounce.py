@@ -0,0 +1,324 @@
+"""
+Gộp các mảnh tin nhắn gửi liên tiếp của 1 session trước khi sinh câu trả lời (debounce)
+- Khách hay tách 1 câu hỏi thành 3-4 tin gửi nhanh → đợi BOT_DEBOUNCE_MS sau tin cuối
+  rồi mới chạy RAG + LLM 1 lần cho nội dung đã gộp
+- Tin mới tới khi câu trả lời cho các mảnh trước đang sinh → hủy lượt đó, gộp mảnh vào lượt mới
+- Lượt sinh đã có câu trả lời (mark_generation_committed) thì không hủy nữa để không mất tin đã lưu
+- Trạng thái giữ trên Redis vì webhook của 1 session có thể được consumer ở bất kỳ worker nào xử lý:
+  list mảnh đang chờ + list mảnh của lượt đang sinh + generation id (INCR mỗi mảnh mới).
+  Hết cửa sổ, worker chỉ nhận lượt nếu generation id chưa đổi; lượt đang sinh chỉ commit được
+  khi generation id chưa đổi, nếu không thì bị bỏ (GenerationSuperseded) và mảnh của nó được
+  lượt mới gộp lại
+- Trong cùng process, lượt đang sinh chưa commit bị cancel ngay khi có mảnh mới (không đợi tới commit)
+- Redis lỗi → sinh câu trả lời ngay cho từng tin như khi tắt debounce; lỗi lúc hết cửa sổ thì trả lời
+  bằng các mảnh process này đã nhận (không bỏ lượt của khách)
+"""
+
+import asyncio
+import logging
+import os
+from contextvars import ContextVar
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+from config.redis_cache import redis_cache
+
+logger = logging.getLogger(__name__)
+
+
+# Cửa sổ gộp tin (ms), 0 = tắt (mỗi tin sinh 1 câu trả lời như trước)
+BOT_DEBOUNCE_MS = int(os.getenv("BOT_DEBOUNCE_MS", 1200))
+# Thời hạn (ms) của trạng thái debounce trên Redis, tránh giữ mảnh mồ côi khi worker chết
+BOT_DEBOUNCE_STATE_TTL_MS = int(os.getenv("BOT_DEBOUNCE_STATE_TTL_MS", 600000))
+
+# KEYS[1] = generation id, KEYS[2] = mảnh đang chờ; ARGV[1] = mảnh, ARGV[2] = TTL (ms)
+# Trả về generation id của mảnh này
+PUSH_SCRIPT = """
+local token = redis.call('INCR', KEYS[1])
+redis.call('PEXPIRE', KEYS[1], ARGV[2])
+redis.call('RPUSH', KEYS[2], ARGV[1])
+redis.call('PEXPIRE', KEYS[2], ARGV[2])
+return token
+"""
+
+# KEYS[1] = generation id, KEYS[2] = mảnh đang chờ, KEYS[3] = mảnh của lượt đang sinh
+# ARGV[1] = generation id của worker, ARGV[2] = TTL (ms)
+# Trả về các mảnh cần trả lời (mảnh của lượt chưa commit + mảnh mới), nil nếu đã có mảnh mới hơn
+CLAIM_SCRIPT = """
+if redis.call('GET', KEYS[1]) ~= ARGV[1] then
+    return false
+end
+local fragments = redis.call('LRANGE', KEYS[3], 0, -1)
+for _, fragment in ipairs(redis.call('LRANGE', KEYS[2], 0, -1)) do
+    table.insert(fragments, fragment)
+end
+redis.call('DEL', KEYS[2], KEYS[3])
+if #fragments > 0 then
+    redis.call('RPUSH', KEYS[3], unpack(fragments))
+    redis.call('PEXPIRE', KEYS[3], ARGV[2])
+end
+return fragments
+"""
+
+# KEYS[1] = generation id, KEYS[2] = mảnh của lượt đang sinh; ARGV[1] = generation id của lượt
+# Trả về 1 nếu lượt vẫn là lượt mới nhất (bỏ mảnh đã trả lời), 0 nếu đã có mảnh mới hơn
+COMMIT_SCRIPT = """
+if redis.call('GET', KEYS[1]) ~= ARGV[1] then
+    return 0
+end
+redis.call('DEL', KEYS[2])
+return 1
+"""
+
+
+class GenerationSuperseded(asyncio.CancelledError):
+    """Đã có mảnh tin mới hơn (có thể ở worker khác) → bỏ câu trả lời của lượt này"""
+
+
+class _Generation:
+
+    def __init__(self, chat_session_id: int, token: str, content: str):
+        self.chat_session_id = chat_session_id
+        self.token = token
+        self.content = content
+        self.task: Optional[asyncio.Task] = None
+        # Đã bắt đầu commit: không cancel cục bộ nữa, Redis quyết định lượt nào thắng
+        self.committing = False
+        self.committed = False
+
+
+_scripts: Dict[int, dict] = {}
+# Timer / lượt đang sinh của process này theo session (chỉ để cancel sớm)
+_timers: Dict[int, asyncio.Task] = {}
+# Lần push mảnh gần nhất của session trong process này: mảnh sau đợi mảnh trước push xong để giữ thứ tự
+_push_tails: Dict[int, asyncio.Future] = {}
+_generations: Dict[int, _Generation] = {}
+# Mảnh process này đã push nhưng chưa được lượt nào nhận: [(generation id, mảnh)], dùng khi claim lỗi
+_local_fragments: Dict[int, List[Tuple[int, str]]] = {}
+_current_generation: ContextVar[Optional[_Generation]] = ContextVar("bot_generation", default=None)
+
+_stats = {
+    "fragments": 0,
+    "generations": 0,
+    "cancelled": 0,
+    "superseded": 0,
+    "direct_fallback": 0
+}
+
+
+def get_generation_key(chat_session_id: int) -> str:
+    return f"debounce:{chat_session_id}:generation"
+
+
+def get_pending_key(chat_session_id: int) -> str:
+    return f"debounce:{chat_session_id}:pending"
+
+
+def get_inflight_key(chat_session_id: int) -> str:
+    return f"debounce:{chat_session_id}:inflight"
+
+
+def _get_scripts(client) -> dict:
+    scripts = _scripts.get(id(client))
+    if scripts is None:
+        scripts = {
+            "push": client.register_script(PUSH_SCRIPT),
+            "claim": client.register_script(CLAIM_SCRIPT),
+            "commit": client.register_script(COMMIT_SCRIPT)
+        }
+        _scripts[id(client)] = scripts
+    return scripts
+
+
+async def _get_client():
+    try:
+        return await redis_cache.get_async_client()
+    except Exception as e:
+        logger.error(f"Error getting Redis client for debounce: {e}")
+        return None
+
+
+def schedule_bot_response(chat_session_id: int, fragment: str, run: Callable[[str], Awaitable]) -> None:
+    """
+    Đăng ký 1 mảnh tin nhắn cần bot trả lời
+
+    Args:
+        run: hàm sinh + gửi câu trả lời, nhận nội dung đã gộp (lấy theo mảnh gần nhất)
+    """
+    _stats["fragments"] += 1
+    if BOT_DEBOUNCE_MS <= 0:
+        _stats["generations"] += 1
+        asyncio.create_task(run(fragment))
+        return
+
+    previous = _push_tails.get(chat_session_id)
+    pushed = asyncio.get_running_loop().create_future()
+    _push_tails[chat_session_id] = pushed
+    asyncio.create_task(_schedule(chat_session_id, fragment, run, previous, pushed))
+
+
+async def _push(chat_session_id: int, fragment: str, previous: Optional[asyncio.Future], pushed: asyncio.Future):
+    try:
+        if previous is not None:
+            await previous
+        client = await _get_client()
+        if client is None:
+            return None
+        return await _get_scripts(client)["push"](
+            keys=[get_generation_key(chat_session_id), get_pending_key(chat_session_id)],
+            args=[fragment, BOT_DEBOUNCE_STATE_TTL_MS]
+        )
+    except Exception as e:
+        logger.error(f"Error pushing debounce fragment: {e}")
+        return None
+    finally:
+        pushed.set_result(None)
+        if _push_tails.get(chat_session_id) is pushed:
+            del _push_tails[chat_session_id]
+
+
+async def _schedule(
+    chat_session_id: int,
+    fragment: str,
+    run: Callable[[str], Awaitable],
+    previous: Optional[asyncio.Future],
+    pushed: asyncio.Future
+) -> None:
+    token = await _push(chat_session_id, fragment, previous, pushed)
+    if token is None:
+        _stats["direct_fallback"] += 1
+        _stats["generations"] += 1
+        await run(fragment)
+        return
+
+    # Generation id đã đổi nên lượt đang sinh không commit được nữa; cùng process thì cancel luôn
+    local_fragments = _local_fragments.setdefault(chat_session_id, [])
+    generation = _generations.get(chat_session_id)
+    if generation is not None and not generation.committing and not generation.task.done():
+        generation.task.cancel()
+        # Mảnh của lượt bị hủy được lượt mới gộp lại (Redis), giữ bản local phòng khi claim lỗi
+        local_fragments.append((int(generation.token), generation.content))
+        _stats["cancelled"] += 1
+        print(f"✂️ Hủy câu trả lời đang sinh của session {chat_session_id}, gộp với tin mới")
+
+    local_fragments.append((int(token), fragment))
+
+    timer = _timers.get(chat_session_id)
+    if timer is not None:
+        timer.cancel()
+    _timers[chat_session_id] = asyncio.create_task(_start_after_window(chat_session_id, str(token), run))
+
+
+async def _start_after_window(chat_session_id: int, token: str, run: Callable[[str], Awaitable]) -> None:
+    try:
+        await asyncio.sleep(BOT_DEBOUNCE_MS / 1000)
+    finally:
+        if _timers.get(chat_session_id) is asyncio.current_task():
+            del _timers[chat_session_id]
+
+    try:
+        client = await _get_client()
+        if client is None:
+            raise ConnectionError("Redis không khả dụng")
+        fragments = await _get_scripts(client)["claim"](
+            keys=[
+                get_generation_key(chat_session_id),
+                get_pending_key(chat_session_id),
+                get_inflight_key(chat_session_id)
+            ],
+            args=[token, BOT_DEBOUNCE_STATE_TTL_MS]
+        )
+    except Exception as e:
+        logger.error(f"Error claiming debounce fragments: {e}")
+        fragments = _pop_local_fragments(chat_session_id, int(token))
+        if fragments:
+            # Không nhận được lượt trên Redis → vẫn trả lời bằng các mảnh đã biết thay vì bỏ lượt
+            _stats["direct_fallback"] += 1
+            _stats["generations"] += 1
+            await run("\n".join(fragments))
+        return
+
+    # Mảnh tới generation id này đã nằm trong lượt vừa nhận hoặc lượt của mảnh mới hơn
+    _pop_local_fragments(chat_session_id, int(token))
+    if not fragments:
+        # Đã có mảnh mới hơn: worker nhận mảnh đó sẽ trả lời chung
+        return
+
+    content = "\n".join(fragments)
+    generation = _Generation(chat_session_id, token, content)
+    generation.task = asyncio.create_task(_run_generation(generation, content, run))
+    _generations[chat_session_id] = generation
+    _stats["generations"] += 1
+    if len(fragments) > 1:
+        print(f"🧩 Gộp {len(fragments)} tin của session {chat_session_id} thành 1 lượt trả lời")
+
+
+def _pop_local_fragments(chat_session_id: int, token: int) -> List[str]:
+    pending = sorted(_local_fragments.get(chat_session_id, []), key=lambda entry: entry[0])
+    fragments = [fragment for fragment_token, fragment in pending if fragment_token <= token]
+    remaining = [entry for entry in pending if entry[0] > token]
+    if remaining:
+        _local_fragments[chat_session_id] = remaining
+    else:
+        _local_fragments.pop(chat_session_id, None)
+    return fragments
+
+
+async def _run_generation(generation: _Generation, content: str, run: Callable[[str], Awaitable]) -> None:
+    # ContextVar được set trong task riêng → mark_generation_committed tìm đúng lượt
+    _current_generation.set(generation)
+    finished = False
+    try:
+        await run(content)
+        finished = True
+    except GenerationSuperseded:
+        _stats["superseded"] += 1
+        print(f"✂️ Bỏ câu trả lời của session {generation.chat_session_id}, đã có tin mới hơn")
+    finally:
+        if _generations.get(generation.chat_session_id) is generation:
+            del _generations[generation.chat_session_id]
+
+    if finished and not generation.committed:
+        # Lượt kết thúc mà không commit (lỗi trước khi có câu trả lời): bỏ mảnh của lượt,
+        # không gộp vào lượt sau
+        try:
+            await _commit(generation)
+        except Exception as e:
+            logger.error(f"Error releasing debounce generation: {e}")
+
+
+async def _commit(generation: _Generation) -> bool:
+    client = await _get_client()
+    return bool(await _get_scripts(client)["commit"](
+        keys=[get_generation_key(generation.chat_session_id), get_inflight_key(generation.chat_session_id)],
+        args=[generation.token]
+    ))
+
+
+async def mark_generation_committed() -> None:
+    """
+    Gọi khi đã có câu trả lời và sắp lưu / gửi: từ đây lượt sinh không bị hủy nữa
+
+    Raises:
+        GenerationSuperseded: đã có mảnh tin mới hơn, lượt mới sẽ trả lời chung
+    """
+    generation = _current_generation.get()
+    if generation is None:
+        return
+    generation.committing = True
+    try:
+        committed = await _commit(generation)
+    except Exception as e:
+        # Không kiểm tra được thì vẫn gửi câu trả lời (thà trả lời 2 lần còn hơn mất)
+        logger.error(f"Error committing debounce generation: {e}")
+        committed = True
+    if not committed:
+        raise GenerationSuperseded()
+    generation.committed = True
+
+
+def get_debounce_stats() -> dict:
+    return {
+        **_stats,
+        "window_ms": BOT_DEBOUNCE_MS,
+        "pending_sessions": len(_timers.keys() | _generations.keys()),
+        "llm_calls_saved": _stats["fragments"] - _stats["generations"]
+    }
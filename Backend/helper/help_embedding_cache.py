@@ -0,0 +1,131 @@
+"""
+Cache embedding của câu hỏi (2 tầng)
+- Tầng 1: LRU in-process
+- Tầng 2: Redis, vector lưu dạng bytes float32
+Key = text đã chuẩn hóa tiếng Việt (Unicode NFC, gộp khoảng trắng, chữ thường) + tên embedding model
+"""
+
+import hashlib
+import logging
+import os
+import re
+import time
+import unicodedata
+from collections import OrderedDict
+from typing import List, Optional
+import numpy as np
+from config.redis_cache import redis_cache
+
+logger = logging.getLogger(__name__)
+
+
+EMBEDDING_CACHE_ENABLED = os.getenv("EMBEDDING_CACHE_ENABLED", "true").lower() == "true"
+# Số vector tối đa trong LRU in-process
+EMBEDDING_CACHE_MAX_ITEMS = int(os.getenv("EMBEDDING_CACHE_MAX_ITEMS", 2000))
+# TTL (giây) cho cả 2 tầng
+EMBEDDING_CACHE_TTL = int(os.getenv("EMBEDDING_CACHE_TTL", 86400))
+
+
+# key -> (expire_at, bytes float32)
+_lru: "OrderedDict[str, tuple]" = OrderedDict()
+
+_stats = {
+    "local_hits": 0,
+    "redis_hits": 0,
+    "misses": 0,
+    "evictions": 0
+}
+
+
+def normalize_query_text(text: str) -> str:
+    """
+    Chuẩn hóa câu hỏi tiếng Việt để các biến thể gõ khác nhau dùng chung 1 key
+    - NFC: gộp dấu tổ hợp (vd: "a" + dấu sắc) thành ký tự dựng sẵn
+    - Gộp mọi khoảng trắng liên tiếp, bỏ khoảng trắng đầu/cuối
+    - Chữ thường
+    """
+    text = unicodedata.normalize("NFC", text or "")
+    text = re.sub(r"\s+", " ", text).strip()
+    return text.lower()
+
+
+def get_embedding_cache_key(text: str, embedding_model_name: str) -> str:
+    digest = hashlib.sha1(normalize_query_text(text).encode("utf-8")).hexdigest()
+    return f"emb:{embedding_model_name.lower()}:{digest}"
+
+
+def _local_get(key: str) -> Optional[bytes]:
+    entry = _lru.get(key)
+    if entry is None:
+        return None
+    expire_at, data = entry
+    if expire_at < time.monotonic():
+        del _lru[key]
+        return None
+    _lru.move_to_end(key)
+    return data
+
+
+def _local_set(key: str, data: bytes) -> None:
+    _lru[key] = (time.monotonic() + EMBEDDING_CACHE_TTL, data)
+    _lru.move_to_end(key)
+    while len(_lru) > EMBEDDING_CACHE_MAX_ITEMS:
+        _lru.popitem(last=False)
+        _stats["evictions"] += 1
+
+
+def _to_vector(data: bytes) -> List[float]:
+    return np.frombuffer(data, dtype=np.float32).tolist()
+
+
+async def get_cached_embedding(text: str, embedding_model_name: str) -> Optional[List[float]]:
+    if not EMBEDDING_CACHE_ENABLED:
+        return None
+
+    key = get_embedding_cache_key(text, embedding_model_name)
+
+    data = _local_get(key)
+    if data is not None:
+        _stats["local_hits"] += 1
+        return _to_vector(data)
+
+    try:
+        client = await redis_cache.get_async_binary_client()
+        if client is not None:
+            data = await client.get(key)
+            if data:
+                _local_set(key, data)
+                _stats["redis_hits"] += 1
+                return _to_vector(data)
+    except Exception as e:
+        logger.error(f"Error getting embedding cache key {key}: {e}")
+
+    _stats["misses"] += 1
+    return None
+
+
+async def cache_embedding(text: str, embedding_model_name: str, vector: List[float]) -> None:
+    if not EMBEDDING_CACHE_ENABLED or not vector:
+        return
+
+    key = get_embedding_cache_key(text, embedding_model_name)
+    data = np.asarray(vector, dtype=np.float32).tobytes()
+    _local_set(key, data)
+
+    try:
+        client = await redis_cache.get_async_binary_client()
+        if client is not None:
+            await client.setex(key, EMBEDDING_CACHE_TTL, data)
+    except Exception as e:
+        logger.error(f"Error setting embedding cache key {key}: {e}")
+
+
+def get_embedding_cache_stats() -> dict:
+    lookups = _stats["local_hits"] + _stats["redis_hits"] + _stats["misses"]
+    return {
+        **_stats,
+        "size": len(_lru),
+        "max_items": EMBEDDING_CACHE_MAX_ITEMS,
+        "ttl": EMBEDDING_CACHE_TTL,
+        "hit_ratio": round((_stats["local_hits"] + _stats["redis_hits"]) / lookups, 4) if lookups else None
+    }
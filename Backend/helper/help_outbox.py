@@ -0,0 +1,420 @@
+"""
+Outbox gửi tin nhắn ra nền tảng (Facebook / Telegram / Zalo) bằng Redis Streams
+- Tin nhắn được XADD vào 1 trong OUTBOX_PARTITIONS stream, chọn theo hash người nhận
+  → mọi tin của cùng 1 người nhận nằm trên cùng 1 partition và được gửi tuần tự (giữ thứ tự)
+- Mỗi partition chỉ do 1 consumer xử lý tại 1 thời điểm (lease Redis), nên chạy nhiều
+  worker / process cùng lúc vẫn an toàn; số partition = số tin gửi song song tối đa
+- At-least-once: chỉ XACK sau khi gửi xong, process chết giữa chừng thì consumer nhận lease
+  sau sẽ đọc lại các tin pending
+- Lease được gia hạn nền trong lúc đang gửi; gia hạn thất bại (worker khác đã nhận) thì
+  hủy lần gửi đang chạy và dừng batch để không gửi trùng / sai thứ tự
+- Lỗi tạm thời (PlatformDeliveryError) được retry với backoff, chỉ gửi lại bước lỗi
+  (ảnh đã gửi thì không gửi lại); quá OUTBOX_MAX_ATTEMPTS lần hoặc lỗi không retry được
+  → chuyển sang dead-letter stream
+- Redis không khả dụng → enqueue trả về None để caller gửi trực tiếp như cũ
+
+Chạy worker riêng: python -m helper.help_outbox  (đặt OUTBOX_RUN_IN_APP=false cho API)
+"""
+
+import asyncio
+import json
+import logging
+import os
+import random
+import socket
+import time
+import uuid
+import zlib
+from collections import deque
+from typing import Dict, List, Optional
+from config.redis_cache import redis_cache
+
+logger = logging.getLogger(__name__)
+
+
+OUTBOX_ENABLED = os.getenv("OUTBOX_ENABLED", "true").lower() == "true"
+# Chạy consumer ngay trong process API (false nếu đã chạy worker riêng)
+OUTBOX_RUN_IN_APP = os.getenv("OUTBOX_RUN_IN_APP", "true").lower() == "true"
+OUTBOX_PARTITIONS = int(os.getenv("OUTBOX_PARTITIONS", 8))
+OUTBOX_MAX_ATTEMPTS = int(os.getenv("OUTBOX_MAX_ATTEMPTS", 5))
+# Backoff (giây) giữa các lần gửi lại
+OUTBOX_RETRY_BASE = float(os.getenv("OUTBOX_RETRY_BASE", 1))
+OUTBOX_RETRY_MAX = float(os.getenv("OUTBOX_RETRY_MAX", 30))
+OUTBOX_LEASE_MS = int(os.getenv("OUTBOX_LEASE_MS", 30000))
+OUTBOX_BLOCK_MS = int(os.getenv("OUTBOX_BLOCK_MS", 2000))
+OUTBOX_BATCH_SIZE = int(os.getenv("OUTBOX_BATCH_SIZE", 10))
+OUTBOX_DEAD_MAXLEN = int(os.getenv("OUTBOX_DEAD_MAXLEN", 10000))
+
+OUTBOX_GROUP = "outbox"
+OUTBOX_DEAD_STREAM = "outbox:dead"
+
+# KEYS[1] = key lease, ARGV[1] = worker id, ARGV[2] = thời hạn lease (ms)
+# Trả về 1 nếu worker đang giữ lease (nhận mới hoặc gia hạn)
+LEASE_SCRIPT = """
+local owner = redis.call('GET', KEYS[1])
+if owner == ARGV[1] then
+    redis.call('PEXPIRE', KEYS[1], ARGV[2])
+    return 1
+end
+if not owner then
+    redis.call('SET', KEYS[1], ARGV[1], 'PX', ARGV[2])
+    return 1
+end
+return 0
+"""
+
+RELEASE_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
+_scripts: Dict[int, dict] = {}
+
+_worker_id = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:6]}"
+_worker_tasks: List[asyncio.Task] = []
+_owned_partitions = set()
+
+_stats = {
+    "enqueued": 0,
+    "direct_fallback": 0,
+    "delivered": 0,
+    "retried": 0,
+    "dead_lettered": 0,
+    "redelivered": 0,
+    "lease_lost": 0
+}
+# Độ trễ từ lúc enqueue tới lúc gửi xong (ms) của các tin gần nhất
+_latencies = deque(maxlen=1000)
+
+
+def get_stream_key(partition: int) -> str:
+    return f"outbox:stream:{partition}"
+
+
+def get_lease_key(partition: int) -> str:
+    return f"outbox:lease:{partition}"
+
+
+def get_partition(channel: str, page_id: Optional[str], recipient_id) -> int:
+    recipient = f"{channel}:{page_id or ''}:{recipient_id}"
+    return zlib.crc32(recipient.encode()) % OUTBOX_PARTITIONS
+
+
+def _get_scripts(client) -> dict:
+    scripts = _scripts.get(id(client))
+    if scripts is None:
+        scripts = {
+            "lease": client.register_script(LEASE_SCRIPT),
+            "release": client.register_script(RELEASE_SCRIPT)
+        }
+        _scripts[id(client)] = scripts
+    return scripts
+
+
+async def _get_client():
+    try:
+        return await redis_cache.get_async_client()
+    except Exception as e:
+        logger.error(f"Error getting Redis client for outbox: {e}")
+        return None
+
+
+async def enqueue_platform_message(
+    channel: str,
+    page_id: Optional[str],
+    recipient_id,
+    message_data: dict,
+    images=None
+) -> Optional[str]:
+    """
+    Đưa tin nhắn vào outbox
+
+    Returns:
+        Optional[str]: id entry trong stream, None nếu outbox tắt / Redis lỗi (caller tự gửi trực tiếp)
+    """
+    if not OUTBOX_ENABLED:
+        return None
+
+    client = await _get_client()
+    if client is None:
+        _stats["direct_fallback"] += 1
+        return None
+
+    fields = {
+        "channel": channel,
+        "page_id": page_id or "",
+        "recipient_id": str(recipient_id),
+        "payload": json.dumps({"message_data": message_data, "images": images}, ensure_ascii=False, default=str),
+        "enqueued_at": repr(time.time())
+    }
+    try:
+        entry_id = await client.xadd(get_stream_key(get_partition(channel, page_id, recipient_id)), fields)
+    except Exception as e:
+        logger.error(f"Error enqueueing outbox message: {e}")
+        _stats["direct_fallback"] += 1
+        return None
+
+    _stats["enqueued"] += 1
+    return entry_id
+
+
+async def _deliver(fields: dict, progress: dict) -> None:
+    from helper.help_send_social import deliver_to_platform
+
+    payload = json.loads(fields["payload"])
+    await deliver_to_platform(
+        fields["channel"],
+        fields.get("page_id") or None,
+        fields["recipient_id"],
+        payload.get("message_data") or {},
+        payload.get("images"),
+        progress
+    )
+
+
+def _retry_delay(attempt: int) -> float:
+    return random.uniform(0, min(OUTBOX_RETRY_MAX, OUTBOX_RETRY_BASE * 2 ** attempt))
+
+
+async def _hold_lease(client, partition: int) -> bool:
+    held = bool(await _get_scripts(client)["lease"](
+        keys=[get_lease_key(partition)],
+        args=[_worker_id, OUTBOX_LEASE_MS]
+    ))
+    if held:
+        _owned_partitions.add(partition)
+    else:
+        _owned_partitions.discard(partition)
+    return held
+
+
+async def _deliver_with_lease(client, partition: int, fields: dict, progress: dict) -> bool:
+    """
+    Gửi 1 lần, gia hạn lease mỗi OUTBOX_LEASE_MS / 3 trong lúc chờ nền tảng trả lời
+
+    Returns:
+        bool: False nếu mất lease (lần gửi bị hủy, entry để pending cho worker nhận lease sau)
+
+    Raises:
+        Exception: lỗi của lần gửi (PlatformDeliveryError...)
+    """
+    delivery = asyncio.create_task(_deliver(fields, progress))
+    interval = OUTBOX_LEASE_MS / 3000
+    renewed_at = time.monotonic()
+    try:
+        while True:
+            done, _ = await asyncio.wait({delivery}, timeout=interval)
+            if done:
+                delivery.result()
+                return True
+            try:
+                held = await _hold_lease(client, partition)
+                renewed_at = time.monotonic()
+            except Exception as e:
+                # Redis lỗi tạm thời: vẫn coi là giữ lease cho tới khi lease chắc chắn đã hết hạn
+                logger.error(f"[outbox] Lỗi gia hạn lease partition {partition}: {e}")
+                held = (time.monotonic() - renewed_at) * 1000 < OUTBOX_LEASE_MS
+            if not held:
+                _stats["lease_lost"] += 1
+                logger.warning(f"[outbox] Mất lease partition {partition} khi đang gửi, hủy lần gửi")
+                return False
+    finally:
+        if not delivery.done():
+            delivery.cancel()
+            await asyncio.gather(delivery, return_exceptions=True)
+
+
+async def _ensure_group(client, stream: str) -> None:
+    try:
+        await client.xgroup_create(stream, OUTBOX_GROUP, id="0", mkstream=True)
+    except Exception as e:
+        # BUSYGROUP: group đã tồn tại
+        if "BUSYGROUP" not in str(e):
+            raise
+
+
+async def _dead_letter(client, partition: int, entry_id: str, fields: dict, attempts: int, error: Exception) -> None:
+    await client.xadd(OUTBOX_DEAD_STREAM, {
+        **fields,
+        "source_id": entry_id,
+        "partition": partition,
+        "attempts": attempts,
+        "error": f"{type(error).__name__}: {error}"[:1000],
+        "failed_at": repr(time.time())
+    }, maxlen=OUTBOX_DEAD_MAXLEN, approximate=True)
+    _stats["dead_lettered"] += 1
+    logger.error(f"[outbox] Dead-letter {entry_id} ({fields.get('channel')}:{fields.get('recipient_id')}): {error}")
+
+
+async def _process_entry(client, partition: int, entry_id: str, fields: Optional[dict]) -> bool:
+    """
+    Gửi 1 entry, retry tại chỗ để tin sau của cùng partition không vượt lên trước
+
+    Returns:
+        bool: False nếu mất lease giữa chừng (entry để pending cho worker nhận lease sau)
+    """
+    from helper.help_send_social import PlatformDeliveryError
+
+    stream = get_stream_key(partition)
+    if fields:
+        attempt = 0
+        # Bước đã gửi xong, giữ qua các lần retry để chỉ gửi lại bước lỗi
+        progress = {}
+        while True:
+            attempt += 1
+            try:
+                if not await _deliver_with_lease(client, partition, fields, progress):
+                    return False
+            except PlatformDeliveryError as e:
+                if attempt >= OUTBOX_MAX_ATTEMPTS:
+                    await _dead_letter(client, partition, entry_id, fields, attempt, e)
+                    break
+                delay = _retry_delay(attempt - 1)
+                _stats["retried"] += 1
+                logger.warning(f"[outbox] {entry_id} lỗi tạm thời, gửi lại lần {attempt + 1} sau {delay:.2f}s: {e}")
+                await asyncio.sleep(delay)
+                if not await _hold_lease(client, partition):
+                    return False
+                continue
+            except Exception as e:
+                # Lỗi không phải do nền tảng (dữ liệu hỏng, bug...) → gửi lại cũng không khỏi
+                await _dead_letter(client, partition, entry_id, fields, attempt, e)
+                break
+
+            _stats["delivered"] += 1
+            try:
+                _latencies.append((time.time() - float(fields.get("enqueued_at") or 0)) * 1000)
+            except ValueError:
+                pass
+            break
+
+    pipe = client.pipeline(transaction=False)
+    pipe.xack(stream, OUTBOX_GROUP, entry_id)
+    pipe.xdel(stream, entry_id)
+    await pipe.execute()
+    return True
+
+
+async def _run_partition(partition: int) -> None:
+    stream = get_stream_key(partition)
+    # Consumer đặt theo partition (không theo process) để worker nhận lease sau
+    # đọc lại được các tin pending của worker trước
+    consumer = f"partition-{partition}"
+    recovering = True
+
+    while True:
+        try:
+            client = await _get_client()
+            if client is None:
+                await asyncio.sleep(OUTBOX_BLOCK_MS / 1000)
+                continue
+            if not await _hold_lease(client, partition):
+                recovering = True
+                await asyncio.sleep(OUTBOX_BLOCK_MS / 1000)
+                continue
+            await _ensure_group(client, stream)
+
+            if recovering:
+                response = await client.xreadgroup(OUTBOX_GROUP, consumer, {stream: "0"}, count=OUTBOX_BATCH_SIZE)
+            else:
+                response = await client.xreadgroup(
+                    OUTBOX_GROUP, consumer, {stream: ">"},
+                    count=OUTBOX_BATCH_SIZE, block=OUTBOX_BLOCK_MS
+                )
+            entries = response[0][1] if response else []
+            if recovering:
+                if not entries:
+                    recovering = False
+                    continue
+                _stats["redelivered"] += len(entries)
+
+            for entry_id, fields in entries:
+                if not await _process_entry(client, partition, entry_id, fields):
+                    recovering = True
+                    break
+                if not await _hold_lease(client, partition):
+                    # Worker khác đã nhận partition, phần còn lại của batch để worker đó gửi
+                    recovering = True
+                    break
+
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"[outbox] Lỗi consumer partition {partition}: {e}")
+            recovering = True
+            await asyncio.sleep(1)
+
+
+async def start_outbox_workers(partitions: Optional[List[int]] = None) -> None:
+    if not OUTBOX_ENABLED or _worker_tasks:
+        return
+    for partition in (range(OUTBOX_PARTITIONS) if partitions is None else partitions):
+        _worker_tasks.append(asyncio.create_task(_run_partition(partition)))
+    logger.info(f"[outbox] Worker {_worker_id} started {len(_worker_tasks)} consumers")
+
+
+async def stop_outbox_workers() -> None:
+    for task in _worker_tasks:
+        task.cancel()
+    await asyncio.gather(*_worker_tasks, return_exceptions=True)
+    _worker_tasks.clear()
+
+    client = await _get_client()
+    if client is not None:
+        for partition in list(_owned_partitions):
+            try:
+                await _get_scripts(client)["release"](keys=[get_lease_key(partition)], args=[_worker_id])
+            except Exception as e:
+                logger.error(f"Error releasing outbox lease {partition}: {e}")
+    _owned_partitions.clear()
+
+
+async def get_outbox_stats() -> dict:
+    latencies = sorted(_latencies)
+    stats = {
+        **_stats,
+        "enabled": OUTBOX_ENABLED,
+        "worker_id": _worker_id,
+        "owned_partitions": sorted(_owned_partitions),
+        "latency_ms": {
+            "p50": round(latencies[len(latencies) // 2], 2) if latencies else None,
+            "p95": round(latencies[int(len(latencies) * 0.95) - 1], 2) if len(latencies) >= 20 else None,
+            "max": round(latencies[-1], 2) if latencies else None
+        },
+        "depth": None,
+        "dead_letter": None
+    }
+
+    client = await _get_client()
+    if client is None:
+        return stats
+    try:
+        pipe = client.pipeline(transaction=False)
+        for partition in range(OUTBOX_PARTITIONS):
+            pipe.xlen(get_stream_key(partition))
+        pipe.xlen(OUTBOX_DEAD_STREAM)
+        lengths = await pipe.execute()
+        # Entry được XDEL sau khi ack nên độ dài stream = số tin chưa gửi xong
+        stats["depth"] = {"total": sum(lengths[:-1]), "partitions": lengths[:-1]}
+        stats["dead_letter"] = lengths[-1]
+    except Exception as e:
+        logger.error(f"Error getting outbox depth: {e}")
+    return stats
+
+
+async def _run_worker_forever() -> None:
+    await start_outbox_workers()
+    try:
+        await asyncio.gather(*_worker_tasks)
+    finally:
+        await stop_outbox_workers()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    try:
+        asyncio.run(_run_worker_forever())
+    except KeyboardInterrupt:
+        pass
@@ -3,7 +3,7 @@ Helper functions cho Redis cache operations
 Quản lý tập trung các cache keys và operations liên quan đến chat sessions
 """
 
-from config.redis_cache import cache_get, cache_set, cache_delete
+from config.redis_cache import cache_get, cache_set, cache_delete, async_cache_get_many, async_cache_set_many
 
 
 # ==================== Helper Functions ====================
@@ -108,6 +108,41 @@ def get_cached_session_id_by_name(session_name: str) -> int:
     return cache_get(cache_key)
 
 
+async def get_cached_sessions_by_names(session_names: list) -> dict:
+    """
+    Lấy session data từ cache cho nhiều session name (2 lần MGET)
+    
+    Args:
+        session_names: Danh sách tên session
+        
+    Returns:
+        dict: {session_name: session_data} cho các session có trong cache
+    """
+    session_ids = await async_cache_get_many([get_session_by_name_cache_key(name) for name in session_names])
+    found = [(name, session_id) for name, session_id in zip(session_names, session_ids) if session_id]
+    sessions_data = await async_cache_get_many([get_session_cache_key(session_id) for _, session_id in found])
+    return {
+        name: session_data
+        for (name, _), session_data in zip(found, sessions_data)
+        if session_data
+    }
+
+
+async def cache_sessions_data(sessions_data: list, ttl: int = 300) -> None:
+    """
+    Cache nhiều session theo cả ID và name trong 1 pipeline
+    
+    Args:
+        sessions_data: Danh sách session data (dict từ session_to_dict)
+        ttl: Time to live (seconds), default 300s
+    """
+    mapping = {}
+    for session_data in sessions_data:
+        mapping[get_session_cache_key(session_data["id"])] = session_data
+        mapping[get_session_by_name_cache_key(session_data["name"])] = session_data["id"]
+    await async_cache_set_many(mapping, ttl=ttl)
+
+
 def update_session_cache(session, ttl: int = 300) -> None:
     """
     Cập nhật cache cho session
@@ -0,0 +1,218 @@
+"""
+Cache câu trả lời theo ngữ nghĩa (opt-in, SEMANTIC_CACHE_ENABLED=true)
+- Mỗi worker giữ các câu đã trả lời gần đây theo category (vector đã chuẩn hóa + JSON {"message","links"})
+- Câu hỏi mới trong cùng category có cosine >= ngưỡng sẽ dùng lại câu trả lời đã lưu
+- Invalidate giữa các worker bằng version trên Redis theo knowledge_id / category_id:
+  write path của knowledge base bump version, khi hit sẽ so version bằng 1 lệnh MGET
+- Mỗi lần invalidate bump thêm epoch chung; caller đọc epoch trước khi tìm tài liệu và chỉ lưu
+  câu trả lời nếu epoch không đổi → invalidate xảy ra trong lúc retrieval / generation không bị bỏ lỡ
+- Chỉ dùng cho câu hỏi không phụ thuộc lịch sử hội thoại (caller quyết định, xem help_llm)
+"""
+
+import itertools
+import logging
+import os
+import time
+from collections import OrderedDict
+from typing import Dict, List, Optional
+import numpy as np
+from config.redis_cache import redis_cache
+
+logger = logging.getLogger(__name__)
+
+
+SEMANTIC_CACHE_ENABLED = os.getenv("SEMANTIC_CACHE_ENABLED", "false").lower() == "true"
+# Cosine tối thiểu giữa câu hỏi mới và câu hỏi đã trả lời
+SEMANTIC_CACHE_THRESHOLD = float(os.getenv("SEMANTIC_CACHE_THRESHOLD", 0.95))
+# Số câu trả lời tối đa giữ lại cho mỗi category
+SEMANTIC_CACHE_MAX_PER_CATEGORY = int(os.getenv("SEMANTIC_CACHE_MAX_PER_CATEGORY", 200))
+# TTL (giây) của mỗi câu trả lời
+SEMANTIC_CACHE_TTL = int(os.getenv("SEMANTIC_CACHE_TTL", 1800))
+
+
+# category_id -> OrderedDict(entry_id -> entry)
+_entries: Dict[int, "OrderedDict[int, dict]"] = {}
+_entry_ids = itertools.count(1)
+
+_stats = {
+    "hits": 0,
+    "misses": 0,
+    "stale": 0,
+    "stored": 0,
+    "skipped_invalidated": 0
+}
+
+SEMANTIC_CACHE_EPOCH_KEY = "semcache:version:epoch"
+
+
+def get_knowledge_version_key(knowledge_id) -> str:
+    return f"semcache:version:knowledge:{knowledge_id}"
+
+
+def get_category_version_key(category_id) -> str:
+    return f"semcache:version:category:{category_id}"
+
+
+def _version_keys(category_id: int, knowledge_ids: List[str]) -> List[str]:
+    return [get_category_version_key(category_id)] + [get_knowledge_version_key(k) for k in knowledge_ids]
+
+
+async def _get_versions(keys: List[str]) -> Optional[list]:
+    try:
+        client = await redis_cache.get_async_client()
+        if client is None:
+            return None
+        return await client.mget(keys)
+    except Exception as e:
+        logger.error(f"Error getting semantic cache versions: {e}")
+        return None
+
+
+def _normalize(vector) -> np.ndarray:
+    vector = np.asarray(vector, dtype=np.float32)
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm else vector
+
+
+async def get_semantic_cache_epoch() -> Optional[str]:
+    """
+    Đọc epoch trước khi tìm tài liệu, truyền lại cho store_semantic_answer
+
+    Returns:
+        Optional[str]: epoch hiện tại, None nếu cache tắt / Redis lỗi (không lưu câu trả lời)
+    """
+    if not SEMANTIC_CACHE_ENABLED:
+        return None
+    versions = await _get_versions([SEMANTIC_CACHE_EPOCH_KEY])
+    if versions is None:
+        return None
+    return versions[0] or "0"
+
+
+async def get_semantic_answer(query_embedding: List[float], category_id: Optional[int]) -> Optional[str]:
+    """
+    Tìm câu trả lời đã lưu cho câu hỏi gần giống trong cùng category
+
+    Returns:
+        str: JSON {"message","links"} đã lưu, None nếu miss
+    """
+    if not SEMANTIC_CACHE_ENABLED or category_id is None or not query_embedding:
+        return None
+
+    entries = _entries.get(category_id)
+    if not entries:
+        _stats["misses"] += 1
+        return None
+
+    now = time.monotonic()
+    for entry_id in [k for k, e in entries.items() if e["expire_at"] < now]:
+        del entries[entry_id]
+
+    query_vector = _normalize(query_embedding)
+    best_id, best_score = None, -1.0
+    for entry_id, entry in entries.items():
+        if entry["vector"].shape != query_vector.shape:
+            continue
+        score = float(entry["vector"] @ query_vector)
+        if score > best_score:
+            best_id, best_score = entry_id, score
+
+    if best_id is None or best_score < SEMANTIC_CACHE_THRESHOLD:
+        _stats["misses"] += 1
+        return None
+
+    entry = entries[best_id]
+    versions = await _get_versions(entry["version_keys"])
+    if versions is None or versions != entry["versions"]:
+        # Chunks nguồn đã thay đổi (hoặc không kiểm tra được) → bỏ entry
+        del entries[best_id]
+        _stats["stale"] += 1
+        _stats["misses"] += 1
+        return None
+
+    entries.move_to_end(best_id)
+    _stats["hits"] += 1
+    logger.info(f"Semantic cache hit category={category_id} score={best_score:.4f}")
+    return entry["answer"]
+
+
+async def store_semantic_answer(
+    query_embedding: List[float],
+    category_id: Optional[int],
+    answer: str,
+    knowledge: List[Dict],
+    epoch: Optional[str]
+) -> None:
+    """
+    Lưu câu trả lời kèm danh sách knowledge_id của các chunk đã dùng để sinh câu trả lời
+
+    Args:
+        epoch: giá trị get_semantic_cache_epoch() đọc trước khi tìm tài liệu
+    """
+    if not SEMANTIC_CACHE_ENABLED or category_id is None or not query_embedding or not knowledge or epoch is None:
+        return
+
+    knowledge_ids = sorted({
+        str(item.get("metadata", {}).get("knowledge_id"))
+        for item in knowledge
+        if item.get("metadata", {}).get("knowledge_id") is not None
+    })
+    version_keys = _version_keys(category_id, knowledge_ids)
+    versions = await _get_versions(version_keys + [SEMANTIC_CACHE_EPOCH_KEY])
+    if versions is None:
+        # Không có Redis thì không invalidate được giữa các worker → không cache
+        return
+    if (versions.pop() or "0") != epoch:
+        # Knowledge base đã thay đổi trong lúc tìm tài liệu / sinh câu trả lời
+        _stats["skipped_invalidated"] += 1
+        return
+
+    entries = _entries.setdefault(category_id, OrderedDict())
+    entries[next(_entry_ids)] = {
+        "vector": _normalize(query_embedding),
+        "answer": answer,
+        "version_keys": version_keys,
+        "versions": versions,
+        "expire_at": time.monotonic() + SEMANTIC_CACHE_TTL
+    }
+    while len(entries) > SEMANTIC_CACHE_MAX_PER_CATEGORY:
+        entries.popitem(last=False)
+    _stats["stored"] += 1
+
+
+async def invalidate_semantic_answers(
+    knowledge_ids: Optional[List] = None,
+    category_ids: Optional[List] = None
+) -> bool:
+    """
+    Bump version cho knowledge_id / category_id, gọi sau khi chunks thay đổi
+    """
+    keys = [get_knowledge_version_key(k) for k in (knowledge_ids or [])]
+    keys += [get_category_version_key(c) for c in (category_ids or [])]
+    if not keys:
+        return True
+    keys.append(SEMANTIC_CACHE_EPOCH_KEY)
+
+    try:
+        client = await redis_cache.get_async_client()
+        if client is None:
+            return False
+        # MULTI: version và epoch đổi cùng lúc
+        async with client.pipeline(transaction=True) as pipe:
+            for key in keys:
+                pipe.incr(key)
+            await pipe.execute()
+        return True
+    except Exception as e:
+        logger.error(f"Error invalidating semantic cache: {e}")
+        return False
+
+
+def get_semantic_cache_stats() -> dict:
+    lookups = _stats["hits"] + _stats["misses"]
+    return {
+        **_stats,
+        "enabled": SEMANTIC_CACHE_ENABLED,
+        "size": sum(len(e) for e in _entries.values()),
+        "hit_ratio": round(_stats["hits"] / lookups, 4) if lookups else None
+    }
@@ -3,6 +3,8 @@ Helper functions để gửi tin nhắn qua các nền tảng social media:
 - Facebook Messenger
 - Telegram
 - Zalo
+Gửi bằng httpx async qua client dùng chung theo nền tảng (config/http_clients.py),
+có timeout và retry khi 429 / 5xx
 """
 
 import asyncio
@@ -10,16 +12,39 @@ import base64
 import inspect
 import io
 import json
-import requests
+import httpx
 import traceback
+from typing import Optional
 from sqlalchemy import select
 from models.facebook_page import FacebookPage
 from models.telegram_page import TelegramBot
 from models.zalo import ZaloBot
 from config.database import AsyncSessionLocal
+import config.http_clients as http_clients
+from config.http_clients import request_with_retry, RETRY_STATUS_CODES
 
 
-def convert_file_to_facebook_attachment_id(file_data, access_token):
+class PlatformDeliveryError(Exception):
+    """Gửi tin nhắn thất bại do lỗi tạm thời (429 / 5xx / mạng), có thể gửi lại sau"""
+
+
+async def send_text_request(platform: str, url: str, **kwargs) -> httpx.Response:
+    """
+    Gửi request text (bước cuối của 1 tin nhắn) qua request_with_retry
+
+    Raises:
+        PlatformDeliveryError: vẫn lỗi tạm thời sau khi đã retry → outbox sẽ gửi lại
+    """
+    try:
+        response = await request_with_retry(platform, "POST", url, **kwargs)
+    except httpx.HTTPError as e:
+        raise PlatformDeliveryError(f"[{platform}] {type(e).__name__}: {e}") from e
+    if response.status_code in RETRY_STATUS_CODES:
+        raise PlatformDeliveryError(f"[{platform}] HTTP {response.status_code}: {response.text[:200]}")
+    return response
+
+
+async def convert_file_to_facebook_attachment_id(file_data, access_token):
     """
     Chuyển đổi file/URL/base64 thành Facebook attachment_id
     
@@ -40,7 +65,7 @@ def convert_file_to_facebook_attachment_id(file_data, access_token):
                 print(f"📷 Phát hiện URL ảnh: {file_data}")
                 # Nếu là URL, tải ảnh về và upload lên Facebook
                 try:
-                    img_response = requests.get(file_data, timeout=10)
+                    img_response = await request_with_retry("media", "GET", file_data)
                     if img_response.status_code == 200:
                         image_bytes = img_response.content
                         # Lấy loại ảnh từ URL hoặc content-type
@@ -84,7 +109,7 @@ def convert_file_to_facebook_attachment_id(file_data, access_token):
             image_type = 'jpeg'
         
         # Upload lên Facebook để lấy attachment_id
-        url = f"https://graph.facebook.com/v23.0/me/message_attachments"
+        url = f"{http_clients.FACEBOOK_GRAPH_URL}/v23.0/me/message_attachments"
         
         params = {
             'access_token': access_token
@@ -105,12 +130,13 @@ def convert_file_to_facebook_attachment_id(file_data, access_token):
         if hasattr(image_file, 'seek'):
             image_file.seek(0)
         
+        # Đọc ra bytes để có thể gửi lại khi retry
         files = {
-            'filedata': (getattr(image_file, 'name', 'image.jpg'), image_file, f'image/{image_type}')
+            'filedata': (getattr(image_file, 'name', 'image.jpg'), image_file.read(), f'image/{image_type}')
         }
         
         print(f"📤 Đang upload ảnh lên Facebook...")
-        response = requests.post(url, params=params, data=payload, files=files)
+        response = await request_with_retry("facebook", "POST", url, params=params, data=payload, files=files)
         
         if response.status_code == 200:
             result = response.json()
@@ -131,7 +157,12 @@ def convert_file_to_facebook_attachment_id(file_data, access_token):
         return None
 
 
-async def send_fb(page_id: str, sender_id, data, images=None):
+async def send_fb(page_id: str, sender_id, data, images=None, progress: Optional[dict] = None):
+    """
+    progress: trạng thái các bước đã gửi xong, giữ qua các lần outbox gửi lại
+    để lần sau chỉ gửi lại bước lỗi (không upload / gửi lại ảnh khi chỉ text lỗi)
+    """
+    progress = {} if progress is None else progress
     async with AsyncSessionLocal() as db:
         try:
             # Async query
@@ -141,8 +172,8 @@ async def send_fb(page_id: str, sender_id, data, images=None):
                 return
            
             PAGE_ACCESS_TOKEN = page.access_token
-            url_text = f"https://graph.facebook.com/v23.0/{page_id}/messages?access_token={PAGE_ACCESS_TOKEN}"
-            url_image = f"https://graph.facebook.com/v23.0/me/messages?access_token={PAGE_ACCESS_TOKEN}"
+            url_text = f"{http_clients.FACEBOOK_GRAPH_URL}/v23.0/{page_id}/messages?access_token={PAGE_ACCESS_TOKEN}"
+            url_image = f"{http_clients.FACEBOOK_GRAPH_URL}/v23.0/me/messages?access_token={PAGE_ACCESS_TOKEN}"
             
             # Ưu tiên sử dụng tham số images nếu được truyền vào
             images_data = None
@@ -156,7 +187,9 @@ async def send_fb(page_id: str, sender_id, data, images=None):
                 images_data = data['image']
                 print(f"📸 Sử dụng images từ data['image']")
            
-            if images_data:
+            if images_data and progress.get("images_sent"):
+                print("ℹ️ Ảnh đã gửi ở lần trước, chỉ gửi lại text")
+            elif images_data:
                 try:
                     if isinstance(images_data, str):
                         images = json.loads(images_data)
@@ -168,42 +201,47 @@ async def send_fb(page_id: str, sender_id, data, images=None):
                     if images and len(images) > 0:
                         print(f"📤 Đang xử lý {len(images)} ảnh để gửi qua Facebook")
                         
-                        for image_data in images:
-                            attachment_id = convert_file_to_facebook_attachment_id(image_data, PAGE_ACCESS_TOKEN)
+                        async def send_image(image_data):
+                            attachment_id = await convert_file_to_facebook_attachment_id(image_data, PAGE_ACCESS_TOKEN)
                             
-                            if attachment_id:
-                                # Gửi tin nhắn với attachment_id
-                                image_payload = {
-                                    "recipient": {
-                                        "id": sender_id
-                                    },
-                                    "message": {
-                                        "attachment": {
-                                            "type": "image",
-                                            "payload": {
-                                                "attachment_id": attachment_id
-                                            }
+                            if not attachment_id:
+                                print(f"❌ Failed to get attachment_id for image")
+                                return
+                            
+                            # Gửi tin nhắn với attachment_id
+                            image_payload = {
+                                "recipient": {
+                                    "id": sender_id
+                                },
+                                "message": {
+                                    "attachment": {
+                                        "type": "image",
+                                        "payload": {
+                                            "attachment_id": attachment_id
                                         }
                                     }
                                 }
-                                
-                                print(f"📋 Image payload for Facebook: {json.dumps(image_payload, indent=2)}")
-                                
-                                try:
-                                    response = requests.post(url_image, json=image_payload)
-                                   
-                                    if response.status_code == 200:
-                                        response_data = response.json()
-                                        print(f"✅ Successfully sent image with attachment_id: {attachment_id}")
-                                        print(f"📬 Message ID: {response_data.get('message_id', 'N/A')}")
-                                    else:
-                                        print(f"❌ Failed to send image: {response.text}")
-                                except requests.exceptions.RequestException as req_error:
-                                    print(f"🌐 Network error sending image: {req_error}")
-                                except Exception as send_error:
-                                    print(f"❌ Unexpected error sending image: {send_error}")
-                            else:
-                                print(f"❌ Failed to get attachment_id for image")
+                            }
+                            
+                            print(f"📋 Image payload for Facebook: {json.dumps(image_payload, indent=2)}")
+                            
+                            try:
+                                response = await request_with_retry("facebook", "POST", url_image, json=image_payload)
+                               
+                                if response.status_code == 200:
+                                    response_data = response.json()
+                                    print(f"✅ Successfully sent image with attachment_id: {attachment_id}")
+                                    print(f"📬 Message ID: {response_data.get('message_id', 'N/A')}")
+                                else:
+                                    print(f"❌ Failed to send image: {response.text}")
+                            except httpx.HTTPError as req_error:
+                                print(f"🌐 Network error sending image: {req_error}")
+                            except Exception as send_error:
+                                print(f"❌ Unexpected error sending image: {send_error}")
+                        
+                        # Upload + gửi các ảnh song song, text gửi sau khi xong ảnh để giữ thứ tự
+                        await asyncio.gather(*[send_image(image_data) for image_data in images])
+                        progress["images_sent"] = True
                     else:
                         print("⚠️ No images found in data")
                 except Exception as img_error:
@@ -250,7 +288,7 @@ async def send_fb(page_id: str, sender_id, data, images=None):
                     
                         print(f"📋 Text payload for Facebook: {json.dumps(text_payload, indent=2)}")
                     
-                        response = requests.post(url_text, json=text_payload, timeout=15)
+                        response = await send_text_request("facebook", url_text, json=text_payload)
                     
                         if response.status_code == 200:
                             response_data = response.json()
@@ -260,18 +298,22 @@ async def send_fb(page_id: str, sender_id, data, images=None):
                     else:
                         print("Empty message text, skipping send")
                         
+                except PlatformDeliveryError:
+                    raise
                 except Exception as text_error:
                     print(f"Error sending text message: {text_error}")
                     traceback.print_exc()
             else:
                 print("No text content to send")
                 
+        except PlatformDeliveryError:
+            raise
         except Exception as e:
             print(f"Error in send_fb: {e}")
             traceback.print_exc()
 
 
-async def send_telegram(chat_id, message):
+async def send_telegram(chat_id, message, progress: Optional[dict] = None):
     """
     Gửi tin nhắn qua Telegram - BẤT ĐỒNG BỘ (async)
     ✅ Sử dụng AsyncSession với context manager
@@ -279,7 +321,9 @@ async def send_telegram(chat_id, message):
     Args:
         chat_id: ID của chat/user Telegram
         message: Dữ liệu tin nhắn (có thể là dict hoặc Message object)
+        progress: các bước đã gửi xong ở lần trước (outbox gửi lại), bỏ qua ảnh đã gửi
     """
+    progress = {} if progress is None else progress
     async with AsyncSessionLocal() as db:
         try:
             result = await db.execute(select(TelegramBot).filter(TelegramBot.id == 1))
@@ -294,7 +338,7 @@ async def send_telegram(chat_id, message):
             elif isinstance(message, dict) and 'image' in message:
                 images_data = message['image']
                 
-            if images_data:
+            if images_data and not progress.get("images_sent"):
                 try:
                     # Xử lý dữ liệu ảnh - có thể là string JSON hoặc list
                     if isinstance(images_data, str):
@@ -307,14 +351,21 @@ async def send_telegram(chat_id, message):
                         images = images_data
                         
                     if images and len(images) > 0:
-                        # Gửi từng ảnh
-                        for image_url in images:
-                            photo_url = f"https://api.telegram.org/bot{TELEGRAM_TOKEN}/sendPhoto"
-                            photo_payload = {
+                        # Gửi các ảnh song song, text gửi sau khi xong ảnh để giữ thứ tự
+                        photo_url = f"{http_clients.TELEGRAM_API_URL}/bot{TELEGRAM_TOKEN}/sendPhoto"
+                        results = await asyncio.gather(*[
+                            request_with_retry("telegram", "POST", photo_url, json={
                                 "chat_id": chat_id,
                                 "photo": image_url
-                            }
-                            requests.post(photo_url, json=photo_payload)
+                            })
+                            for image_url in images
+                        ], return_exceptions=True)
+                        for result in results:
+                            if isinstance(result, Exception):
+                                print(f"Error sending image: {result}")
+                            elif result.status_code != 200:
+                                print(f"Error sending image: {result.status_code} - {result.text}")
+                        progress["images_sent"] = True
                 except Exception as img_error:
                     print(f"Error sending image: {img_error}")
             
@@ -327,18 +378,22 @@ async def send_telegram(chat_id, message):
                 
             # Gửi tin nhắn text
             if content_data:
-                text_url = f"https://api.telegram.org/bot{TELEGRAM_TOKEN}/sendMessage"
+                text_url = f"{http_clients.TELEGRAM_API_URL}/bot{TELEGRAM_TOKEN}/sendMessage"
                 payload = {
                     "chat_id": chat_id,
                     "text": content_data
                 }
-                requests.post(text_url, json=payload)
+                response = await send_text_request("telegram", text_url, json=payload)
+                if response.status_code != 200:
+                    print(f"Error sending text: {response.status_code} - {response.text}")
+        except PlatformDeliveryError:
+            raise
         except Exception as e:
             print(e)
             traceback.print_exc()
 
 
-def convert_base64_to_attachment_id(base64_string, token):
+async def convert_base64_to_attachment_id(base64_string, token):
     """
     Chuyển đổi base64 image string thành attachment_id của Zalo
     
@@ -362,21 +417,17 @@ def convert_base64_to_attachment_id(base64_string, token):
         # Decode base64 thành bytes
         image_bytes = base64.b64decode(encoded)
         
-        # Tạo file-like object từ bytes
-        image_file = io.BytesIO(image_bytes)
-        image_file.name = f"image.{image_type}"
-        
         # Upload lên Zalo
-        url = "https://openapi.zalo.me/v2.0/oa/upload/image"
+        url = f"{http_clients.ZALO_API_URL}/v2.0/oa/upload/image"
         headers = {
             "access_token": token
         }
         
         files = {
-            'file': (image_file.name, image_file, f'image/{image_type}')
+            'file': (f"image.{image_type}", image_bytes, f'image/{image_type}')
         }
         
-        response = requests.post(url, headers=headers, files=files)
+        response = await request_with_retry("zalo", "POST", url, headers=headers, files=files)
         
         if response.status_code == 200:
             data = response.json()
@@ -397,7 +448,7 @@ def convert_base64_to_attachment_id(base64_string, token):
         return None
 
 
-def send_text_only(url, headers, chat_id, content_text):
+async def send_text_only(url, headers, chat_id, content_text):
     """
     Helper function để gửi tin nhắn text thuần qua Zalo
     
@@ -416,7 +467,7 @@ def send_text_only(url, headers, chat_id, content_text):
         }
     }
     
-    response = requests.post(url, headers=headers, data=json.dumps(payload))
+    response = await send_text_request("zalo", url, headers=headers, content=json.dumps(payload))
     
     if response.status_code == 200:
         print(f"✅ Đã gửi tin nhắn text đến Zalo: {chat_id}")
@@ -424,7 +475,7 @@ def send_text_only(url, headers, chat_id, content_text):
         print(f"❌ Lỗi gửi tin nhắn text: {response.status_code} - {response.text}")
 
 
-async def send_zalo(chat_id, message, images_base64):
+async def send_zalo(chat_id, message, images_base64, progress: Optional[dict] = None):
     """
     Gửi tin nhắn qua Zalo - BẤT ĐỒNG BỘ (async)
     ✅ Sử dụng AsyncSession với context manager
@@ -433,7 +484,9 @@ async def send_zalo(chat_id, message, images_base64):
         chat_id: ID của người nhận trên Zalo
         message: Dữ liệu tin nhắn (có thể là dict hoặc Message object)
         images_base64: List các ảnh dạng base64
+        progress: các bước đã xong ở lần trước (outbox gửi lại), dùng lại attachment_id đã upload
     """
+    progress = {} if progress is None else progress
     async with AsyncSessionLocal() as db:
         try:
             # Lấy thông tin Zalo bot - Async query
@@ -456,7 +509,7 @@ async def send_zalo(chat_id, message, images_base64):
                 print("⚠️ Tin nhắn không có nội dung text")
                 return
             
-            url = "https://openapi.zalo.me/v3.0/oa/message/cs"
+            url = f"{http_clients.ZALO_API_URL}/v3.0/oa/message/cs"
             headers = {
                 "Content-Type": "application/json",
                 "access_token": ACCESS_TOKEN
@@ -467,8 +520,11 @@ async def send_zalo(chat_id, message, images_base64):
                 # Lấy ảnh đầu tiên (Zalo chỉ hỗ trợ 1 ảnh/tin nhắn)
                 first_image = images_base64[0] if isinstance(images_base64, list) else images_base64
                 
-                print(f"🔄 Đang chuyển đổi base64 thành attachment_id...")
-                attachment_id = convert_base64_to_attachment_id(first_image, ACCESS_TOKEN)
+                attachment_id = progress.get("attachment_id")
+                if not attachment_id:
+                    print(f"🔄 Đang chuyển đổi base64 thành attachment_id...")
+                    attachment_id = await convert_base64_to_attachment_id(first_image, ACCESS_TOKEN)
+                    progress["attachment_id"] = attachment_id
                 
                 if attachment_id:
                     # Gửi tin nhắn có ảnh + text
@@ -493,17 +549,45 @@ async def send_zalo(chat_id, message, images_base64):
                         }
                     }
                     
-                    response = requests.post(url, headers=headers, data=json.dumps(payload))
+                    response = await request_with_retry("zalo", "POST", url, headers=headers, content=json.dumps(payload))
                     
                     if response.status_code == 200:
                         print(f"✅ Đã gửi tin nhắn có ảnh đến Zalo: {chat_id}")
                     else:
-                        send_text_only(url, headers, chat_id, content_text)
+                        await send_text_only(url, headers, chat_id, content_text)
                 else:
-                    send_text_only(url, headers, chat_id, content_text)
+                    await send_text_only(url, headers, chat_id, content_text)
             else:
                 # Không có ảnh, gửi chỉ text
-                send_text_only(url, headers, chat_id, content_text)
+                await send_text_only(url, headers, chat_id, content_text)
+        except PlatformDeliveryError:
+            raise
         except Exception as e:
             print(f"❌ Exception trong send_zalo: {e}")
             traceback.print_exc()
+
+
+async def deliver_to_platform(
+    channel: str,
+    page_id: str,
+    recipient_id: str,
+    message_data: dict,
+    images=None,
+    progress: Optional[dict] = None
+):
+    """
+    Gửi 1 tin nhắn ra đúng nền tảng theo channel
+
+    Args:
+        progress: dict do caller giữ qua các lần gửi lại, ghi lại bước đã xong
+            (ảnh đã gửi, attachment_id đã upload) để lần sau chỉ gửi lại bước lỗi
+
+    Raises:
+        PlatformDeliveryError: lỗi tạm thời, có thể gửi lại
+    """
+    if channel == "facebook":
+        await send_fb(page_id, recipient_id, message_data, images, progress)
+    elif channel == "telegram":
+        await send_telegram(recipient_id, message_data, progress)
+    elif channel == "zalo":
+        await send_zalo(recipient_id, message_data, images, progress)
@@ -0,0 +1,183 @@
+"""
+Tuần tự hóa việc sinh câu trả lời bot theo session (single-flight)
+- Trong 1 process: asyncio.Lock theo chat_session_id (FIFO) → các lượt sinh của 1 session
+  chạy lần lượt theo thứ tự tới, lượt sau đọc được câu trả lời đã lưu của lượt trước
+- Nhiều worker: thêm Redis lock (SET NX PX + token, tự gia hạn khi đang giữ)
+  → không có 2 worker sinh câu trả lời cho cùng 1 session cùng lúc
+- Báo thời gian chờ trong hàng đợi (queue_wait_ms) cho từng lượt và thống kê tổng
+- Redis lỗi hoặc chờ quá BOT_SESSION_LOCK_WAIT giây → chạy tiếp chỉ với lock trong process
+- Lock hết hạn khi đang giữ: nhận lại nếu chưa ai giữ, worker khác đã giữ thì cancel lượt đang sinh
+  (không để 2 worker cùng trả lời 1 session)
+"""
+
+import asyncio
+import logging
+import os
+import time
+import uuid
+from contextlib import asynccontextmanager
+from typing import Dict, Optional
+from config.redis_cache import redis_cache
+
+logger = logging.getLogger(__name__)
+
+
+BOT_SESSION_LOCK_ENABLED = os.getenv("BOT_SESSION_LOCK_ENABLED", "true").lower() == "true"
+# Thời hạn Redis lock (ms), được gia hạn mỗi 1/3 thời hạn khi đang giữ
+BOT_SESSION_LOCK_TTL_MS = int(os.getenv("BOT_SESSION_LOCK_TTL_MS", 30000))
+# Thời gian chờ Redis lock tối đa (giây) trước khi bỏ qua lock giữa các worker
+BOT_SESSION_LOCK_WAIT = float(os.getenv("BOT_SESSION_LOCK_WAIT", 120))
+BOT_SESSION_LOCK_POLL_MS = int(os.getenv("BOT_SESSION_LOCK_POLL_MS", 100))
+
+# KEYS[1] = key lock, ARGV[1] = token, ARGV[2] = thời hạn (ms, chỉ dùng khi gia hạn)
+RENEW_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('PEXPIRE', KEYS[1], ARGV[2])
+end
+return 0
+"""
+
+RELEASE_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
+_scripts: Dict[int, dict] = {}
+
+_local_locks: Dict[int, asyncio.Lock] = {}
+# Số lượt đang giữ / chờ lock theo session, về 0 thì bỏ lock khỏi dict
+_users: Dict[int, int] = {}
+
+_stats = {
+    "acquired": 0,
+    "queued": 0,
+    "wait_ms_total": 0.0,
+    "wait_ms_max": 0.0,
+    "redis_lock_timeouts": 0,
+    "redis_lock_lost": 0
+}
+
+
+def get_session_lock_key(chat_session_id: int) -> str:
+    return f"bot_generation_lock:{chat_session_id}"
+
+
+def _get_scripts(client) -> dict:
+    scripts = _scripts.get(id(client))
+    if scripts is None:
+        scripts = {
+            "renew": client.register_script(RENEW_SCRIPT),
+            "release": client.register_script(RELEASE_SCRIPT)
+        }
+        _scripts[id(client)] = scripts
+    return scripts
+
+
+async def _acquire_redis_lock(chat_session_id: int) -> Optional[tuple]:
+    """
+    Returns:
+        Optional[tuple]: (client, token) nếu giữ được lock, None nếu không dùng được Redis / chờ quá lâu
+    """
+    try:
+        client = await redis_cache.get_async_client()
+    except Exception as e:
+        logger.error(f"Error getting Redis client for session lock: {e}")
+        return None
+    if client is None:
+        return None
+
+    key = get_session_lock_key(chat_session_id)
+    token = uuid.uuid4().hex
+    deadline = time.monotonic() + BOT_SESSION_LOCK_WAIT
+    try:
+        while not await client.set(key, token, nx=True, px=BOT_SESSION_LOCK_TTL_MS):
+            if time.monotonic() >= deadline:
+                _stats["redis_lock_timeouts"] += 1
+                logger.warning(f"Chờ lock sinh câu trả lời session {chat_session_id} quá {BOT_SESSION_LOCK_WAIT}s, bỏ qua lock")
+                return None
+            await asyncio.sleep(BOT_SESSION_LOCK_POLL_MS / 1000)
+    except Exception as e:
+        logger.error(f"Error acquiring session lock {key}: {e}")
+        return None
+    return client, token
+
+
+async def _renew_redis_lock(client, key: str, token: str, holder: asyncio.Task) -> None:
+    while True:
+        await asyncio.sleep(BOT_SESSION_LOCK_TTL_MS / 3000)
+        try:
+            if await _get_scripts(client)["renew"](keys=[key], args=[token, BOT_SESSION_LOCK_TTL_MS]):
+                continue
+            # Lock đã hết hạn: chưa ai nhận thì giữ lại, worker khác đã nhận thì dừng lượt này
+            if await client.set(key, token, nx=True, px=BOT_SESSION_LOCK_TTL_MS):
+                logger.warning(f"Lock {key} đã hết hạn khi đang sinh câu trả lời, đã nhận lại")
+                continue
+        except Exception as e:
+            logger.error(f"Error renewing session lock {key}: {e}")
+            continue
+
+        _stats["redis_lock_lost"] += 1
+        logger.warning(f"Mất lock {key} khi đang sinh câu trả lời, worker khác đã nhận → hủy lượt này")
+        holder.cancel()
+        return
+
+
+@asynccontextmanager
+async def session_generation_slot(chat_session_id: int):
+    """
+    Giữ lượt sinh câu trả lời của session, trả về thời gian đã chờ trong hàng đợi (ms)
+
+        async with session_generation_slot(chat_session_id) as queue_wait_ms:
+            ...
+
+    Task đang giữ lượt bị cancel nếu Redis lock bị worker khác nhận mất
+    """
+    if not BOT_SESSION_LOCK_ENABLED:
+        yield 0.0
+        return
+
+    started = time.perf_counter()
+    lock = _local_locks.setdefault(chat_session_id, asyncio.Lock())
+    _users[chat_session_id] = _users.get(chat_session_id, 0) + 1
+    if lock.locked():
+        _stats["queued"] += 1
+    try:
+        async with lock:
+            redis_lock = await _acquire_redis_lock(chat_session_id)
+            wait_ms = round((time.perf_counter() - started) * 1000, 2)
+            _stats["acquired"] += 1
+            _stats["wait_ms_total"] += wait_ms
+            _stats["wait_ms_max"] = max(_stats["wait_ms_max"], wait_ms)
+
+            renew_task = None
+            if redis_lock is not None:
+                client, token = redis_lock
+                key = get_session_lock_key(chat_session_id)
+                renew_task = asyncio.create_task(_renew_redis_lock(client, key, token, asyncio.current_task()))
+            try:
+                yield wait_ms
+            finally:
+                if renew_task is not None:
+                    renew_task.cancel()
+                    try:
+                        await _get_scripts(client)["release"](keys=[key], args=[token])
+                    except Exception as e:
+                        logger.error(f"Error releasing session lock {key}: {e}")
+    finally:
+        _users[chat_session_id] -= 1
+        if _users[chat_session_id] == 0:
+            _users.pop(chat_session_id, None)
+            _local_locks.pop(chat_session_id, None)
+
+
+def get_session_lock_stats() -> dict:
+    return {
+        **_stats,
+        "wait_ms_total": round(_stats["wait_ms_total"], 2),
+        "wait_ms_avg": round(_stats["wait_ms_total"] / _stats["acquired"], 2) if _stats["acquired"] else None,
+        "enabled": BOT_SESSION_LOCK_ENABLED,
+        "active_sessions": len(_users),
+        "waiting": sum(_users.values()) - sum(1 for lock in _local_locks.values() if lock.locked())
+    }
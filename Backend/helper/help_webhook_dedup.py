@@ -0,0 +1,147 @@
+"""
+Chống xử lý trùng webhook khi nền tảng gửi lại (timeout, lỗi mạng...)
+- Khóa theo id tin nhắn của nền tảng: Facebook `mid`, Telegram `update_id`, Zalo `msg_id`
+- SET NX EX trên Redis trong cửa sổ WEBHOOK_DEDUP_TTL: lần đầu ghi được → xử lý, lần sau → bỏ
+- Chạy ngay khi nhận webhook, trước khi đưa vào hàng đợi / đụng tới DB, LLM
+- Facebook có thể gom nhiều event trong 1 webhook → lọc từng event, chỉ bỏ cả webhook khi mọi event đều trùng
+- Event chưa được xử lý (hàng đợi đầy → 503, xử lý lỗi → dead-letter) thì xóa khóa bằng
+  release_webhook_dedup để lần nền tảng gửi lại vẫn được xử lý, không bị coi là trùng
+- Redis lỗi → cho qua (thà xử lý trùng còn hơn mất tin)
+"""
+
+import copy
+import logging
+import os
+from typing import List, Optional
+from config.redis_cache import redis_cache
+
+logger = logging.getLogger(__name__)
+
+
+WEBHOOK_DEDUP_ENABLED = os.getenv("WEBHOOK_DEDUP_ENABLED", "true").lower() == "true"
+# Cửa sổ chống trùng (giây), nền tảng thường gửi lại trong vài giờ
+WEBHOOK_DEDUP_TTL = int(os.getenv("WEBHOOK_DEDUP_TTL", 86400))
+
+WEBHOOK_DEDUP_STATS_KEY = "webhook_dedup:stats"
+
+_stats = {
+    "checked": 0,
+    "duplicates": 0,
+    "dropped_webhooks": 0,
+    "without_id": 0,
+    "released": 0
+}
+
+
+def get_dedup_key(platform: str, message_id) -> str:
+    return f"webhook_dedup:{platform}:{message_id}"
+
+
+def _get_facebook_mid(event: dict) -> Optional[str]:
+    return (event.get("message") or {}).get("mid")
+
+
+def extract_message_ids(platform: str, body: dict) -> List[Optional[str]]:
+    """
+    Lấy id tin nhắn trong webhook (Facebook trả về 1 id cho mỗi messaging event, có thể None)
+    """
+    if platform == "fb":
+        return [
+            _get_facebook_mid(event)
+            for entry in body.get("entry") or []
+            for event in entry.get("messaging") or []
+        ]
+    if platform == "tele":
+        update_id = body.get("update_id")
+        return [str(update_id) if update_id is not None else None]
+    if platform == "zalo":
+        return [(body.get("message") or {}).get("msg_id")]
+    return [None]
+
+
+async def filter_duplicate_webhook(platform: str, body: dict) -> Optional[dict]:
+    """
+    Bỏ các event đã xử lý khỏi webhook
+
+    Returns:
+        Optional[dict]: body cần xử lý (đã lọc event trùng), None nếu toàn bộ là trùng
+    """
+    if not WEBHOOK_DEDUP_ENABLED:
+        return body
+
+    message_ids = extract_message_ids(platform, body)
+    ids = [message_id for message_id in message_ids if message_id]
+    _stats["without_id"] += len(message_ids) - len(ids)
+    if not ids:
+        return body
+
+    try:
+        client = await redis_cache.get_async_client()
+        if client is None:
+            return body
+        pipe = client.pipeline(transaction=False)
+        for message_id in ids:
+            pipe.set(get_dedup_key(platform, message_id), 1, nx=True, ex=WEBHOOK_DEDUP_TTL)
+        results = await pipe.execute()
+    except Exception as e:
+        logger.error(f"Error checking webhook dedup: {e}")
+        return body
+
+    duplicates = {message_id for message_id, created in zip(ids, results) if not created}
+    _stats["checked"] += len(ids)
+    if not duplicates:
+        return body
+
+    _stats["duplicates"] += len(duplicates)
+    try:
+        await client.hincrby(WEBHOOK_DEDUP_STATS_KEY, platform, len(duplicates))
+    except Exception as e:
+        logger.error(f"Error counting webhook duplicates: {e}")
+
+    if platform == "fb":
+        body = copy.deepcopy(body)
+        for entry in body.get("entry") or []:
+            entry["messaging"] = [
+                event for event in entry.get("messaging") or []
+                if _get_facebook_mid(event) not in duplicates
+            ]
+        body["entry"] = [entry for entry in body.get("entry") or [] if entry["messaging"]]
+        if body["entry"]:
+            return body
+    logger.info(f"[webhook] Bỏ webhook {platform} trùng: {sorted(duplicates)}")
+    _stats["dropped_webhooks"] += 1
+    return None
+
+
+async def release_webhook_dedup(platform: str, body: dict) -> None:
+    """
+    Xóa khóa chống trùng của các event trong body (đã ghi ở filter_duplicate_webhook
+    nhưng event chưa được xử lý) để webhook gửi lại không bị bỏ
+    """
+    if not WEBHOOK_DEDUP_ENABLED:
+        return
+
+    try:
+        ids = [message_id for message_id in extract_message_ids(platform, body) if message_id]
+        if not ids:
+            return
+        client = await redis_cache.get_async_client()
+        if client is None:
+            return
+        await client.delete(*[get_dedup_key(platform, message_id) for message_id in ids])
+        _stats["released"] += len(ids)
+    except Exception as e:
+        logger.error(f"Error releasing webhook dedup keys: {e}")
+
+
+async def get_webhook_dedup_stats() -> dict:
+    stats = {**_stats, "enabled": WEBHOOK_DEDUP_ENABLED, "ttl": WEBHOOK_DEDUP_TTL, "duplicates_by_platform": None}
+    try:
+        client = await redis_cache.get_async_client()
+        if client is not None:
+            # Tổng số event trùng của mọi worker, theo nền tảng
+            counts = await client.hgetall(WEBHOOK_DEDUP_STATS_KEY)
+            stats["duplicates_by_platform"] = {platform: int(count) for platform, count in counts.items()}
+    except Exception as e:
+        logger.error(f"Error getting webhook dedup stats: {e}")
+    return stats
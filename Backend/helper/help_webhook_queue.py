@@ -0,0 +1,301 @@
+"""
+Hàng đợi webhook (Facebook / Telegram / Zalo) bằng Redis Streams
+- Router chỉ XADD event thô vào stream rồi trả 200, không tạo task không giới hạn
+- Backlog vượt WEBHOOK_MAX_BACKLOG → trả 503 để nền tảng tự gửi lại sau (backpressure)
+- WEBHOOK_CONCURRENCY consumer mỗi process cùng đọc 1 consumer group (xử lý song song có giới hạn)
+- At-least-once: chỉ XACK sau khi xử lý xong; entry của consumer chết quá WEBHOOK_CLAIM_IDLE_MS
+  được consumer khác nhận lại bằng XAUTOCLAIM
+- Xử lý lỗi quá WEBHOOK_MAX_ATTEMPTS lần → chuyển sang stream webhook:failed, gửi lại bằng replay
+- Redis không khả dụng → enqueue trả về None để router xử lý trực tiếp như cũ
+
+Chạy consumer riêng:   python -m helper.help_webhook_queue worker  (đặt WEBHOOK_RUN_IN_APP=false cho API)
+Replay event lỗi:      python -m helper.help_webhook_queue replay [số lượng]
+"""
+
+import asyncio
+import json
+import logging
+import os
+import random
+import socket
+import sys
+import time
+import uuid
+from collections import deque
+from typing import List, Optional
+from config.redis_cache import redis_cache
+from helper.help_webhook_dedup import release_webhook_dedup
+
+logger = logging.getLogger(__name__)
+
+
+WEBHOOK_QUEUE_ENABLED = os.getenv("WEBHOOK_QUEUE_ENABLED", "true").lower() == "true"
+# Chạy consumer ngay trong process API (false nếu đã chạy worker riêng)
+WEBHOOK_RUN_IN_APP = os.getenv("WEBHOOK_RUN_IN_APP", "true").lower() == "true"
+WEBHOOK_CONCURRENCY = int(os.getenv("WEBHOOK_CONCURRENCY", 8))
+# Số event chưa xử lý tối đa trước khi từ chối webhook mới (0 = không giới hạn)
+WEBHOOK_MAX_BACKLOG = int(os.getenv("WEBHOOK_MAX_BACKLOG", 10000))
+WEBHOOK_MAX_ATTEMPTS = int(os.getenv("WEBHOOK_MAX_ATTEMPTS", 3))
+WEBHOOK_RETRY_BASE = float(os.getenv("WEBHOOK_RETRY_BASE", 0.5))
+WEBHOOK_RETRY_MAX = float(os.getenv("WEBHOOK_RETRY_MAX", 10))
+# Entry pending lâu hơn thời gian này (ms) coi như consumer đã chết
+WEBHOOK_CLAIM_IDLE_MS = int(os.getenv("WEBHOOK_CLAIM_IDLE_MS", 60000))
+WEBHOOK_BLOCK_MS = int(os.getenv("WEBHOOK_BLOCK_MS", 2000))
+WEBHOOK_FAILED_MAXLEN = int(os.getenv("WEBHOOK_FAILED_MAXLEN", 10000))
+
+WEBHOOK_STREAM = "webhook:stream"
+WEBHOOK_FAILED_STREAM = "webhook:failed"
+WEBHOOK_GROUP = "webhook"
+
+
+class WebhookQueueFull(Exception):
+    """Backlog webhook vượt WEBHOOK_MAX_BACKLOG"""
+
+
+_worker_id = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:6]}"
+_consumer_tasks: List[asyncio.Task] = []
+
+_stats = {
+    "enqueued": 0,
+    "rejected": 0,
+    "direct_fallback": 0,
+    "processed": 0,
+    "retried": 0,
+    "failed": 0,
+    "reclaimed": 0,
+    "replayed": 0
+}
+# Độ trễ từ lúc nhận webhook tới lúc xử lý xong (ms) của các event gần nhất
+_latencies = deque(maxlen=1000)
+
+
+async def _get_client():
+    try:
+        return await redis_cache.get_async_client()
+    except Exception as e:
+        logger.error(f"Error getting Redis client for webhook queue: {e}")
+        return None
+
+
+async def enqueue_webhook_event(platform: str, body: dict) -> Optional[str]:
+    """
+    Ghi event webhook thô vào stream
+
+    Returns:
+        Optional[str]: id entry, None nếu hàng đợi tắt / Redis lỗi (caller tự xử lý trực tiếp)
+
+    Raises:
+        WebhookQueueFull: backlog đã đầy
+    """
+    if not WEBHOOK_QUEUE_ENABLED:
+        return None
+
+    client = await _get_client()
+    if client is None:
+        _stats["direct_fallback"] += 1
+        return None
+
+    try:
+        if WEBHOOK_MAX_BACKLOG and await client.xlen(WEBHOOK_STREAM) >= WEBHOOK_MAX_BACKLOG:
+            _stats["rejected"] += 1
+            raise WebhookQueueFull(f"Webhook backlog >= {WEBHOOK_MAX_BACKLOG}")
+        entry_id = await client.xadd(WEBHOOK_STREAM, {
+            "platform": platform,
+            "body": json.dumps(body, ensure_ascii=False),
+            "received_at": repr(time.time())
+        })
+    except WebhookQueueFull:
+        raise
+    except Exception as e:
+        logger.error(f"Error enqueueing webhook event: {e}")
+        _stats["direct_fallback"] += 1
+        return None
+
+    _stats["enqueued"] += 1
+    return entry_id
+
+
+async def _handle_event(platform: str, body: dict) -> None:
+    from config.database import AsyncSessionLocal
+    from controllers.social_controller import chat_platform
+
+    async with AsyncSessionLocal() as db:
+        await chat_platform(platform, body, db)
+
+
+async def _ensure_group(client) -> None:
+    try:
+        await client.xgroup_create(WEBHOOK_STREAM, WEBHOOK_GROUP, id="0", mkstream=True)
+    except Exception as e:
+        # BUSYGROUP: group đã tồn tại
+        if "BUSYGROUP" not in str(e):
+            raise
+
+
+async def _process_entry(client, entry_id: str, fields: Optional[dict]) -> None:
+    if fields:
+        attempt = 0
+        while True:
+            attempt += 1
+            try:
+                await _handle_event(fields["platform"], json.loads(fields["body"]))
+            except Exception as e:
+                if attempt < WEBHOOK_MAX_ATTEMPTS:
+                    _stats["retried"] += 1
+                    delay = random.uniform(0, min(WEBHOOK_RETRY_MAX, WEBHOOK_RETRY_BASE * 2 ** (attempt - 1)))
+                    logger.warning(f"[webhook] {entry_id} lỗi, xử lý lại lần {attempt + 1} sau {delay:.2f}s: {e}")
+                    await asyncio.sleep(delay)
+                    continue
+                await client.xadd(WEBHOOK_FAILED_STREAM, {
+                    **fields,
+                    "source_id": entry_id,
+                    "attempts": attempt,
+                    "error": f"{type(e).__name__}: {e}"[:1000],
+                    "failed_at": repr(time.time())
+                }, maxlen=WEBHOOK_FAILED_MAXLEN, approximate=True)
+                _stats["failed"] += 1
+                logger.error(f"[webhook] {entry_id} ({fields.get('platform')}) chuyển sang {WEBHOOK_FAILED_STREAM}: {e}")
+                # Event chưa xử lý được → nền tảng gửi lại / replay không bị coi là trùng
+                await release_webhook_dedup(fields["platform"], json.loads(fields["body"]))
+                break
+
+            _stats["processed"] += 1
+            try:
+                _latencies.append((time.time() - float(fields.get("received_at") or 0)) * 1000)
+            except ValueError:
+                pass
+            break
+
+    pipe = client.pipeline(transaction=False)
+    pipe.xack(WEBHOOK_STREAM, WEBHOOK_GROUP, entry_id)
+    pipe.xdel(WEBHOOK_STREAM, entry_id)
+    await pipe.execute()
+
+
+async def _run_consumer(index: int) -> None:
+    consumer = f"{_worker_id}-{index}"
+    # Consumer đầu tiên lo việc nhận lại entry của consumer đã chết
+    claim_at = 0.0
+
+    while True:
+        try:
+            client = await _get_client()
+            if client is None:
+                await asyncio.sleep(WEBHOOK_BLOCK_MS / 1000)
+                continue
+            await _ensure_group(client)
+
+            entries = []
+            if index == 0 and time.monotonic() >= claim_at:
+                claim_at = time.monotonic() + WEBHOOK_CLAIM_IDLE_MS / 2000
+                claimed = await client.xautoclaim(
+                    WEBHOOK_STREAM, WEBHOOK_GROUP, consumer,
+                    min_idle_time=WEBHOOK_CLAIM_IDLE_MS, start_id="0-0", count=10
+                )
+                entries = claimed[1]
+                _stats["reclaimed"] += len(entries)
+            if not entries:
+                response = await client.xreadgroup(
+                    WEBHOOK_GROUP, consumer, {WEBHOOK_STREAM: ">"},
+                    count=1, block=WEBHOOK_BLOCK_MS
+                )
+                entries = response[0][1] if response else []
+
+            for entry_id, fields in entries:
+                await _process_entry(client, entry_id, fields)
+
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"[webhook] Lỗi consumer {consumer}: {e}")
+            await asyncio.sleep(1)
+
+
+async def start_webhook_consumers(concurrency: Optional[int] = None) -> None:
+    if not WEBHOOK_QUEUE_ENABLED or _consumer_tasks:
+        return
+    for index in range(concurrency or WEBHOOK_CONCURRENCY):
+        _consumer_tasks.append(asyncio.create_task(_run_consumer(index)))
+    logger.info(f"[webhook] Worker {_worker_id} started {len(_consumer_tasks)} consumers")
+
+
+async def stop_webhook_consumers() -> None:
+    for task in _consumer_tasks:
+        task.cancel()
+    await asyncio.gather(*_consumer_tasks, return_exceptions=True)
+    _consumer_tasks.clear()
+
+
+async def replay_failed_webhooks(limit: Optional[int] = None) -> int:
+    """
+    Đưa các event trong webhook:failed trở lại hàng đợi chính (cũ nhất trước)
+
+    Returns:
+        int: số event đã replay
+    """
+    client = await _get_client()
+    if client is None:
+        return 0
+
+    entries = await client.xrange(WEBHOOK_FAILED_STREAM, count=limit)
+    for failed_id, fields in entries:
+        await client.xadd(WEBHOOK_STREAM, {
+            "platform": fields["platform"],
+            "body": fields["body"],
+            "received_at": repr(time.time()),
+            "replayed_from": failed_id
+        })
+        await client.xdel(WEBHOOK_FAILED_STREAM, failed_id)
+        _stats["replayed"] += 1
+    return len(entries)
+
+
+async def get_webhook_queue_stats() -> dict:
+    latencies = sorted(_latencies)
+    stats = {
+        **_stats,
+        "enabled": WEBHOOK_QUEUE_ENABLED,
+        "worker_id": _worker_id,
+        "consumers": len(_consumer_tasks),
+        "latency_ms": {
+            "p50": round(latencies[len(latencies) // 2], 2) if latencies else None,
+            "p95": round(latencies[int(len(latencies) * 0.95) - 1], 2) if len(latencies) >= 20 else None,
+            "max": round(latencies[-1], 2) if latencies else None
+        },
+        "backlog": None,
+        "failed_backlog": None
+    }
+
+    client = await _get_client()
+    if client is None:
+        return stats
+    try:
+        pipe = client.pipeline(transaction=False)
+        pipe.xlen(WEBHOOK_STREAM)
+        pipe.xlen(WEBHOOK_FAILED_STREAM)
+        # Entry được XDEL sau khi ack nên độ dài stream = số event chưa xử lý xong
+        stats["backlog"], stats["failed_backlog"] = await pipe.execute()
+    except Exception as e:
+        logger.error(f"Error getting webhook queue depth: {e}")
+    return stats
+
+
+async def _run_worker_forever() -> None:
+    await start_webhook_consumers()
+    try:
+        await asyncio.gather(*_consumer_tasks)
+    finally:
+        await stop_webhook_consumers()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    command = sys.argv[1] if len(sys.argv) > 1 else "worker"
+    if command == "replay":
+        count = asyncio.run(replay_failed_webhooks(int(sys.argv[2]) if len(sys.argv) > 2 else None))
+        print(f"✅ Đã replay {count} event webhook")
+    else:
+        try:
+            asyncio.run(_run_worker_forever())
+        except KeyboardInterrupt:
+            pass
@@ -1,9 +1,13 @@
 import asyncio
+import contextlib
 import json
 import os
+import time
 import traceback
+import uuid
 from datetime import datetime, timedelta
-from sqlalchemy import select
+from typing import Optional
+from sqlalchemy import select, insert
 from models.chat import ChatSession, Message
 from helper.help_redis import (
     cache_session_data,
@@ -12,12 +16,21 @@ from helper.help_redis import (
 from config.database import AsyncSessionLocal
 from sqlalchemy.ext.asyncio import AsyncSession
 from llm.help_llm import generate_response_prompt, get_current_model
+from helper.help_outbox import enqueue_platform_message
+from helper.help_debounce import mark_generation_committed
+from helper.help_session_lock import session_generation_slot
 
     
 from config.websocket_manager import ConnectionManager
 manager = ConnectionManager()
 
 
+# Stream câu trả lời bot (frame bot_delta) cho client kết nối với ?stream=1
+BOT_STREAMING_ENABLED = os.getenv("BOT_STREAMING_ENABLED", "true").lower() == "true"
+# Gom các delta trong khoảng này (giây) thành 1 frame, tránh gửi 1 frame cho mỗi token
+BOT_STREAM_FLUSH_INTERVAL = float(os.getenv("BOT_STREAM_FLUSH_INTERVAL", 0.05))
+
+
 async def save_message_to_db_background(data: dict, sender_name: str, image_url: list):
     async with AsyncSessionLocal() as new_db:
         try:
@@ -40,6 +53,32 @@ async def save_message_to_db_background(data: dict, sender_name: str, image_url:
 
 
 
+async def save_messages_to_db(rows: list):
+    """
+    Lưu nhiều tin nhắn bằng 1 câu INSERT nhiều dòng (webhook gom nhiều tin nhắn)
+    rows: list dict gồm chat_session_id, sender_type, content (tùy chọn sender_name, image)
+    Được await trong consumer webhook trước khi XACK: lỗi DB raise ra để event được xử lý lại
+    hoặc chuyển sang webhook:failed thay vì mất tin nhắn của khách
+    """
+    if not rows:
+        return
+    async with AsyncSessionLocal() as new_db:
+        now = datetime.now()
+        await new_db.execute(insert(Message).values([
+            {
+                "chat_session_id": row.get("chat_session_id"),
+                "sender_type": row.get("sender_type"),
+                "content": row.get("content"),
+                "sender_name": row.get("sender_name"),
+                "image": row.get("image"),
+                "created_at": now
+            }
+            for row in rows
+        ]))
+        await new_db.commit()
+        print(f"✅ Đã lưu {len(rows)} tin nhắn")
+
+
 async def update_session_admin_background(chat_session_id: int, sender_name: str):
     async with AsyncSessionLocal() as new_db:
         try:
@@ -84,7 +123,7 @@ async def update_session_admin_background(chat_session_id: int, sender_name: str
                     "previous_receiver": db_session.previous_receiver,
                     "time": db_session.time.isoformat() if db_session.time else None
                 }
-                await send_socket_message(chat_session_id, socket_data)
+                await send_socket_message(chat_session_id, socket_data, channel=db_session.channel)
                 
         except Exception as e:
             traceback.print_exc()
@@ -93,27 +132,34 @@ async def update_session_admin_background(chat_session_id: int, sender_name: str
 
 async def send_to_platform_background(channel: str, page_id: str, recipient_id: str, message_data: dict, images=None):
     try:
-        from helper.help_send_social import send_fb, send_telegram, send_zalo
+        from helper.help_send_social import deliver_to_platform
         
-        if channel == "facebook":
-            await send_fb(page_id, recipient_id, message_data, images)
-        elif channel == "telegram":
-            await send_telegram(recipient_id, message_data)
-        elif channel == "zalo":
-            await send_zalo(recipient_id, message_data, images)
-            
+        await deliver_to_platform(channel, page_id, recipient_id, message_data, images)
             
     except Exception as e:
         print(f"❌ [Background] Lỗi gửi tin nhắn {channel}: {e}")
         traceback.print_exc()
 
 
-async def send_socket_message(chat_session_id: int, message: dict):
+async def queue_platform_message(channel: str, page_id: str, recipient_id: str, message_data: dict, images=None):
+    """
+    Đưa tin nhắn vào outbox (giữ thứ tự theo người nhận, retry, dead-letter);
+    outbox tắt hoặc Redis lỗi thì gửi trực tiếp ở background như trước
+    """
+    entry_id = await enqueue_platform_message(channel, page_id, recipient_id, message_data, images)
+    if entry_id is None:
+        asyncio.create_task(send_to_platform_background(channel, page_id, recipient_id, message_data, images))
+
+
+async def send_socket_message(chat_session_id: int, message: dict, stream_only: bool = False, channel: str = None):
+    """
+    channel: kênh của session (web / facebook / telegram / zalo) để gửi cho admin đăng ký theo kênh
+    """
     try:
         
-        await manager.broadcast_to_admins(message)
+        await manager.broadcast_to_admins(message, stream_only=stream_only, channel=channel)
 
-        await manager.send_to_customer(chat_session_id, message)
+        await manager.send_to_customer(chat_session_id, message, stream_only=stream_only, channel=channel)
 
     except Exception as e:
         print(f"Socket send error: {e}")
@@ -148,10 +194,56 @@ async def notify_missing_information(chat_session_id: int, user_question: str, b
         traceback.print_exc()
 
 
+class BotDeltaStreamer:
+    """
+    Gom các phần câu trả lời đang sinh và gửi frame bot_delta
+    cho customer + admin đã đăng ký stream
+    """
+
+    def __init__(self, chat_session_id: int, channel: str = None):
+        self.chat_session_id = chat_session_id
+        self.channel = channel
+        self.stream_id = uuid.uuid4().hex
+        self.seq = 0
+        self.buffer = []
+        self.last_flush = 0.0
+
+    async def push(self, delta: str):
+        self.buffer.append(delta)
+        # Frame đầu gửi ngay, các frame sau gom theo BOT_STREAM_FLUSH_INTERVAL
+        if time.perf_counter() - self.last_flush >= BOT_STREAM_FLUSH_INTERVAL:
+            await self.flush()
+
+    async def flush(self):
+        if not self.buffer:
+            return
+        frame = {
+            "type": "bot_delta",
+            "chat_session_id": self.chat_session_id,
+            "stream_id": self.stream_id,
+            "seq": self.seq,
+            "delta": "".join(self.buffer)
+        }
+        self.buffer = []
+        self.seq += 1
+        self.last_flush = time.perf_counter()
+        await send_socket_message(self.chat_session_id, frame, stream_only=True, channel=self.channel)
+
+
+def parse_response_links(response_json: str) -> list:
+    try:
+        data = json.loads(response_json)
+    except (TypeError, ValueError):
+        return []
+    links = data.get("links") if isinstance(data, dict) else None
+    return links if isinstance(links, list) else []
+
+
 async def generate_bot_response_common(
     user_content: str,
     chat_session_id: int,
-    new_db: AsyncSession
+    new_db: AsyncSession,
+    on_delta=None
 ) -> dict:
    
     model_info = await get_current_model(
@@ -167,6 +259,18 @@ async def generate_bot_response_common(
     embedding_key = model_info["embedding"]["key"]
     embedding_model_name = model_info["embedding"]["name"]
     
+    # Thời gian từng stage (ms) của pipeline, gửi kèm response
+    timings = {}
+    started = time.perf_counter()
+    
+    stream_delta = None
+    if on_delta is not None:
+        async def stream_delta(delta: str):
+            # Time-to-first-token tính từ lúc bắt đầu pipeline
+            if "first_delta_ms" not in timings:
+                timings["first_delta_ms"] = round((time.perf_counter() - started) * 1000, 2)
+            await on_delta(delta)
+    
     response_json = await generate_response_prompt(
         db_session=new_db,
         query=user_content,
@@ -174,9 +278,17 @@ async def generate_bot_response_common(
         bot_key=bot_key,
         bot_model_name=bot_model_name,
         embedding_key=embedding_key,
-        embedding_model_name=embedding_model_name
+        embedding_model_name=embedding_model_name,
+        timings=timings,
+        on_delta=stream_delta
     )
     
+    timings["total_ms"] = round((time.perf_counter() - started) * 1000, 2)
+    print(f"⏱️ Pipeline timings session {chat_session_id}: {timings}")
+    # Đã có câu trả lời: từ đây không hủy (debounce) để tin đã lưu luôn được gửi;
+    # khách đã gửi thêm tin (kể cả tới worker khác) thì raise GenerationSuperseded, lượt mới trả lời chung
+    await mark_generation_committed()
+    
         
     message_bot = Message(
         chat_session_id=chat_session_id,
@@ -208,7 +320,8 @@ async def generate_bot_response_common(
         "sender_type": message_bot.sender_type,
         "sender_name": message_bot.sender_name,
         "content": response_json,
-        "created_at": message_bot.created_at.isoformat() if message_bot.created_at else datetime.now().isoformat()
+        "created_at": message_bot.created_at.isoformat() if message_bot.created_at else datetime.now().isoformat(),
+        "timings": timings
     }
 
 
@@ -219,15 +332,33 @@ async def generate_and_send_bot_response(
     session_data: dict,
     platform: str = None,
     page_id: str = None,
-    sender_id: str = None
+    sender_id: str = None,
+    concurrency_limit: Optional[asyncio.Semaphore] = None
 ):
-    async with AsyncSessionLocal() as new_db:
+    """
+    concurrency_limit: giới hạn số lượt sinh song song, chỉ lấy sau khi đã tới lượt của session
+    để session đang phải chờ không giữ chỗ của các session khác
+    """
+    streamer = None
+    # Mỗi session chỉ 1 lượt sinh tại 1 thời điểm (kể cả giữa các worker), lượt sau chờ
+    # lượt trước lưu + gửi xong để đọc được lịch sử mới nhất và không xen kẽ câu trả lời
+    async with (
+        session_generation_slot(chat_session_id) as queue_wait_ms,
+        concurrency_limit or contextlib.nullcontext(),
+        AsyncSessionLocal() as new_db
+    ):
         try:
             
             
+            # Chỉ stream khi có client đăng ký nhận bot_delta
+            if BOT_STREAMING_ENABLED and manager.has_stream_listeners(chat_session_id):
+                streamer = BotDeltaStreamer(chat_session_id, channel=session_data.get("channel"))
+            
             bot_message_data = await generate_bot_response_common(
-                user_content, chat_session_id, new_db
+                user_content, chat_session_id, new_db,
+                on_delta=streamer.push if streamer else None
             )
+            bot_message_data["timings"]["queue_wait_ms"] = queue_wait_ms
             
             bot_message = {
                 **bot_message_data,
@@ -243,11 +374,18 @@ async def generate_and_send_bot_response(
                 bot_message["current_receiver"] = session_data.get("current_receiver")
                 bot_message["previous_receiver"] = session_data.get("previous_receiver")
 
+            if streamer:
+                await streamer.flush()
+                # Frame cuối giữ nguyên format tin nhắn bot (id đã lưu, content JSON),
+                # thêm stream_id để client thay nội dung đang stream và links đã parse
+                bot_message["stream_id"] = streamer.stream_id
+                bot_message["links"] = parse_response_links(bot_message["content"])
+
 
-            await send_socket_message(chat_session_id, bot_message)
+            await send_socket_message(chat_session_id, bot_message, channel=session_data.get("channel"))
 
             if platform:
-                await send_to_platform_background(
+                await queue_platform_message(
                     channel=platform,
                     page_id=page_id,
                     recipient_id=sender_id,
@@ -256,6 +394,15 @@ async def generate_and_send_bot_response(
                 )
                 
 
+        except asyncio.CancelledError:
+            # Bị hủy vì khách gửi thêm tin (debounce) → báo client bỏ phần đã stream
+            if streamer:
+                await send_socket_message(chat_session_id, {
+                    "type": "bot_cancel",
+                    "chat_session_id": chat_session_id,
+                    "stream_id": streamer.stream_id
+                }, stream_only=True, channel=streamer.channel)
+            raise
         except Exception as e:
             traceback.print_exc()
             await new_db.rollback()
\ No newline at end of file
@@ -1,24 +1,109 @@
 import os
 import json
 import re
-from typing import Optional
-import google.generativeai as genai
+import asyncio
+import time
+from typing import Awaitable, Callable, Dict, Optional
+from google.ai import generativelanguage as glm
+from google.generativeai.types import AsyncGenerateContentResponse
+from config.llm_clients import get_gemini_async_client
+from llm.help_key_health import record_key_success, record_key_failure, ContentBlockedError
+from llm.help_rate_limiter import acquire_llm_budget, RATE_LIMITED_MESSAGE
+from llm.help_stream import MessageStreamExtractor
 
 
+# Model sinh câu trả lời (LLMDetail.name chỉ lưu "gemini"), cũng là model tính budget RPM/TPM
+GEMINI_DEFAULT_MODEL = "gemini-2.0-flash-001"
+# Số request Gemini tối đa chạy đồng thời trên mỗi API key
+GEMINI_MAX_CONCURRENCY_PER_KEY = int(os.getenv("GEMINI_MAX_CONCURRENCY_PER_KEY", 8))
+
+_key_semaphores: Dict[str, asyncio.Semaphore] = {}
+
+
+def get_key_semaphore(api_key: str) -> asyncio.Semaphore:
+    semaphore = _key_semaphores.get(api_key)
+    if semaphore is None:
+        semaphore = asyncio.Semaphore(GEMINI_MAX_CONCURRENCY_PER_KEY)
+        _key_semaphores[api_key] = semaphore
+    return semaphore
+
+
+def build_generate_request(model_name: str, prompt: str) -> glm.GenerateContentRequest:
+    """
+    Request generate_content cho client theo key (GenerativeServiceAsyncClient)
+    Gọi thẳng client public thay vì gắn client vào GenerativeModel (thuộc tính private của SDK)
+    """
+    if "/" not in model_name:
+        model_name = f"models/{model_name}"
+    return glm.GenerateContentRequest(
+        model=model_name,
+        contents=[glm.Content(role="user", parts=[glm.Part(text=prompt)])]
+    )
+
+
+def _has_parts(response) -> bool:
+    # Câu hỏi bị chặn → không có candidate; câu trả lời bị chặn → candidate không có Part
+    return bool(response.candidates) and bool(response.candidates[0].content.parts)
+
+
+def _get_text(response) -> str:
+    if not _has_parts(response):
+        raise ContentBlockedError(
+            f"Gemini không trả về nội dung (prompt_feedback={response.prompt_feedback}, "
+            f"finish_reason={response.candidates[0].finish_reason if response.candidates else None})"
+        )
+    return response.text
+
+
+async def _stream_content(client, request, on_delta: Callable[[str], Awaitable[None]]) -> str:
+    """
+    Stream response, gọi on_delta với phần "message" mới nhận được, trả về toàn bộ text
+    """
+    iterator = await client.stream_generate_content(request)
+    response = await AsyncGenerateContentResponse.from_aiterator(iterator)
+    extractor = MessageStreamExtractor()
+    parts = []
+    async for chunk in response:
+        text = chunk.text if _has_parts(chunk) else ""
+        parts.append(text)
+        delta = extractor.feed(text)
+        if delta:
+            await on_delta(delta)
+    if not any(parts):
+        raise ContentBlockedError(f"Gemini không trả về nội dung (prompt_feedback={response.prompt_feedback})")
+    return "".join(parts)
+
 
 async def generate_gemini_response(
     api_key: str,
     prompt: str,
-    model_name: str = "gemini-2.0-flash-001"
+    model_name: str = GEMINI_DEFAULT_MODEL,
+    on_delta: Optional[Callable[[str], Awaitable[None]]] = None
 ) -> str:
     
+    started = None
     try:
-        # Cấu hình GenAI
-        genai.configure(api_key=api_key)
-        model = genai.GenerativeModel(model_name)
+        # Chờ budget RPM/TPM của key trước khi chiếm slot đồng thời
+        if not await acquire_llm_budget(api_key, model_name, prompt):
+            return json.dumps({"message": RATE_LIMITED_MESSAGE, "links": []}, ensure_ascii=False)
+
+        async with get_key_semaphore(api_key):
+            # Dùng client theo key từ registry thay vì genai.configure (state global)
+            client = get_gemini_async_client(api_key)
+            request = build_generate_request(model_name, prompt)
+
+            # Sinh response bằng async API, không block event loop
+            # Có on_delta → stream từng phần message cho client
+            started = time.perf_counter()
+            if on_delta is None:
+                response = AsyncGenerateContentResponse.from_response(await client.generate_content(request))
+                response_text = _get_text(response)
+            else:
+                response_text = await _stream_content(client, request, on_delta)
+        await record_key_success(api_key, (time.perf_counter() - started) * 1000)
+        started = None
 
-        # Sinh response
-        response_text = model.generate_content(prompt).text.strip()
+        response_text = response_text.strip()
         
         # Parse JSON response
         try:
@@ -40,6 +125,8 @@ async def generate_gemini_response(
 
     except Exception as e:
         print(f"❌ Lỗi khi gọi Gemini API: {e}")
+        if started is not None:
+            await record_key_failure(api_key, e, (time.perf_counter() - started) * 1000)
         error_response = {
             "message": "Xin lỗi, đã có lỗi xảy ra khi xử lý câu hỏi của bạn.",
             "links": []
@@ -1,25 +1,75 @@
 import json
 import re
-from typing import Optional
-from openai import AsyncOpenAI
+import time
+from typing import Awaitable, Callable, Optional
+from config.llm_clients import get_openai_client
+from llm.help_key_health import record_key_success, record_key_failure, ContentBlockedError
+from llm.help_rate_limiter import acquire_llm_budget, RATE_LIMITED_MESSAGE
+from llm.help_stream import MessageStreamExtractor
+
+
+# Model sinh câu trả lời (LLMDetail.name chỉ lưu "gpt"), cũng là model tính budget RPM/TPM
+GPT_DEFAULT_MODEL = "gpt-4o-mini"
+
+
+async def _stream_completion(client, model_name: str, prompt: str, on_delta: Callable[[str], Awaitable[None]]) -> str:
+    """
+    Stream completion, gọi on_delta với phần "message" mới nhận được, trả về toàn bộ text
+    """
+    stream = await client.chat.completions.create(
+        model=model_name,
+        messages=[{"role": "user", "content": prompt}],
+        temperature=0.7,
+        stream=True
+    )
+    extractor = MessageStreamExtractor()
+    parts = []
+    finish_reason = None
+    async for chunk in stream:
+        if not chunk.choices:
+            continue
+        text = chunk.choices[0].delta.content or ""
+        finish_reason = chunk.choices[0].finish_reason or finish_reason
+        parts.append(text)
+        delta = extractor.feed(text)
+        if delta:
+            await on_delta(delta)
+    if not any(parts):
+        raise ContentBlockedError(f"OpenAI không trả về nội dung (finish_reason={finish_reason})")
+    return "".join(parts)
 
 
 async def generate_gpt_response(
     api_key: str,
     prompt: str,
-    model_name: str = "gpt-4o-mini"
+    model_name: str = GPT_DEFAULT_MODEL,
+    on_delta: Optional[Callable[[str], Awaitable[None]]] = None
 ) -> str:
 
+    if not await acquire_llm_budget(api_key, model_name, prompt):
+        return json.dumps({"message": RATE_LIMITED_MESSAGE, "links": []}, ensure_ascii=False)
+
+    started = time.perf_counter()
     try:
-        client = AsyncOpenAI(api_key=api_key)
-        response = await client.chat.completions.create(
-            model=model_name,
-            messages=[{"role": "user", "content": prompt}],
-            temperature=0.7
-        )
-        await client.close()
+        client = get_openai_client(api_key)
+        if on_delta is None:
+            response = await client.chat.completions.create(
+                model=model_name,
+                messages=[{"role": "user", "content": prompt}],
+                temperature=0.7
+            )
+            choice = response.choices[0]
+            if choice.message.content is None:
+                # Bị bộ lọc nội dung chặn / chỉ trả về refusal
+                raise ContentBlockedError(f"OpenAI không trả về nội dung (finish_reason={choice.finish_reason})")
+            response_text = choice.message.content
+        else:
+            # Stream từng phần message cho client
+            response_text = await _stream_completion(client, model_name, prompt, on_delta)
+        await record_key_success(api_key, (time.perf_counter() - started) * 1000)
+        started = None
 
-        response_text = response.choices[0].message.content.strip()
+        response_text = response_text.strip()
 
         try:
             cleaned_response = re.sub(r'```json\s*|\s*```', '', response_text).strip()
@@ -38,6 +88,8 @@ async def generate_gpt_response(
     except Exception as e:
         
         print("Error generating GPT response:", str(e))
+        if started is not None:
+            await record_key_failure(api_key, e, (time.perf_counter() - started) * 1000)
         
         error_response = {
             "message": "Xin lỗi, đã có lỗi xảy ra khi xử lý câu hỏi của bạn.",
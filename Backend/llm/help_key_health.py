@@ -0,0 +1,281 @@
+"""
+Theo dõi sức khỏe API key (LLM / embedding)
+- Ghi nhận latency, lỗi, rate limit (429 / hết quota) của từng key sau mỗi lần gọi
+- Key bị rate limit, hoặc lỗi liên tiếp KEY_ERROR_THRESHOLD lần, bị đưa vào cooldown
+- Câu hỏi / câu trả lời bị provider chặn (an toàn, nội dung) không phải lỗi của key → tính là thành công
+  với backoff lũy thừa: KEY_COOLDOWN_BASE * 2^(level-1), tối đa KEY_COOLDOWN_MAX
+- Cooldown lưu trên Redis (dùng chung giữa các worker), scheduler bỏ qua key đang cooldown
+  và tự pin lại các session đang dùng key đó
+- Số liệu latency / số lần lỗi tính theo worker hiện tại
+"""
+
+import hashlib
+import logging
+import os
+import time
+from typing import Dict, List, Optional
+from config.redis_cache import redis_cache
+
+logger = logging.getLogger(__name__)
+
+
+# Số lỗi liên tiếp (không phải rate limit) trước khi cooldown key
+KEY_ERROR_THRESHOLD = int(os.getenv("KEY_ERROR_THRESHOLD", 3))
+# Thời gian cooldown (giây) lần đầu, nhân đôi sau mỗi lần cooldown tiếp theo
+KEY_COOLDOWN_BASE = int(os.getenv("KEY_COOLDOWN_BASE", 30))
+KEY_COOLDOWN_MAX = int(os.getenv("KEY_COOLDOWN_MAX", 900))
+# TTL (giây) của streak lỗi / level backoff, hết hạn thì backoff quay về mức đầu
+KEY_HEALTH_STATE_TTL = int(os.getenv("KEY_HEALTH_STATE_TTL", KEY_COOLDOWN_MAX * 4))
+# Hệ số EWMA cho latency
+LATENCY_EWMA_ALPHA = 0.2
+
+
+# KEYS[1] = streak lỗi, KEYS[2] = level backoff, KEYS[3] = cooldown
+# ARGV[1] = 1 nếu rate limit, ARGV[2] = ngưỡng lỗi, ARGV[3] = base, ARGV[4] = max, ARGV[5] = TTL state
+# Trả về số giây cooldown (0 nếu chưa cooldown)
+RECORD_FAILURE_SCRIPT = """
+local streak = redis.call('INCR', KEYS[1])
+redis.call('EXPIRE', KEYS[1], ARGV[5])
+if ARGV[1] ~= '1' and streak < tonumber(ARGV[2]) then
+    return 0
+end
+
+-- Đang cooldown: lỗi của các request đang bay không tăng thêm backoff
+local ttl = redis.call('TTL', KEYS[3])
+if ttl > 0 then
+    return ttl
+end
+
+local level = redis.call('INCR', KEYS[2])
+redis.call('EXPIRE', KEYS[2], ARGV[5])
+local cooldown = math.floor(math.min(tonumber(ARGV[3]) * 2 ^ (level - 1), tonumber(ARGV[4])))
+redis.call('SET', KEYS[3], level, 'EX', cooldown)
+redis.call('DEL', KEYS[1])
+return cooldown
+"""
+
+_scripts: Dict[int, object] = {}
+
+# fingerprint -> số liệu của key trong worker hiện tại
+_health: Dict[str, dict] = {}
+# cooldown key -> thời điểm hết cooldown (monotonic), dùng khi không có Redis
+_local_cooldowns: Dict[str, float] = {}
+
+
+def get_key_fingerprint(api_key: str) -> str:
+    """Không đưa API key thô vào tên key Redis / log"""
+    return hashlib.sha1((api_key or "").encode("utf-8")).hexdigest()[:16]
+
+
+def get_cooldown_key(api_key: str) -> str:
+    return f"llm_health:cooldown:{get_key_fingerprint(api_key)}"
+
+
+def _get_streak_key(fingerprint: str) -> str:
+    return f"llm_health:streak:{fingerprint}"
+
+
+def _get_level_key(fingerprint: str) -> str:
+    return f"llm_health:level:{fingerprint}"
+
+
+def mask_api_key(api_key: str) -> str:
+    if not api_key or len(api_key) <= 8:
+        return "****"
+    return f"{api_key[:4]}...{api_key[-4:]}"
+
+
+class ContentBlockedError(Exception):
+    """Provider không trả về nội dung vì câu hỏi / câu trả lời bị chặn (an toàn, bộ lọc nội dung)"""
+
+
+def is_content_error(error: Exception) -> bool:
+    """
+    Lỗi do nội dung chứ không do key: ContentBlockedError, Gemini BlockedPromptException /
+    StopCandidateException, OpenAI content_filter / content_policy_violation
+    """
+    if isinstance(error, ContentBlockedError):
+        return True
+    if type(error).__name__ in ("BlockedPromptException", "StopCandidateException"):
+        return True
+    return getattr(error, "code", None) in ("content_filter", "content_policy_violation")
+
+
+def is_rate_limit_error(error: Exception) -> bool:
+    """
+    429 / hết quota: openai.RateLimitError (status_code), google ResourceExhausted (code)
+    hoặc thông báo lỗi chứa dấu hiệu rate limit
+    """
+    status = getattr(error, "status_code", None) or getattr(error, "code", None)
+    if status == 429:
+        return True
+    text = f"{type(error).__name__} {error}".lower()
+    return any(s in text for s in ("429", "quota", "resource_exhausted", "resourceexhausted", "rate limit", "ratelimit"))
+
+
+def _get_entry(fingerprint: str) -> dict:
+    entry = _health.get(fingerprint)
+    if entry is None:
+        entry = {
+            "requests": 0,
+            "successes": 0,
+            "errors": 0,
+            "rate_limited": 0,
+            "content_blocked": 0,
+            "consecutive_failures": 0,
+            "cooldowns": 0,
+            "latency_ms_avg": None,
+            "latency_ms_last": None,
+            "last_error": None,
+            "last_error_at": None,
+            "last_used_at": None
+        }
+        _health[fingerprint] = entry
+    return entry
+
+
+def _record_latency(entry: dict, latency_ms: float) -> None:
+    latency_ms = round(latency_ms, 2)
+    entry["latency_ms_last"] = latency_ms
+    if entry["latency_ms_avg"] is None:
+        entry["latency_ms_avg"] = latency_ms
+    else:
+        entry["latency_ms_avg"] = round(
+            LATENCY_EWMA_ALPHA * latency_ms + (1 - LATENCY_EWMA_ALPHA) * entry["latency_ms_avg"], 2
+        )
+
+
+async def record_key_success(api_key: str, latency_ms: float) -> None:
+    fingerprint = get_key_fingerprint(api_key)
+    entry = _get_entry(fingerprint)
+    entry["requests"] += 1
+    entry["successes"] += 1
+    entry["last_used_at"] = time.time()
+    _record_latency(entry, latency_ms)
+
+    # Chỉ gọi Redis khi worker này vừa thấy lỗi, tránh thêm round trip cho mỗi request
+    if entry["consecutive_failures"]:
+        entry["consecutive_failures"] = 0
+        try:
+            client = await redis_cache.get_async_client()
+            if client is not None:
+                await client.delete(_get_streak_key(fingerprint))
+        except Exception as e:
+            logger.error(f"Error resetting key failure streak: {e}")
+
+
+def _cooldown_local(cooldown_key: str, entry: dict, rate_limited: bool) -> int:
+    if not rate_limited and entry["consecutive_failures"] < KEY_ERROR_THRESHOLD:
+        return 0
+    now = time.monotonic()
+    if _local_cooldowns.get(cooldown_key, 0) > now:
+        return int(_local_cooldowns[cooldown_key] - now)
+    cooldown = min(KEY_COOLDOWN_BASE * 2 ** entry["cooldowns"], KEY_COOLDOWN_MAX)
+    _local_cooldowns[cooldown_key] = now + cooldown
+    return cooldown
+
+
+async def record_key_failure(api_key: str, error: Exception, latency_ms: float) -> int:
+    """
+    Ghi nhận lỗi và đưa key vào cooldown nếu cần
+
+    Returns:
+        int: số giây cooldown của key (0 nếu key chưa bị cooldown)
+    """
+    if is_content_error(error):
+        # Key vẫn gọi được provider, chỉ nội dung bị chặn → không đưa key vào cooldown
+        await record_key_success(api_key, latency_ms)
+        _get_entry(get_key_fingerprint(api_key))["content_blocked"] += 1
+        return 0
+
+    fingerprint = get_key_fingerprint(api_key)
+    cooldown_key = get_cooldown_key(api_key)
+    rate_limited = is_rate_limit_error(error)
+
+    entry = _get_entry(fingerprint)
+    entry["requests"] += 1
+    entry["rate_limited" if rate_limited else "errors"] += 1
+    entry["consecutive_failures"] += 1
+    entry["last_error"] = str(error)[:300]
+    entry["last_error_at"] = time.time()
+    entry["last_used_at"] = time.time()
+    _record_latency(entry, latency_ms)
+
+    cooldown = 0
+    try:
+        client = await redis_cache.get_async_client()
+        if client is None:
+            cooldown = _cooldown_local(cooldown_key, entry, rate_limited)
+        else:
+            script = _scripts.get(id(client))
+            if script is None:
+                script = client.register_script(RECORD_FAILURE_SCRIPT)
+                _scripts[id(client)] = script
+            cooldown = int(await script(
+                keys=[_get_streak_key(fingerprint), _get_level_key(fingerprint), cooldown_key],
+                args=[
+                    1 if rate_limited else 0,
+                    KEY_ERROR_THRESHOLD,
+                    KEY_COOLDOWN_BASE,
+                    KEY_COOLDOWN_MAX,
+                    KEY_HEALTH_STATE_TTL
+                ]
+            ))
+    except Exception as e:
+        logger.error(f"Error recording key failure: {e}")
+        cooldown = _cooldown_local(cooldown_key, entry, rate_limited)
+
+    if cooldown:
+        entry["cooldowns"] += 1
+        entry["consecutive_failures"] = 0
+        logger.warning(
+            f"API key {mask_api_key(api_key)} cooldown {cooldown}s "
+            f"({'rate limited' if rate_limited else 'errors'}): {entry['last_error']}"
+        )
+    return cooldown
+
+
+def is_cooling_locally(cooldown_key: str) -> bool:
+    return _local_cooldowns.get(cooldown_key, 0) > time.monotonic()
+
+
+async def get_keys_health(keys: List[dict]) -> List[dict]:
+    """
+    Sức khỏe của danh sách key (dict có id, name, key, type)
+    cooldown_remaining lấy từ Redis nên đúng cho mọi worker
+    """
+    cooldown_ttls: Optional[list] = None
+    try:
+        client = await redis_cache.get_async_client()
+        if client is not None and keys:
+            async with client.pipeline(transaction=False) as pipe:
+                for k in keys:
+                    pipe.ttl(get_cooldown_key(k["key"]))
+                cooldown_ttls = await pipe.execute()
+    except Exception as e:
+        logger.error(f"Error getting key cooldowns: {e}")
+
+    result = []
+    for i, k in enumerate(keys):
+        fingerprint = get_key_fingerprint(k["key"])
+        entry = _get_entry(fingerprint)
+        if cooldown_ttls is not None:
+            remaining = max(int(cooldown_ttls[i] or 0), 0)
+        else:
+            remaining = max(int(_local_cooldowns.get(get_cooldown_key(k["key"]), 0) - time.monotonic()), 0)
+
+        result.append({
+            "id": k.get("id"),
+            "name": k.get("name"),
+            "type": k.get("type"),
+            "weight": k.get("weight"),
+            "key": mask_api_key(k["key"]),
+            "status": "cooldown" if remaining else "healthy",
+            "cooldown_remaining": remaining,
+            **entry,
+            "error_rate": (
+                round((entry["errors"] + entry["rate_limited"]) / entry["requests"], 4)
+                if entry["requests"] else None
+            )
+        })
+    return result
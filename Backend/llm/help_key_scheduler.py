@@ -0,0 +1,196 @@
+"""
+Scheduler chọn API key (round-robin có trọng số) chạy nguyên tử trên Redis
+- 1 Lua script duy nhất: đọc session pin, INCR counter, chọn key, pin session
+  cho cả key bot và key embedding → 1 round trip, không race giữa các worker
+- Trọng số: lịch smooth weighted round-robin được tính sẵn ở Python và truyền vào script
+- Key đang cooldown (help_key_health) hoặc hết budget RPM/TPM (help_rate_limiter) bị bỏ qua,
+  session pin vào key đó được pin lại
+"""
+
+import logging
+from typing import Dict, List
+from config.redis_cache import redis_cache
+from llm.help_key_health import is_cooling_locally
+
+logger = logging.getLogger(__name__)
+
+
+SESSION_PIN_TTL = 3600
+COUNTER_TTL = 86400
+# Trọng số tối đa của 1 key (giới hạn độ dài lịch)
+MAX_KEY_WEIGHT = 100
+
+
+# KEYS[2i-1] = session key ("" nếu không pin), KEYS[2i] = counter key
+# KEYS[2n+1..] = 2 key đánh dấu (cooldown, hết budget) của từng API key, lần lượt theo selections
+#                ("" nếu không kiểm tra)
+# ARGV[1] = TTL session, ARGV[2] = TTL counter, ARGV[3] = n
+# ARGV[3+i] = lịch chọn key (csv các index), ARGV[3+n+i] = số key
+SELECT_KEYS_SCRIPT = """
+local n = tonumber(ARGV[3])
+local offset = 2 * n
+local result = {}
+for i = 1, n do
+    local session_key = KEYS[2 * i - 1]
+    local counter_key = KEYS[2 * i]
+    local key_count = tonumber(ARGV[3 + n + i])
+    local idx = nil
+
+    -- Key đang cooldown / hết budget bị loại, trừ khi tất cả đều bị loại
+    local cooling = {}
+    local healthy = 0
+    for k = 0, key_count - 1 do
+        local cooldown_key = KEYS[offset + 2 * k + 1]
+        local saturated_key = KEYS[offset + 2 * k + 2]
+        if (cooldown_key ~= '' and redis.call('EXISTS', cooldown_key) == 1)
+            or (saturated_key ~= '' and redis.call('EXISTS', saturated_key) == 1) then
+            cooling[k] = true
+        else
+            healthy = healthy + 1
+        end
+    end
+    offset = offset + 2 * key_count
+    if healthy == 0 then
+        cooling = {}
+    end
+
+    if session_key ~= '' then
+        local pinned = tonumber(redis.call('GET', session_key))
+        if pinned and pinned >= 0 and pinned < key_count and not cooling[pinned] then
+            idx = pinned
+        end
+    end
+
+    -- Session mới hoặc key đã pin đang cooldown → chọn key khác và pin lại
+    if idx == nil then
+        local schedule = {}
+        for v in string.gmatch(ARGV[3 + i], '[^,]+') do
+            local candidate = tonumber(v)
+            if not cooling[candidate] then
+                schedule[#schedule + 1] = candidate
+            end
+        end
+        local counter = redis.call('INCR', counter_key)
+        if counter == 1 then
+            redis.call('EXPIRE', counter_key, ARGV[2])
+        end
+        idx = schedule[((counter - 1) % #schedule) + 1]
+        if session_key ~= '' then
+            redis.call('SET', session_key, idx, 'EX', ARGV[1])
+        end
+    end
+
+    result[i] = idx
+end
+return result
+"""
+
+# Script đã đăng ký theo client (EVALSHA, tự fallback EVAL khi NOSCRIPT)
+_scripts: Dict[int, object] = {}
+# Counter in-process khi Redis không khả dụng
+_local_counters: Dict[str, int] = {}
+
+
+def build_weighted_schedule(weights: List[int]) -> List[int]:
+    """
+    Smooth weighted round-robin: với trọng số [3, 1] → [0, 0, 1, 0]
+    Các key được rải đều trong chu kỳ thay vì dồn liên tiếp
+    """
+    weights = [min(max(int(w or 1), 1), MAX_KEY_WEIGHT) for w in weights]
+    total = sum(weights)
+    current = [0] * len(weights)
+    schedule = []
+    for _ in range(total):
+        for i, w in enumerate(weights):
+            current[i] += w
+        best = max(range(len(weights)), key=lambda i: current[i])
+        current[best] -= total
+        schedule.append(best)
+    return schedule
+
+
+def get_session_pin_key(chat_session_id: int, llm_detail_id: int, key_type: str) -> str:
+    return f"llm_key_session:session_{chat_session_id}:llm_detail_{llm_detail_id}:type_{key_type}"
+
+
+def get_counter_key(llm_detail_id: int, key_type: str) -> str:
+    return f"llm_key_global_counter:llm_detail_{llm_detail_id}:type_{key_type}"
+
+
+async def _get_script(client):
+    script = _scripts.get(id(client))
+    if script is None:
+        script = client.register_script(SELECT_KEYS_SCRIPT)
+        _scripts[id(client)] = script
+    return script
+
+
+def _select_local(selections: List[dict]) -> List[int]:
+    result = []
+    for selection in selections:
+        counter_key = selection["counter_key"]
+        counter = _local_counters.get(counter_key, 0)
+        _local_counters[counter_key] = counter + 1
+        schedule = build_weighted_schedule(selection["weights"])
+        cooldown_keys = selection.get("cooldown_keys") or []
+        healthy = [i for i in schedule if not (cooldown_keys and is_cooling_locally(cooldown_keys[i]))]
+        schedule = healthy or schedule
+        result.append(schedule[counter % len(schedule)])
+    return result
+
+
+async def select_key_indexes(
+    selections: List[dict],
+    session_ttl: int = SESSION_PIN_TTL,
+    counter_ttl: int = COUNTER_TTL
+) -> List[int]:
+    """
+    Chọn index key cho nhiều loại key trong 1 round trip
+
+    Args:
+        selections: [{"session_key": str hoặc None, "counter_key": str, "weights": [int],
+                      "cooldown_keys": [str], "saturated_keys": [str]
+                      (tùy chọn, cùng thứ tự với weights)}]
+
+    Returns:
+        list: index key được chọn, cùng thứ tự với selections
+    """
+    for selection in selections:
+        if not selection["weights"]:
+            raise ValueError(f"Không có API key nào cho {selection['counter_key']}")
+
+    client = await redis_cache.get_async_client()
+    if client is None:
+        logger.warning("Redis không khả dụng, dùng round-robin in-process")
+        return _select_local(selections)
+
+    keys = []
+    marker_keys = []
+    schedules = []
+    counts = []
+    for selection in selections:
+        key_count = len(selection["weights"])
+        keys.extend([selection.get("session_key") or "", selection["counter_key"]])
+        cooldown_keys = selection.get("cooldown_keys") or [""] * key_count
+        saturated_keys = selection.get("saturated_keys") or [""] * key_count
+        for cooldown_key, saturated_key in zip(cooldown_keys, saturated_keys):
+            marker_keys.extend([cooldown_key, saturated_key])
+        schedules.append(",".join(str(i) for i in build_weighted_schedule(selection["weights"])))
+        counts.append(str(key_count))
+
+    try:
+        script = await _get_script(client)
+        result = await script(
+            keys=keys + marker_keys,
+            args=[session_ttl, counter_ttl, len(selections), *schedules, *counts]
+        )
+    except Exception as e:
+        # Redis timeout / mất kết nối / lỗi script → lượt chat vẫn chọn được key
+        logger.error(f"Lỗi chọn API key trên Redis, dùng round-robin in-process: {e}")
+        return _select_local(selections)
+    return [int(i) for i in result]
+
+
+def get_key_weights(keys: List[dict]) -> List[int]:
+    return [k.get("weight") or 1 for k in keys]
+
@@ -1,11 +1,32 @@
-from typing import List, Dict
+import asyncio
+import os
+import time
+from typing import Awaitable, Callable, List, Dict, Optional
 from sqlalchemy import select, desc
 from sqlalchemy.ext.asyncio import AsyncSession
 from models.chat import Message
 from models.llm import LLM, LLMKey
 from config.redis_cache import async_cache_get, async_cache_set, async_cache_delete, async_cache_delete_pattern
 from llm.prompt import prompt_builder
-from llm.help_search_query import search_data, search_metadata
+from llm.help_search_query import search_data, search_metadata, embed_query
+from llm.help_local_router import route_query_local, warm_centroids, LOCAL_ROUTER_ENABLED
+from helper.help_semantic_cache import get_semantic_answer, get_semantic_cache_epoch, store_semantic_answer
+from llm.help_key_scheduler import (
+    select_key_indexes,
+    get_session_pin_key,
+    get_counter_key,
+    get_key_weights
+)
+from llm.help_key_health import get_cooldown_key
+from llm.help_rate_limiter import get_saturated_key, RATE_LIMITED_MESSAGE
+from llm.gemini import GEMINI_DEFAULT_MODEL
+from llm.gpt import GPT_DEFAULT_MODEL
+
+
+# Timeout (giây) cho từng stage remote của pipeline RAG (embedding, router LLM)
+RAG_STAGE_TIMEOUT = float(os.getenv("RAG_STAGE_TIMEOUT", 30))
+# Gọi router LLM song song với embedding ngay từ đầu, cancel nếu router cục bộ đủ tự tin
+RAG_SPECULATIVE_ROUTING = os.getenv("RAG_SPECULATIVE_ROUTING", "false").lower() == "true"
 
 async def get_all_key(db_session: AsyncSession, llm_detail_id: int) -> list:
     
@@ -18,14 +39,17 @@ async def get_all_key(db_session: AsyncSession, llm_detail_id: int) -> list:
     
     
     # 2. Nếu không có trong cache, query từ database
-    query = select(LLMKey.key, LLMKey.type, LLMKey.llm_detail_id).order_by(LLMKey.id)
+    query = select(LLMKey.key, LLMKey.type, LLMKey.llm_detail_id, LLMKey.weight).order_by(LLMKey.id)
     
     # Filter theo llm_detail_id
     query = query.where(LLMKey.llm_detail_id == llm_detail_id)
     
     result = await db_session.execute(query)
     
-    keys = [{"key": row.key, "type": row.type, "llm_detail_id": row.llm_detail_id} for row in result.all()]
+    keys = [
+        {"key": row.key, "type": row.type, "llm_detail_id": row.llm_detail_id, "weight": row.weight}
+        for row in result.all()
+    ]
     
    
     await async_cache_set(cache_key, keys, ttl=3600)
@@ -33,75 +57,59 @@ async def get_all_key(db_session: AsyncSession, llm_detail_id: int) -> list:
     return keys
 
 
+def get_generation_model_name(bot_model_name: str) -> str:
+    """
+    Model thực sự dùng để sinh câu trả lời theo LLMDetail.name ("gemini" / "gpt"),
+    budget RPM/TPM và đánh dấu saturated đều tính theo model này
+    """
+    return GEMINI_DEFAULT_MODEL if "gemini" in bot_model_name.lower() else GPT_DEFAULT_MODEL
+
+
 async def get_round_robin_api_key(
     db_session: AsyncSession,
     model_info: dict,
     chat_session_id: int = None
 ) -> dict:
 
-    try:
-        keys_result = {}
-
-
-        if chat_session_id is None:
-            # Lấy key của embedding model
-            embedding_detail_id = model_info["embedding"]["id"]
-            llm_keys_all = await get_all_key(db_session, llm_detail_id=embedding_detail_id)
-            embedding_keys = [k for k in llm_keys_all if k["type"] == "embedding"]
-
-
-            counter_key = f"llm_key_global_counter:llm_detail_{embedding_detail_id}:type_embedding"
-            current_counter = await async_cache_get(counter_key)
-            current_counter = int(current_counter) if current_counter is not None else 0
-
-            selected_index = current_counter % len(embedding_keys)
-
-            # Cập nhật counter
-            await async_cache_set(counter_key, current_counter + 1, ttl=86400)
+    # Session None → chỉ lấy key embedding, không pin
+    key_types = ["embedding"] if chat_session_id is None else ["bot", "embedding"]
 
-            # Trả key embedding
-            keys_result["embedding_key"] = embedding_keys[selected_index]["key"]
-
-            return keys_result
-        
-        
+    keys_by_type = {}
+    selections = []
+    for key_type in key_types:
+        # Lấy llm_detail_id tương ứng
+        llm_detail_id = model_info[key_type]["id"]
         
-        for key_type in ["bot", "embedding"]:
-            # Lấy llm_detail_id tương ứng
-            llm_detail_id = model_info[key_type]["id"]
-            
-            # Lấy key theo llm_detail_id và type
-            llm_keys_all = await get_all_key(db_session, llm_detail_id=llm_detail_id)
-            llm_keys = [k for k in llm_keys_all if k["type"] == key_type]
-
-            # Kiểm tra session cache
-            session_key = f"llm_key_session:session_{chat_session_id}:llm_detail_{llm_detail_id}:type_{key_type}"
-            assigned_index = await async_cache_get(session_key)
-
-            if assigned_index is not None:
-                keys_result[f"{key_type}_key"] = llm_keys[int(assigned_index)]["key"]
-                continue
-
-            # Session mới, Round-Robin
-            counter_key = f"llm_key_global_counter:llm_detail_{llm_detail_id}:type_{key_type}"
-            current_counter = await async_cache_get(counter_key)
-            current_counter = int(current_counter) if current_counter is not None else 0
-
-            selected_index = current_counter % len(llm_keys)
-
-            # Cập nhật counter
-            await async_cache_set(counter_key, current_counter + 1, ttl=86400)
-
-            # Lưu session -> index
-            await async_cache_set(session_key, selected_index, ttl=3600)
-
-            # Lưu key vào kết quả
-            keys_result[f"{key_type}_key"] = llm_keys[selected_index]["key"]
-
-        return keys_result
-
-    except Exception as e:
-        raise
+        # Lấy key theo llm_detail_id và type
+        llm_keys_all = await get_all_key(db_session, llm_detail_id=llm_detail_id)
+        # Key trọng số 0 là key đã tắt, không chọn
+        llm_keys = [k for k in llm_keys_all if k["type"] == key_type and k.get("weight") != 0]
+        keys_by_type[key_type] = llm_keys
+
+        selections.append({
+            "session_key": (
+                get_session_pin_key(chat_session_id, llm_detail_id, key_type)
+                if chat_session_id is not None else None
+            ),
+            "counter_key": get_counter_key(llm_detail_id, key_type),
+            "weights": get_key_weights(llm_keys),
+            "cooldown_keys": [get_cooldown_key(k["key"]) for k in llm_keys],
+            # Budget tính theo (model, key) → chỉ bỏ key đã hết budget của đúng model sinh câu trả lời
+            # (embedding không đi qua rate limiter)
+            "saturated_keys": [
+                get_saturated_key(k["key"], get_generation_model_name(model_info["bot"]["name"]))
+                for k in llm_keys
+            ] if key_type == "bot" else None
+        })
+
+    # Chọn key + pin session cho tất cả loại key trong 1 round trip (Lua, nguyên tử),
+    # bỏ qua key đang cooldown / hết budget và pin lại session đang dùng key đó
+    indexes = await select_key_indexes(selections)
+
+    return {
+        f"{key_type}_key": keys_by_type[key_type][index]["key"]
+        for key_type, index in zip(key_types, indexes)
+    }
 
 
 
@@ -177,7 +185,7 @@ async def get_current_model(db_session: AsyncSession, chat_session_id: int = Non
         
         
         result["bot"] = {
-                "name":model_info["embedding"]["name"],
+                "name": model_info["bot"]["name"],
                 "key": keys["bot_key"]
             }
         
@@ -241,38 +249,145 @@ async def get_latest_messages(
 
 
 
+async def _timed_stage(timings: Optional[dict], stage: str, coro):
+    """
+    Await coroutine và ghi thời gian chạy (ms) vào timings[stage]
+    """
+    started = time.perf_counter()
+    try:
+        return await coro
+    finally:
+        if timings is not None:
+            timings[stage] = round((time.perf_counter() - started) * 1000, 2)
+
+
+async def route_query(
+    query: str,
+    bot_key: str,
+    bot_model_name: str,
+    embedding_key: str,
+    embedding_model_name: str,
+    timings: Optional[dict] = None
+) -> tuple:
+    """
+    Embedding query + định tuyến metadata
+
+    Returns:
+        tuple: (query_embedding, metadata {"category_id", "file_names"})
+    """
+    
+    # Các task con, luôn được cancel nếu pipeline lỗi / timeout / bị cancel
+    tasks = []
+    
+    try:
+        
+        # Embedding query và chuẩn bị centroid chạy song song
+        embed_task = asyncio.create_task(
+            _timed_stage(timings, "embedding_ms", embed_query(query, embedding_key, embedding_model_name))
+        )
+        tasks.append(embed_task)
+        
+        if LOCAL_ROUTER_ENABLED:
+            tasks.append(asyncio.create_task(warm_centroids(embedding_key, embedding_model_name)))
+        
+        # Router LLM chạy song song ngay từ đầu nếu không có router cục bộ
+        # hoặc bật chế độ speculative (đổi chi phí lấy độ trễ)
+        routing_task = None
+        if not LOCAL_ROUTER_ENABLED or RAG_SPECULATIVE_ROUTING:
+            routing_task = asyncio.create_task(
+                _timed_stage(timings, "routing_llm_ms", search_metadata(
+                    query=query,
+                    model_name=bot_model_name,
+                    api_key=bot_key
+                ))
+            )
+            tasks.append(routing_task)
+        
+        q_emb = await asyncio.wait_for(embed_task, timeout=RAG_STAGE_TIMEOUT)
+        
+        # Định tuyến cục bộ bằng centroid, chỉ gọi LLM khi không đủ tự tin
+        metadata = await _timed_stage(
+            timings, "routing_local_ms",
+            route_query_local(q_emb, embedding_key, embedding_model_name)
+        )
+        
+        if metadata is not None:
+            if routing_task is not None:
+                routing_task.cancel()
+        else:
+            if routing_task is None:
+                routing_task = asyncio.create_task(
+                    _timed_stage(timings, "routing_llm_ms", search_metadata(
+                        query=query,
+                        model_name=bot_model_name,
+                        api_key=bot_key
+                    ))
+                )
+                tasks.append(routing_task)
+            metadata = await asyncio.wait_for(routing_task, timeout=RAG_STAGE_TIMEOUT)
+        
+        print("metadata found:", metadata)
+        
+        return q_emb, metadata
+    
+    finally:
+        for task in tasks:
+            if not task.done():
+                task.cancel()
+
+
+async def search_routed_documents(
+    query: str,
+    top_k: int,
+    q_emb: List[float],
+    metadata: dict,
+    embedding_key: str,
+    embedding_model_name: str,
+    timings: Optional[dict] = None
+) -> List[Dict]:
+    
+    # Kiểm tra nếu metadata rỗng hoặc không có dữ liệu hợp lệ
+    if metadata.get('category_id') is None and not metadata.get('file_names'):
+        print("⚠️ Metadata rỗng, không tìm kiếm search_data")
+        return []
+    
+    return await _timed_stage(timings, "vector_search_ms", search_data(
+        query=query,
+        embedding_key=embedding_key,
+        embedding_model_name=embedding_model_name,
+        top_k=top_k,
+        metadata_filter=metadata,
+        query_embedding=q_emb
+    ))
+
+
 async def search_similar_documents(
     query: str, 
     top_k: int,
     bot_key: str,
     bot_model_name: str,
     embedding_key: str = None,
-    embedding_model_name: str = None
+    embedding_model_name: str = None,
+    timings: Optional[dict] = None
     
 ) -> List[Dict]:
     
     try:
         
-        
-        metadata = await search_metadata(
-            query=query,
-            model_name=bot_model_name,
-            api_key=bot_key
+        q_emb, metadata = await route_query(
+            query,
+            bot_key=bot_key,
+            bot_model_name=bot_model_name,
+            embedding_key=embedding_key,
+            embedding_model_name=embedding_model_name,
+            timings=timings
         )
         
-        print("metadata found:", metadata)
-        
-        # Kiểm tra nếu metadata rỗng hoặc không có dữ liệu hợp lệ
-        if metadata.get('category_id') is None and not metadata.get('file_names'):
-            print("⚠️ Metadata rỗng, không tìm kiếm search_data")
-            return []
-        
-        candidates = await search_data(
-            query=query,
+        candidates = await search_routed_documents(
+            query, top_k, q_emb, metadata,
             embedding_key=embedding_key,
             embedding_model_name=embedding_model_name,
-            top_k=top_k,
-            metadata_filter=metadata
+            timings=timings
         )
         
                 
@@ -294,25 +409,62 @@ async def generate_response_prompt(
     bot_key: str,
     bot_model_name: str,
     embedding_key: str,
-    embedding_model_name: str
+    embedding_model_name: str,
+    timings: Optional[dict] = None,
+    on_delta: Optional[Callable[[str], Awaitable[None]]] = None
 ) -> dict:
+    """
+    on_delta: nếu có, câu trả lời được stream và on_delta nhận từng phần nội dung "message";
+    giá trị trả về vẫn là JSON {"message","links"} đầy đủ như khi không stream
+    """
+    
+    # Lấy lịch sử song song với định tuyến
+    # (route không dùng db_session nên không tranh chấp connection)
+    history_task = asyncio.create_task(
+        _timed_stage(timings, "history_ms", get_latest_messages(db_session, chat_session_id, limit=10))
+    )
     
     try:
         
-        # Lấy lịch sử
-        history = await get_latest_messages(db_session, chat_session_id, limit=10)
+        try:
+            q_emb, metadata = await route_query(
+                query,
+                bot_key=bot_key,
+                bot_model_name=bot_model_name,
+                embedding_key=embedding_key,
+                embedding_model_name=embedding_model_name,
+                timings=timings
+            )
+        except Exception as e:
+            raise Exception(f"Lỗi khi tìm kiếm: {str(e)}")
         
-                
-        # Tìm kiếm tài liệu
-        knowledge = await search_similar_documents(
-            query, 
-            top_k=1,
-            embedding_key=embedding_key,
-            embedding_model_name=embedding_model_name,
-            bot_key=bot_key,
-            bot_model_name=bot_model_name
-        )
         
+        history = await history_task
+        
+        # Chỉ dùng cache cho câu hỏi đứng riêng: câu hỏi nối tiếp (vd: "còn giá thì sao?")
+        # phụ thuộc lịch sử nên câu trả lời của hội thoại khác không dùng lại được
+        use_semantic_cache = not has_prior_answers(history)
+        cache_epoch = None
+        if use_semantic_cache:
+            # Câu hỏi gần giống đã được trả lời gần đây trong cùng category
+            cached_answer = await get_semantic_answer(q_emb, metadata.get("category_id"))
+            if cached_answer is not None:
+                if timings is not None:
+                    timings["semantic_cache"] = "hit"
+                return cached_answer
+            # Đọc trước khi tìm tài liệu để invalidate trong lúc sinh câu trả lời không bị bỏ lỡ
+            cache_epoch = await get_semantic_cache_epoch()
+        
+        
+        try:
+            knowledge = await search_routed_documents(
+                query, 1, q_emb, metadata,
+                embedding_key=embedding_key,
+                embedding_model_name=embedding_model_name,
+                timings=timings
+            )
+        except Exception as e:
+            raise Exception(f"Lỗi khi tìm kiếm: {str(e)}")
         
         
         # Tạo prompt
@@ -325,16 +477,24 @@ async def generate_response_prompt(
         
         if "gemini" in bot_model_name.lower():
             from llm.gemini import generate_gemini_response
-            response_json = await generate_gemini_response(
+            response_json = await _timed_stage(timings, "generation_ms", generate_gemini_response(
                 api_key=bot_key,
-                prompt=prompt
-            )
+                prompt=prompt,
+                model_name=get_generation_model_name(bot_model_name),
+                on_delta=on_delta
+            ))
         else:
             from llm.gpt import generate_gpt_response
-            response_json = await generate_gpt_response(
+            response_json = await _timed_stage(timings, "generation_ms", generate_gpt_response(
                 api_key=bot_key,
-                prompt=prompt
-            )
+                prompt=prompt,
+                model_name=get_generation_model_name(bot_model_name),
+                on_delta=on_delta
+            ))
+
+
+        if use_semantic_cache and is_cacheable_answer(response_json):
+            await store_semantic_answer(q_emb, metadata.get("category_id"), response_json, knowledge, cache_epoch)
 
 
         return response_json
@@ -342,6 +502,31 @@ async def generate_response_prompt(
         
     except Exception as e:
         return f"Xin lỗi, đã có lỗi xảy ra khi xử lý câu hỏi của bạn: {str(e)}"
+    
+    finally:
+        if not history_task.done():
+            # Chỉ xảy ra khi lỗi / bị cancel: đợi query history kết thúc thay vì
+            # cancel giữa chừng để không làm hỏng connection của db_session
+            await asyncio.gather(history_task, return_exceptions=True)
+
+
+def has_prior_answers(history: str) -> bool:
+    """
+    Lịch sử đã có câu trả lời của bot / admin → câu hỏi hiện tại có thể dựa vào ngữ cảnh trước
+    """
+    return any(line.startswith(("bot:", "admin:")) for line in (history or "").splitlines())
+
+
+def is_cacheable_answer(response_json: str) -> bool:
+    """
+    Chỉ cache câu trả lời có thông tin (không cache lỗi hoặc câu báo thiếu dữ liệu)
+    """
+    text = (response_json or "").lower()
+    return (
+        "đã có lỗi xảy ra" not in text
+        and "chưa có thông tin chính thức" not in text
+        and RATE_LIMITED_MESSAGE.lower() not in text
+    )
 
 async def clear_llm_keys_cache() -> bool:
     try:
@@ -0,0 +1,238 @@
+"""
+Định tuyến metadata cục bộ (không gọi LLM)
+- Tính centroid embedding cho mỗi KnowledgeCategory và mỗi file description
+- Chấm điểm cosine giữa query embedding và các centroid
+- Chỉ khi khoảng cách top-1/top-2 nhỏ hơn ngưỡng mới fallback sang search_metadata (LLM)
+- Tính centroid lỗi / quá LOCAL_ROUTER_BUILD_TIMEOUT → không thử lại trong LOCAL_ROUTER_RETRY_BACKOFF
+  giây (fallback LLM ngay), tránh mỗi lượt chat lại embed cả catalog trong lúc giữ lock
+"""
+
+import asyncio
+import logging
+import os
+import time
+from typing import Dict, List, Optional
+import numpy as np
+from config.get_embedding import get_embedding_gemini, get_embedding_chatgpt
+from helper.help_catalog_cache import get_catalog_snapshot
+
+logger = logging.getLogger(__name__)
+
+
+LOCAL_ROUTER_ENABLED = os.getenv("LOCAL_ROUTER_ENABLED", "true").lower() == "true"
+# Margin tối thiểu giữa category top-1 và top-2 để tin kết quả cục bộ
+LOCAL_ROUTER_MARGIN = float(os.getenv("LOCAL_ROUTER_MARGIN", 0.05))
+# Điểm cosine tối thiểu của category top-1
+LOCAL_ROUTER_MIN_SCORE = float(os.getenv("LOCAL_ROUTER_MIN_SCORE", 0.35))
+# Margin tối thiểu giữa file top-1 và top-2 (trong category đã chọn) để lọc thêm theo file
+LOCAL_ROUTER_FILE_MARGIN = float(os.getenv("LOCAL_ROUTER_FILE_MARGIN", 0.05))
+# Thời gian (giây) tối đa để embed cả catalog khi tính centroid (chạy trong lượt chat)
+LOCAL_ROUTER_BUILD_TIMEOUT = float(os.getenv("LOCAL_ROUTER_BUILD_TIMEOUT", 15))
+# Thời gian (giây) chờ trước khi tính lại centroid sau khi lỗi
+LOCAL_ROUTER_RETRY_BACKOFF = float(os.getenv("LOCAL_ROUTER_RETRY_BACKOFF", 30))
+
+
+# key = (catalog_version, embedding_model_name)
+_centroids: Dict[tuple, dict] = {}
+# key như _centroids → thời điểm (monotonic) được thử tính lại sau lần lỗi
+_retry_at: Dict[tuple, float] = {}
+_lock = asyncio.Lock()
+
+_stats = {
+    "local": 0,
+    "llm_fallback": 0,
+    "build_failures": 0
+}
+
+
+def _normalize(vectors: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return vectors / norms
+
+
+async def _embed_texts(texts: List[str], embedding_key: str, embedding_model_name: str) -> List[List[float]]:
+    if "gemini" in embedding_model_name.lower():
+        return await get_embedding_gemini(texts, embedding_key)
+    return await get_embedding_chatgpt(texts, embedding_key)
+
+
+async def _build_centroids(categories: list, embedding_key: str, embedding_model_name: str) -> Optional[dict]:
+    """
+    Embed mô tả category + mô tả file (1 batch), centroid category = trung bình
+    vector mô tả category và các file của nó
+    """
+    texts = []
+    owners = []  # (category_index, file_name hoặc None)
+
+    for idx, category in enumerate(categories):
+        texts.append(f"{category['category_name']}\n{category.get('category_description') or ''}")
+        owners.append((idx, None))
+        for file in category["file_list"]:
+            texts.append(f"{file['file_name']}\n{file.get('summary') or ''}")
+            owners.append((idx, file["file_name"]))
+
+    if not texts:
+        return None
+
+    vectors = await _embed_texts(texts, embedding_key, embedding_model_name)
+    if not vectors or len(vectors) != len(texts):
+        logger.warning("Local router: không embed được catalog, bỏ qua định tuyến cục bộ")
+        return None
+
+    vectors = _normalize(np.asarray(vectors, dtype=np.float32))
+
+    category_vectors = [[] for _ in categories]
+    file_entries = [[] for _ in categories]
+    for (idx, file_name), vector in zip(owners, vectors):
+        category_vectors[idx].append(vector)
+        if file_name is not None:
+            file_entries[idx].append((file_name, vector))
+
+    return {
+        "category_ids": [c["category_id"] for c in categories],
+        "category_matrix": _normalize(np.stack([np.mean(v, axis=0) for v in category_vectors])),
+        "files": [
+            {
+                "names": [name for name, _ in entries],
+                "matrix": np.stack([vec for _, vec in entries]) if entries else None
+            }
+            for entries in file_entries
+        ]
+    }
+
+
+async def get_centroids(embedding_key: str, embedding_model_name: str) -> Optional[dict]:
+    snapshot = await get_catalog_snapshot()
+    cache_key = (snapshot["version"], embedding_model_name)
+
+    if cache_key in _centroids:
+        return _centroids[cache_key]
+    if time.monotonic() < _retry_at.get(cache_key, 0):
+        return None
+
+    async with _lock:
+        if cache_key in _centroids:
+            return _centroids[cache_key]
+        if time.monotonic() < _retry_at.get(cache_key, 0):
+            return None
+
+        try:
+            centroids = await asyncio.wait_for(
+                _build_centroids(snapshot["categories"], embedding_key, embedding_model_name),
+                timeout=LOCAL_ROUTER_BUILD_TIMEOUT
+            )
+        except asyncio.TimeoutError:
+            # Provider embedding chậm → lượt chat fallback sang router LLM thay vì chờ không giới hạn
+            logger.warning(f"Local router: tính centroid quá {LOCAL_ROUTER_BUILD_TIMEOUT}s, fallback LLM")
+            _record_build_failure(cache_key)
+            return None
+        except Exception:
+            _record_build_failure(cache_key)
+            raise
+        if centroids is None:
+            _record_build_failure(cache_key)
+            return None
+        # Catalog đã đổi version → bỏ centroid cũ
+        _centroids.clear()
+        _retry_at.clear()
+        _centroids[cache_key] = centroids
+
+    return _centroids[cache_key]
+
+
+def _record_build_failure(cache_key: tuple) -> None:
+    _stats["build_failures"] += 1
+    _retry_at[cache_key] = time.monotonic() + LOCAL_ROUTER_RETRY_BACKOFF
+
+
+async def warm_centroids(embedding_key: str, embedding_model_name: str) -> None:
+    """
+    Chuẩn bị trước centroid (chạy song song với embedding query)
+    """
+    try:
+        await get_centroids(embedding_key, embedding_model_name)
+    except Exception as e:
+        logger.error(f"Local router: lỗi khi tính centroid: {e}")
+
+
+async def route_query_local(
+    query_embedding: List[float],
+    embedding_key: str,
+    embedding_model_name: str
+) -> Optional[Dict]:
+    """
+    Định tuyến query bằng centroid embedding
+
+    Returns:
+        dict: {"category_id", "file_names"} nếu đủ tự tin, None nếu cần fallback sang LLM
+    """
+    if not LOCAL_ROUTER_ENABLED or not query_embedding:
+        return None
+
+    try:
+        centroids = await get_centroids(embedding_key, embedding_model_name)
+    except Exception as e:
+        logger.error(f"Local router: lỗi khi tính centroid: {e}")
+        centroids = None
+
+    if centroids is None:
+        record_route_decision("llm_fallback", reason="no_centroids")
+        return None
+
+    query_vector = _normalize(np.asarray(query_embedding, dtype=np.float32))
+    if query_vector.shape[-1] != centroids["category_matrix"].shape[-1]:
+        record_route_decision("llm_fallback", reason="dimension_mismatch")
+        return None
+
+    scores = centroids["category_matrix"] @ query_vector
+    order = np.argsort(scores)[::-1]
+    top1 = float(scores[order[0]])
+    top2 = float(scores[order[1]]) if len(order) > 1 else -1.0
+    margin = top1 - top2
+
+    if top1 < LOCAL_ROUTER_MIN_SCORE or margin < LOCAL_ROUTER_MARGIN:
+        record_route_decision("llm_fallback", top1=top1, margin=margin)
+        return None
+
+    best = int(order[0])
+    file_names = []
+    files = centroids["files"][best]
+    if files["matrix"] is not None:
+        file_scores = files["matrix"] @ query_vector
+        file_order = np.argsort(file_scores)[::-1]
+        file_margin = (
+            float(file_scores[file_order[0]] - file_scores[file_order[1]])
+            if len(file_order) > 1 else float("inf")
+        )
+        if file_margin >= LOCAL_ROUTER_FILE_MARGIN:
+            file_names = [files["names"][int(file_order[0])]]
+
+    category_id = centroids["category_ids"][best]
+    record_route_decision("local", top1=top1, margin=margin, category_id=category_id)
+
+    return {
+        "category_id": category_id,
+        "file_names": file_names
+    }
+
+
+def record_route_decision(decision: str, **details) -> None:
+    _stats[decision] += 1
+    total = _stats["local"] + _stats["llm_fallback"]
+    logger.info(
+        f"Local router decision={decision} details={details} "
+        f"fallback_rate={_stats['llm_fallback'] / total:.3f}"
+    )
+
+
+def get_local_router_stats() -> dict:
+    total = _stats["local"] + _stats["llm_fallback"]
+    return {
+        **_stats,
+        "fallback_rate": round(_stats["llm_fallback"] / total, 4) if total else None,
+        "margin_threshold": LOCAL_ROUTER_MARGIN,
+        "min_score": LOCAL_ROUTER_MIN_SCORE,
+        "build_timeout": LOCAL_ROUTER_BUILD_TIMEOUT,
+        "retry_backoff": LOCAL_ROUTER_RETRY_BACKOFF
+    }
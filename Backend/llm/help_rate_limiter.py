@@ -0,0 +1,203 @@
+"""
+Rate limiter token bucket cho API key LLM, dùng chung giữa các worker qua Redis
+- Mỗi (model, key) có 2 bucket: số request/phút (RPM) và số token ước lượng/phút (TPM)
+- Bucket được nạp lại liên tục theo thời gian Redis (TIME), trừ token nguyên tử bằng Lua
+- Hết budget → đánh dấu (model, key) "saturated" trong thời gian cần chờ để scheduler chọn key
+  khác cho model đó (key vẫn dùng được cho model còn budget), request hiện tại chờ tối đa LLM_RATE_LIMIT_MAX_WAIT giây rồi mới bỏ cuộc
+- Budget cấu hình theo model qua LLM_RATE_LIMITS (JSON), 0 = không giới hạn
+  Ví dụ: {"gemini-2.0-flash-001": {"rpm": 15, "tpm": 1000000}}
+"""
+
+import asyncio
+import json
+import logging
+import os
+import random
+import time
+from typing import Dict, Optional
+from config.redis_cache import redis_cache
+from llm.help_key_health import get_key_fingerprint
+
+logger = logging.getLogger(__name__)
+
+
+LLM_RATE_LIMIT_ENABLED = os.getenv("LLM_RATE_LIMIT_ENABLED", "true").lower() == "true"
+# Budget mặc định cho model không có trong LLM_RATE_LIMITS (0 = không giới hạn)
+LLM_DEFAULT_RPM = int(os.getenv("LLM_DEFAULT_RPM", 0))
+LLM_DEFAULT_TPM = int(os.getenv("LLM_DEFAULT_TPM", 0))
+LLM_RATE_LIMITS: Dict[str, dict] = json.loads(os.getenv("LLM_RATE_LIMITS", "{}") or "{}")
+# Thời gian chờ tối đa (giây) để có budget trước khi trả lời "hệ thống đang bận"
+LLM_RATE_LIMIT_MAX_WAIT = float(os.getenv("LLM_RATE_LIMIT_MAX_WAIT", 10))
+# Ước lượng token: số ký tự / CHARS_PER_TOKEN + số token output dự kiến
+CHARS_PER_TOKEN = 4
+LLM_ESTIMATED_OUTPUT_TOKENS = int(os.getenv("LLM_ESTIMATED_OUTPUT_TOKENS", 512))
+
+# Câu trả lời khi không lấy được budget trong thời gian chờ
+RATE_LIMITED_MESSAGE = "Hệ thống đang có nhiều yêu cầu, bạn vui lòng thử lại sau giây lát."
+
+
+# KEYS[1] = bucket RPM, KEYS[2] = bucket TPM, KEYS[3] = key đánh dấu saturated
+# ARGV[1] = rpm, ARGV[2] = tpm, ARGV[3] = số token ước lượng
+# Trả về 0 nếu lấy được budget, ngược lại số ms cần chờ
+ACQUIRE_SCRIPT = """
+local t = redis.call('TIME')
+local now = tonumber(t[1]) * 1000 + math.floor(tonumber(t[2]) / 1000)
+local rpm = tonumber(ARGV[1])
+local tpm = tonumber(ARGV[2])
+local cost = tonumber(ARGV[3])
+
+local function refill(key, capacity)
+    if capacity <= 0 then
+        return nil
+    end
+    local data = redis.call('HMGET', key, 'tokens', 'ts')
+    local tokens = tonumber(data[1]) or capacity
+    local ts = tonumber(data[2]) or now
+    return math.min(capacity, tokens + math.max(now - ts, 0) * capacity / 60000)
+end
+
+local requests = refill(KEYS[1], rpm)
+local tokens = refill(KEYS[2], tpm)
+-- Request lớn hơn cả bucket thì chỉ cần bucket đầy
+if tpm > 0 and cost > tpm then
+    cost = tpm
+end
+
+local wait = 0
+if requests and requests < 1 then
+    wait = math.max(wait, (1 - requests) * 60000 / rpm)
+end
+if tokens and tokens < cost then
+    wait = math.max(wait, (cost - tokens) * 60000 / tpm)
+end
+
+if wait > 0 then
+    wait = math.ceil(wait)
+    redis.call('SET', KEYS[3], 1, 'PX', wait)
+    return wait
+end
+
+if requests then
+    redis.call('HSET', KEYS[1], 'tokens', requests - 1, 'ts', now)
+    redis.call('PEXPIRE', KEYS[1], 60000)
+end
+if tokens then
+    redis.call('HSET', KEYS[2], 'tokens', tokens - cost, 'ts', now)
+    redis.call('PEXPIRE', KEYS[2], 60000)
+end
+return 0
+"""
+
+_scripts: Dict[int, object] = {}
+
+_stats = {
+    "acquired": 0,
+    "waited": 0,
+    "wait_ms_total": 0.0,
+    "rejected": 0,
+    # Lượt gặp (model, key) hết budget → key bị đánh dấu saturated
+    "saturated": 0,
+    # Redis lỗi → cho qua không giới hạn
+    "redis_fallback": 0
+}
+
+
+def get_model_budget(model_name: str) -> dict:
+    budget = LLM_RATE_LIMITS.get(model_name) or {}
+    return {
+        "rpm": int(budget.get("rpm", LLM_DEFAULT_RPM) or 0),
+        "tpm": int(budget.get("tpm", LLM_DEFAULT_TPM) or 0)
+    }
+
+
+def estimate_tokens(prompt: str) -> int:
+    return len(prompt or "") // CHARS_PER_TOKEN + LLM_ESTIMATED_OUTPUT_TOKENS
+
+
+def get_saturated_key(api_key: str, model_name: str) -> str:
+    return f"llm_rate:saturated:{model_name}:{get_key_fingerprint(api_key)}"
+
+
+def _get_bucket_keys(api_key: str, model_name: str) -> list:
+    fingerprint = get_key_fingerprint(api_key)
+    return [
+        f"llm_rate:rpm:{model_name}:{fingerprint}",
+        f"llm_rate:tpm:{model_name}:{fingerprint}",
+        get_saturated_key(api_key, model_name)
+    ]
+
+
+async def acquire_llm_budget(
+    api_key: str,
+    model_name: str,
+    prompt: str,
+    max_wait: Optional[float] = None
+) -> bool:
+    """
+    Lấy budget RPM/TPM cho 1 request, chờ tối đa max_wait giây
+
+    Returns:
+        bool: True nếu được phép gọi provider, False nếu hết thời gian chờ
+    """
+    if not LLM_RATE_LIMIT_ENABLED:
+        return True
+
+    budget = get_model_budget(model_name)
+    if not budget["rpm"] and not budget["tpm"]:
+        return True
+
+    try:
+        client = await redis_cache.get_async_client()
+    except Exception as e:
+        logger.error(f"Error getting Redis client for rate limiter: {e}")
+        client = None
+    if client is None:
+        # Không có Redis thì không giới hạn được giữa các worker → cho qua
+        _stats["redis_fallback"] += 1
+        return True
+
+    script = _scripts.get(id(client))
+    if script is None:
+        script = client.register_script(ACQUIRE_SCRIPT)
+        _scripts[id(client)] = script
+
+    max_wait = LLM_RATE_LIMIT_MAX_WAIT if max_wait is None else max_wait
+    keys = _get_bucket_keys(api_key, model_name)
+    cost = estimate_tokens(prompt)
+    started = time.monotonic()
+    waited = False
+
+    while True:
+        try:
+            wait_ms = int(await script(keys=keys, args=[budget["rpm"], budget["tpm"], cost]))
+        except Exception as e:
+            logger.error(f"Error acquiring LLM budget: {e}")
+            _stats["redis_fallback"] += 1
+            return True
+
+        elapsed = time.monotonic() - started
+        if wait_ms == 0:
+            _stats["acquired"] += 1
+            if waited:
+                _stats["waited"] += 1
+                _stats["wait_ms_total"] += elapsed * 1000
+            return True
+
+        if not waited:
+            _stats["saturated"] += 1
+        if elapsed + wait_ms / 1000 > max_wait:
+            _stats["rejected"] += 1
+            return False
+
+        # Jitter để các worker đang chờ không cùng lúc gọi lại
+        waited = True
+        await asyncio.sleep(wait_ms / 1000 * (1 + random.random() * 0.2))
+
+
+def get_rate_limiter_stats() -> dict:
+    return {
+        **_stats,
+        "wait_ms_total": round(_stats["wait_ms_total"], 2),
+        "enabled": LLM_RATE_LIMIT_ENABLED,
+        "wait_ms_avg": round(_stats["wait_ms_total"] / _stats["waited"], 2) if _stats["waited"] else None
+    }
@@ -4,59 +4,21 @@ from llm.gemini import generate_gemini_response
 from llm.gpt import generate_gpt_response
 from config.chromadb_config import search_chunks_tthc, search_chunks_with_metadata, search_chunks_with_metadata_tthc
 from config.get_embedding import get_embedding_gemini, get_embedding_chatgpt
-from sqlalchemy import select
-from collections import defaultdict
-from config.database import AsyncSessionLocal
-from models.knowledge_base import KnowledgeBase, KnowledgeBaseDetail, KnowledgeCategory
+from helper.help_catalog_cache import get_catalog_snapshot
+from helper.help_embedding_cache import get_cached_embedding, cache_embedding
 
 
 
 # Đang dùng
 async def get_all_categories_service_for_chunk():
-    async with AsyncSessionLocal() as session:
-        
-        result = await session.execute(
-            select(
-                KnowledgeCategory.id,
-                KnowledgeCategory.name,
-                KnowledgeCategory.description,
-                KnowledgeBaseDetail.file_name,
-                KnowledgeBaseDetail.description
-            ).outerjoin(KnowledgeBaseDetail, KnowledgeCategory.id == KnowledgeBaseDetail.category_id)
-        )
-        rows = result.all()
-
-        category_dict = defaultdict(lambda: {"file_list": [], "category_description": None})
-
-        for cat_id, cat_name, cat_desc, file_name, file_desc in rows:
-            key = (cat_id, cat_name)
-            category_dict[key]["category_description"] = cat_desc
-
-            if file_name:
-                category_dict[key]["file_list"].append({
-                    "file_name": file_name,
-                    "summary": file_desc
-                })
-
-        formatted_categories = []
-        for (cat_id, cat_name), data in category_dict.items():
-            if not data["file_list"]:
-                continue 
-
-            formatted_categories.append({
-                "category_id": cat_id,
-                "category_name": cat_name,
-                "category_description": data["category_description"],
-                "file_list": data["file_list"]
-            })
-
-        return formatted_categories
+    snapshot = await get_catalog_snapshot()
+    return snapshot["categories"]
     
     
 # Đang dùng
 async def search_metadata(query: str, model_name: str, api_key: str) -> Dict[str, any]:
     
-    categories = await get_all_categories_service_for_chunk()
+    snapshot = await get_catalog_snapshot()
          
     
     prompt = f"""
@@ -68,7 +30,7 @@ Nhiệm vụ:
 - Hãy xác định category phù hợp nhất và danh sách file cần thiết.
 
 Dữ liệu categories:
-{json.dumps(categories, ensure_ascii=False)}
+{snapshot["categories_json"]}
 
 Yêu cầu trả về đúng JSON theo format:
 {{
@@ -145,12 +107,32 @@ Hãy trả về danh sách các thủ tục phù hợp với câu hỏi này, **
         
 
 
+async def embed_query(
+    query: str,
+    embedding_key: str,
+    embedding_model_name: str
+) -> List[float]:
+    
+    cached = await get_cached_embedding(query, embedding_model_name)
+    if cached is not None:
+        return cached
+    
+    if "gemini" in embedding_model_name.lower():
+        q_emb = await get_embedding_gemini(query, embedding_key)
+    else:
+        q_emb = await get_embedding_chatgpt(query, embedding_key)
+    
+    await cache_embedding(query, embedding_model_name, q_emb)
+    return q_emb
+
+
 async def search_data(
     query: str, 
     embedding_key: str,
     embedding_model_name: str, 
     top_k: int,
-    metadata_filter: Optional[Dict] = None
+    metadata_filter: Optional[Dict] = None,
+    query_embedding: Optional[List[float]] = None
 ) -> List[Dict]:
 
 
@@ -158,11 +140,10 @@ async def search_data(
         return []
     
     
-    
-    if "gemini" in embedding_model_name.lower():
-        q_emb = await get_embedding_gemini(query, embedding_key)
-    else:
-        q_emb = await get_embedding_chatgpt(query, embedding_key)
+    # Dùng lại embedding đã tính ở bước định tuyến nếu có
+    q_emb = query_embedding
+    if q_emb is None:
+        q_emb = await embed_query(query, embedding_key, embedding_model_name)
 
 
 
@@ -175,11 +156,3 @@ async def search_data(
     
     
     return result
-    
-    
-    
-    
-
-
-
-
@@ -0,0 +1,117 @@
+"""
+Tách nội dung "message" từ JSON {"message": ..., "links": [...]} mà LLM đang stream
+- Mỗi lần feed 1 đoạn text thô, trả về phần message mới giải mã được (đã xử lý escape JSON)
+- Bỏ qua ```json fence; nếu model không trả JSON thì stream nguyên văn text
+- Escape \\u sai (không phải hex, surrogate lẻ) không làm hỏng stream: giữ nguyên văn / thay bằng U+FFFD
+"""
+
+import re
+
+_MESSAGE_KEY = re.compile(r'"message"\s*:\s*"')
+_ESCAPES = {'"': '"', '\\': '\\', '/': '/', 'b': '\b', 'f': '\f', 'n': '\n', 'r': '\r', 't': '\t'}
+_HEX_DIGITS = set("0123456789abcdefABCDEF")
+
+
+def _parse_hex4(text: str) -> int:
+    """
+    Giá trị của 4 ký tự hex sau \\u, -1 nếu không hợp lệ
+    """
+    return int(text, 16) if len(text) == 4 and set(text) <= _HEX_DIGITS else -1
+
+
+class MessageStreamExtractor:
+
+    def __init__(self):
+        self.raw = ""
+        # None: chưa biết, "json": đang tìm / đọc field message, "text": không phải JSON
+        self.mode = None
+        self.pos = None
+        self.done = False
+
+    def _detect_mode(self) -> None:
+        head = self.raw.lstrip()
+        if head and "```".startswith(head):
+            return
+        if head.startswith("```"):
+            head = head[3:]
+            if len(head) < 4 and "json".startswith(head):
+                return
+            if head.startswith("json"):
+                head = head[4:]
+            head = head.lstrip()
+        if not head:
+            return
+        self.mode = "json" if head[0] == "{" else "text"
+        if self.mode == "text":
+            self.pos = len(self.raw) - len(self.raw.lstrip())
+
+    def feed(self, chunk: str) -> str:
+        if not chunk or self.done:
+            return ""
+        self.raw += chunk
+
+        if self.mode is None:
+            self._detect_mode()
+            if self.mode is None:
+                return ""
+
+        if self.mode == "text":
+            delta = self.raw[self.pos:]
+            self.pos = len(self.raw)
+            return delta
+
+        if self.pos is None:
+            match = _MESSAGE_KEY.search(self.raw)
+            if match is None:
+                return ""
+            self.pos = match.end()
+
+        out = []
+        i = self.pos
+        while i < len(self.raw):
+            c = self.raw[i]
+            if c == '"':
+                self.done = True
+                i += 1
+                break
+            if c != '\\':
+                out.append(c)
+                i += 1
+                continue
+
+            # Escape chưa nhận đủ → đợi chunk sau
+            if i + 1 >= len(self.raw):
+                break
+            code = self.raw[i + 1]
+            if code == 'u':
+                if i + 6 > len(self.raw):
+                    break
+                point = _parse_hex4(self.raw[i + 2:i + 6])
+                if point < 0:
+                    # Không phải hex → giữ nguyên văn \u thay vì dừng stream
+                    out.append(self.raw[i:i + 2])
+                    i += 2
+                    continue
+                if 0xD800 <= point < 0xDC00:
+                    # Cặp surrogate (emoji...) cần đủ 2 escape \uXXXX
+                    low = -1
+                    if '\\u'.startswith(self.raw[i + 6:i + 8]):
+                        if i + 12 > len(self.raw):
+                            break
+                        low = _parse_hex4(self.raw[i + 8:i + 12])
+                    if 0xDC00 <= low < 0xE000:
+                        point = 0x10000 + ((point - 0xD800) << 10) + (low - 0xDC00)
+                        i += 6
+                    else:
+                        point = 0xFFFD
+                elif 0xDC00 <= point < 0xE000:
+                    # Surrogate thấp đứng lẻ không mã hóa UTF-8 được
+                    point = 0xFFFD
+                out.append(chr(point))
+                i += 6
+            else:
+                out.append(_ESCAPES.get(code, code))
+                i += 2
+
+        self.pos = i
+        return "".join(out)
@@ -1,5 +1,12 @@
 from fastapi import FastAPI, Request
 from config.database import create_tables
+from config.llm_clients import llm_clients
+from config import http_clients
+from helper import help_outbox
+from helper import help_webhook_queue
+from config.websocket_backplane import websocket_backplane
+from config.websocket_replay import websocket_replay
+from config.websocket_manager import ConnectionManager
 from datetime import datetime
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
@@ -33,6 +40,23 @@ app = FastAPI()
 @app.on_event("startup")
 async def startup_event():
     await create_tables()
+    await websocket_backplane.start()
+    await websocket_replay.start()
+    if help_outbox.OUTBOX_RUN_IN_APP:
+        await help_outbox.start_outbox_workers()
+    if help_webhook_queue.WEBHOOK_RUN_IN_APP:
+        await help_webhook_queue.start_webhook_consumers()
+
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    await help_webhook_queue.stop_webhook_consumers()
+    await help_outbox.stop_outbox_workers()
+    await websocket_replay.stop()
+    await websocket_backplane.stop()
+    await ConnectionManager().stop_heartbeat()
+    await llm_clients.close_all()
+    await http_clients.close_all()
 
 app.include_router(user_router.router)
 app.include_router(company_router.router)
@@ -44,6 +44,7 @@ class LLMKey(Base):
     name = Column(String(150), nullable=False)
     key = Column(String(150), nullable=False)
     type = Column(String(50), nullable=False, default="bot")  # "bot" hoặc "embedding"
+    weight = Column(Integer, nullable=False, default=1, server_default="1")  # Trọng số round-robin (0 = tắt key)
     created_at = Column(DateTime, default=datetime.now)
     updated_at = Column(DateTime, default=datetime.now, onupdate=datetime.now)
     llm_detail_id = Column(Integer, ForeignKey("llm_detail.id"), nullable=False)
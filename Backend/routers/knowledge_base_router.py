@@ -80,6 +80,30 @@ async def add_kb_rich_text(
     )
     
     
+@router.get("/catalog-cache/stats")
+async def get_catalog_cache_stats():
+
+    return await knowledge_base_controller.get_catalog_cache_stats_controller()
+
+
+@router.get("/local-router/stats")
+async def get_local_router_stats():
+
+    return await knowledge_base_controller.get_local_router_stats_controller()
+
+
+@router.get("/embedding-cache/stats")
+async def get_embedding_cache_stats():
+
+    return await knowledge_base_controller.get_embedding_cache_stats_controller()
+
+
+@router.get("/semantic-cache/stats")
+async def get_semantic_cache_stats():
+
+    return await knowledge_base_controller.get_semantic_cache_stats_controller()
+
+
 # Categories
 @router.get("/categories")
 async def get_all_categories(db: AsyncSession = Depends(get_db)):
@@ -12,7 +12,9 @@ from controllers.llm_key_controller import (
     create_llm_key_controller,
     update_llm_key_controller,
     delete_llm_key_controller,
-    get_llm_keys_controller
+    get_llm_keys_controller,
+    get_llm_keys_health_controller,
+    get_rate_limiter_stats_controller
 )
 
 router = APIRouter(prefix="/llms", tags=["LLMs"])
@@ -72,4 +74,14 @@ async def delete_llm_key(llm_detail_id: int, key_id: int, db: AsyncSession = Dep
 @router.get("/details/{llm_detail_id}/keys")
 async def get_llm_keys(llm_detail_id: int, db: AsyncSession = Depends(get_db)):
     """Lấy tất cả keys của LLMDetail"""
-    return await get_llm_keys_controller(llm_detail_id, db)
\ No newline at end of file
+    return await get_llm_keys_controller(llm_detail_id, db)
+
+@router.get("/details/{llm_detail_id}/keys/health")
+async def get_llm_keys_health(llm_detail_id: int, db: AsyncSession = Depends(get_db)):
+    """Sức khỏe từng key của LLMDetail (latency, lỗi, rate limit, cooldown)"""
+    return await get_llm_keys_health_controller(llm_detail_id, db)
+
+@router.get("/rate-limiter/stats")
+async def get_rate_limiter_stats():
+    """Thống kê rate limiter LLM của worker (chờ budget, từ chối, key hết budget, Redis lỗi)"""
+    return await get_rate_limiter_stats_controller()
@@ -13,8 +13,16 @@ from config.websocket_manager import ConnectionManager
 from controllers.social_controller import (
     chat_platform,
     customer_chat,
-    admin_chat
+    admin_chat,
+    get_outbox_stats_controller,
+    get_webhook_queue_stats_controller,
+    get_debounce_stats_controller,
+    get_session_lock_stats_controller,
+    get_backplane_stats_controller,
+    get_websocket_stats_controller
 )
+from helper.help_webhook_queue import enqueue_webhook_event, WebhookQueueFull
+from helper.help_webhook_dedup import filter_duplicate_webhook, release_webhook_dedup
 
 router = APIRouter(prefix="/chat", tags=["Chat"])
 
@@ -33,9 +41,24 @@ async def customer_ws(websocket: WebSocket):
         await websocket.close(code=1008, reason="Invalid sessionId")
         return
 
+    # ?stream=1 → nhận frame bot_delta khi bot đang trả lời
+    stream = websocket.query_params.get("stream", "").lower() in ("1", "true")
+    # ?heartbeat=1 → nhận frame ping, trả lời pong; im lặng quá lâu sẽ bị ngắt
+    heartbeat = websocket.query_params.get("heartbeat", "").lower() in ("1", "true")
+
+    # ?since=<session_seq cuối đã nhận> → gửi lại các frame bị lỡ khi mất kết nối
+    since = None
+    since_str = websocket.query_params.get("since")
+    if since_str:
+        try:
+            since = int(since_str)
+        except ValueError:
+            await websocket.close(code=1008, reason="Invalid since")
+            return
+
     try:
         
-        await customer_chat(websocket, session_id)
+        await customer_chat(websocket, session_id, stream=stream, heartbeat=heartbeat, since=since)
     except WebSocketDisconnect:
         print(f"Customer WS disconnected: {session_id}")
     except Exception as e:
@@ -60,7 +83,9 @@ async def admin_ws(websocket: WebSocket):
         
 
         
-        await admin_chat(websocket, user)
+        stream = websocket.query_params.get("stream", "").lower() in ("1", "true")
+        heartbeat = websocket.query_params.get("heartbeat", "").lower() in ("1", "true")
+        await admin_chat(websocket, user, stream=stream, heartbeat=heartbeat)
 
     except WebSocketDisconnect:
         username = user.username if user else "unknown_admin"
@@ -85,6 +110,24 @@ async def process_message(platform: str, body: dict):
         print(f"❌ Lỗi xử lý tin nhắn {platform}: {e}")
 
 
+async def ingest_webhook(platform: str, body: dict) -> Response:
+    # Nền tảng gửi lại webhook đã nhận → bỏ trước khi đụng tới DB / LLM
+    body = await filter_duplicate_webhook(platform, body)
+    if body is None:
+        return Response(status_code=200)
+
+    # Ghi event vào hàng đợi rồi trả 200; Redis lỗi thì xử lý trực tiếp như trước
+    try:
+        entry_id = await enqueue_webhook_event(platform, body)
+    except WebhookQueueFull:
+        # Nền tảng sẽ gửi lại webhook sau → bỏ khóa chống trùng để lần gửi lại được xử lý
+        await release_webhook_dedup(platform, body)
+        return Response(status_code=503)
+    if entry_id is None:
+        asyncio.create_task(process_message(platform, body))
+    return Response(status_code=200)
+
+
 # FB
 @router.get("/webhook/fb") 
 async def receive_message(request: Request):
@@ -105,8 +148,7 @@ async def receive_message(request: Request):
 @router.post("/webhook/fb")
 async def receive_fb_message(request: Request):
     body = await request.json()
-    asyncio.create_task(process_message("fb", body))
-    return Response(status_code=200)
+    return await ingest_webhook("fb", body)
 
 
 # TELEGRAM_BOT
@@ -115,14 +157,47 @@ async def receive_tele_message(request: Request):
     data = await request.json()
      
     
-    asyncio.create_task(process_message("tele", data))
-
-    return Response(status_code=200)
+    return await ingest_webhook("tele", data)
 
 
 # ZALO
 @router.post("/zalo/webhook") 
 async def receive_zalo_message(request: Request): 
     data = await request.json()
-    asyncio.create_task(process_message("zalo", data))
-    return Response(status_code=200)
\ No newline at end of file
+    return await ingest_webhook("zalo", data)
+
+
+@router.get("/outbox/stats")
+async def get_outbox_stats():
+
+    return await get_outbox_stats_controller()
+
+
+@router.get("/webhook/stats")
+async def get_webhook_queue_stats():
+
+    return await get_webhook_queue_stats_controller()
+
+
+@router.get("/debounce/stats")
+async def get_debounce_stats():
+
+    return await get_debounce_stats_controller()
+
+
+@router.get("/generation-lock/stats")
+async def get_session_lock_stats():
+
+    return await get_session_lock_stats_controller()
+
+
+@router.get("/backplane/stats")
+async def get_backplane_stats():
+
+    return await get_backplane_stats_controller()
+
+
+@router.get("/websocket/stats")
+async def get_websocket_stats():
+
+    return await get_websocket_stats_controller()
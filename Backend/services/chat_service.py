@@ -226,7 +226,7 @@ async def update_chat_session(id: int, data: dict, user, db: Session):
         }
         
         print("Sending socket message:", socket_data)
-        await send_socket_message(id, socket_data)
+        await send_socket_message(id, socket_data, channel=chatSession.channel)
         
         return {
             "chat_session_id": chatSession.id,
@@ -248,6 +248,7 @@ async def delete_chat_session(ids: list[int], db):
         if not sessions:
             return 0
         
+        channels = {s.id: s.channel for s in sessions}
         # Clear cache cho từng session trước khi xóa
         for s in sessions:
             clear_session_cache(s.id)
@@ -261,7 +262,7 @@ async def delete_chat_session(ids: list[int], db):
                 "chat_session_id": session_id,
                 "deleted_ids": ids
             }
-            await send_socket_message(session_id, socket_data)
+            await send_socket_message(session_id, socket_data, channel=channels.get(session_id))
         
         return len(sessions)
     except Exception as e:
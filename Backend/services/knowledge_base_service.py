@@ -10,6 +10,8 @@ from helper.file_processor import (
 )
 
 from config.chromadb_config import delete_chunks
+from helper.help_catalog_cache import invalidate_catalog_cache
+from helper.help_semantic_cache import invalidate_semantic_answers
 
 from typing import Optional, List
 import logging
@@ -235,6 +237,10 @@ async def create_kb_with_files_service(
         success_count = len(successful_files)
         failed_count = len(failed_files)
         
+        if success_count > 0:
+            await invalidate_catalog_cache()
+            await invalidate_semantic_answers(category_ids=[category_id])
+        
         if success_count == total_files:
             status = "success"
             message = f"Đã xử lý thành công tất cả {success_count} file"
@@ -295,6 +301,8 @@ async def add_kb_rich_text_service(
         )
         
         if success:
+            await invalidate_catalog_cache()
+            await invalidate_semantic_answers(category_ids=[category_id])
             return detail
         
         else:
@@ -378,6 +386,8 @@ async def update_kb_with_rich_text_service(
         # Chỉ commit khi tất cả các bước trên thành công
         await db.commit()
         logger.info(f"Đã commit thành công toàn bộ thay đổi cho detail_id={detail_id}.")
+        await invalidate_catalog_cache()
+        await invalidate_semantic_answers(knowledge_ids=[detail_id])
 
         # Bước 6: SỬA LỖI MissingGreenlet
         # Tải lại 'kb' với đầy đủ quan hệ để trả về
@@ -464,6 +474,8 @@ async def delete_kb_detail_service(detail_id: int, db: AsyncSession):
         detail = await db.get(KnowledgeBaseDetail, detail_id)
         await db.delete(detail)
         await db.commit()
+        await invalidate_catalog_cache()
+        await invalidate_semantic_answers(knowledge_ids=[detail_id])
         return True
     except Exception as e:
         await db.rollback()
@@ -494,12 +506,18 @@ async def delete_multiple_kb_details_service(detail_ids: list, db: AsyncSession)
                 failed_ids.append(detail_id)
                 logger.warning(f"Không tìm thấy detail ID {detail_id}")
             
+            # Sau commit: lượt chat đồng thời không nạp lại được dữ liệu cũ dưới version mới
+            await invalidate_semantic_answers(knowledge_ids=[detail_id])
+            
         except Exception as e:
             await db.rollback()
             failed_count += 1
             failed_ids.append(detail_id)
             logger.error(f"Lỗi khi xóa detail {detail_id}: {str(e)}")
     
+    if deleted_count > 0:
+        await invalidate_catalog_cache()
+    
     return {
         "total_count": len(detail_ids),
         "deleted_count": deleted_count,
@@ -599,6 +617,7 @@ async def create_category_service(name: str, description: Optional[str], db: Asy
         await db.refresh(category)
         
         logger.info(f"Đã tạo category mới: {name}")
+        await invalidate_catalog_cache()
         
         return {
             "id": category.id,
@@ -642,6 +661,7 @@ async def update_category_service(category_id: int, name: str, description: Opti
         await db.refresh(category)
         
         logger.info(f"Đã cập nhật category ID {category_id}")
+        await invalidate_catalog_cache()
         
         return {
             "id": category.id,
@@ -677,6 +697,8 @@ async def delete_category_service(category_id: int, db: AsyncSession):
         await db.commit()
         
         logger.info(f"Đã xóa category ID {category_id}")
+        await invalidate_catalog_cache()
+        await invalidate_semantic_answers(category_ids=[category_id])
         return True
         
     except Exception as e:
@@ -2,6 +2,21 @@ from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy import select
 from sqlalchemy.orm import selectinload
 from models.llm import LLM, LLMKey, LLMDetail
+from llm.help_key_scheduler import MAX_KEY_WEIGHT
+
+
+def parse_key_weight(value) -> int:
+    """
+    Trọng số round-robin của key: số nguyên 1..MAX_KEY_WEIGHT, 0 = tắt key (không được chọn)
+
+    Raises:
+        ValueError: trọng số không hợp lệ (None, số âm, số thực, chuỗi không phải số...)
+    """
+    if isinstance(value, str) and value.strip().isdigit():
+        value = int(value)
+    if isinstance(value, bool) or not isinstance(value, int) or not 0 <= value <= MAX_KEY_WEIGHT:
+        raise ValueError(f"Trọng số key phải là số nguyên từ 1 đến {MAX_KEY_WEIGHT}, hoặc 0 để tắt key")
+    return value
 
 async def create_llm_service(data: dict, db: AsyncSession):
     llm_instance = LLM(
@@ -86,6 +101,7 @@ async def create_llm_key_service(llm_detail_id: int, data: dict, db: AsyncSessio
     # Kiểm tra tên key trùng trong cùng llm_detail và cùng type
     key_type = data.get("type", "bot")
     key_name = data.get("name")
+    weight = parse_key_weight(data["weight"]) if "weight" in data else 1
     
     # Lấy tất cả keys có cùng llm_detail_id và type
     result = await db.execute(
@@ -104,6 +120,7 @@ async def create_llm_key_service(llm_detail_id: int, data: dict, db: AsyncSessio
         name=key_name,
         key=data.get("key"),
         type=key_type,
+        weight=weight,
         llm_detail_id=llm_detail_id
     )
     db.add(llm_key)
@@ -114,6 +131,8 @@ async def create_llm_key_service(llm_detail_id: int, data: dict, db: AsyncSessio
 
 async def update_llm_key_service(key_id: int, data: dict, db: AsyncSession):
     """Cập nhật thông tin của một key"""
+    weight = parse_key_weight(data['weight']) if 'weight' in data else None
+
     result = await db.execute(select(LLMKey).filter(LLMKey.id == key_id))
     llm_key = result.scalar_one_or_none()
     if not llm_key:
@@ -137,6 +156,8 @@ async def update_llm_key_service(key_id: int, data: dict, db: AsyncSession):
     llm_key.name = data.get('name', llm_key.name)
     llm_key.key = data.get('key', llm_key.key)
     llm_key.type = data.get('type', llm_key.type)
+    if weight is not None:
+        llm_key.weight = weight
     await db.commit()
     await db.refresh(llm_key)
     return llm_key
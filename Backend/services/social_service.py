@@ -1,23 +1,32 @@
 import asyncio
+import os
 import traceback
 from datetime import datetime, timedelta
 from config.save_base64_image import save_base64_image
 from helper.task import (
     save_message_to_db_background, 
+    save_messages_to_db,
     update_session_admin_background,
-    send_to_platform_background,
+    queue_platform_message,
     generate_and_send_bot_response,
     send_socket_message
 )
+from helper.help_debounce import schedule_bot_response
 from helper.help_chat import (
     get_session_by_id_cached,
     get_or_create_session_by_name_cached,
+    get_or_create_sessions_by_names_cached,
     build_session_name,
     check_repply_cached,
     check_page_active_status
 )
 
 
+# Số câu trả lời bot sinh đồng thời tối đa cho các webhook gom nhiều tin nhắn
+PAGE_GENERATION_CONCURRENCY = int(os.getenv("PAGE_GENERATION_CONCURRENCY", 16))
+_generation_semaphore = asyncio.Semaphore(PAGE_GENERATION_CONCURRENCY)
+
+
 
 
 
@@ -53,7 +62,7 @@ async def send_message_fast_service(data: dict, user, db):
         "created_at": datetime.now().isoformat()
     }
     
-    asyncio.create_task(send_socket_message(chat_session_id, user_message)) 
+    asyncio.create_task(send_socket_message(chat_session_id, user_message, channel=session_data.get("channel"))) 
     asyncio.create_task(save_message_to_db_background(data, sender_name, image_url))
     
     
@@ -63,23 +72,24 @@ async def send_message_fast_service(data: dict, user, db):
         
         
         name_to_send = session_data["name"][2:]
-        asyncio.create_task(send_to_platform_background(
+        await queue_platform_message(
             session_data["channel"], 
             session_data.get("page_id"),
             name_to_send, 
             user_message, 
             data.get("image")
-        ))
+        )
         
         return
     
     should_reply = await check_repply_cached(chat_session_id, db)
     if should_reply:
-        asyncio.create_task(generate_and_send_bot_response(
-            data.get("content"),
+        # Gộp các tin gửi liên tiếp thành 1 lượt trả lời
+        schedule_bot_response(
             chat_session_id,
-            session_data
-        ))
+            data.get("content"),
+            lambda content: generate_and_send_bot_response(content, chat_session_id, session_data)
+        )
         
     
 
@@ -106,30 +116,109 @@ async def send_message_page_service(data: dict, db):
         "created_at": datetime.now().isoformat()
     }
     
-    asyncio.create_task(send_socket_message(session_data['id'], customer_message))
+    asyncio.create_task(send_socket_message(session_data['id'], customer_message, channel=session_data.get("channel")))
     
     message_data = {
         "chat_session_id": session_data['id'],
         "sender_type": "customer",
         "content": data["message"]
     }
-    asyncio.create_task(save_message_to_db_background(message_data, None, []))
-    
     
     page_is_active = await check_page_active_status(data["platform"], data.get("page_id"), db)
+    should_reply = page_is_active and await check_repply_cached(session_data['id'], db)
     
-    if page_is_active:
-        should_reply = await check_repply_cached(session_data['id'], db)
-        
-        if should_reply:
-            asyncio.create_task(generate_and_send_bot_response(
-                data["message"],
+    # Lưu xong mới ack event webhook: lỗi DB → consumer xử lý lại / chuyển webhook:failed
+    await save_messages_to_db([message_data])
+    
+    if should_reply:
+        # Gộp các tin gửi liên tiếp thành 1 lượt trả lời
+        schedule_bot_response(
+            session_data['id'],
+            data["message"],
+            lambda content: generate_and_send_bot_response(
+                content,
                 session_data['id'],
                 session_data,
                 platform=data["platform"],
                 page_id=data.get("page_id"),
                 sender_id=data["sender_id"]
-            ))
+            )
+        )
 
 
+async def _generate_bot_response_limited(*args, **kwargs):
+    # Semaphore lấy bên trong lượt của session: session đang chờ lượt không chiếm chỗ
+    await generate_and_send_bot_response(*args, concurrency_limit=_generation_semaphore, **kwargs)
 
+
+async def send_message_page_batch_service(items: list, db):
+    """
+    Xử lý mọi tin nhắn trong 1 webhook (Facebook gom tới 1000 event / request):
+    - Tra / tạo session cho cả batch 1 lần
+    - Lưu tin nhắn khách bằng 1 câu INSERT nhiều dòng
+    - Mỗi session chỉ sinh 1 câu trả lời cho các tin trong batch (gộp theo thứ tự),
+      các session chạy song song với giới hạn PAGE_GENERATION_CONCURRENCY
+    """
+    sessions = await get_or_create_sessions_by_names_cached(
+        {
+            build_session_name(item["platform"], item["sender_id"]): (item["platform"], item.get("page_id", ""))
+            for item in items
+        },
+        db
+    )
+    
+    rows = []
+    # session_id -> (session_data, item cuối, nội dung các tin theo thứ tự)
+    by_session = {}
+    for item in items:
+        session_data = sessions[build_session_name(item["platform"], item["sender_id"])]
+        
+        customer_message = {
+            "id": None,
+            "chat_session_id": session_data['id'],
+            "sender_type": "customer",
+            "sender_name": None,
+            "content": item["message"],
+            "session_name": session_data['name'],
+            "session_status": session_data['status'],
+            "platform": item["platform"],
+            "created_at": datetime.now().isoformat()
+        }
+        asyncio.create_task(send_socket_message(session_data['id'], customer_message, channel=session_data.get("channel")))
+        
+        rows.append({
+            "chat_session_id": session_data['id'],
+            "sender_type": "customer",
+            "content": item["message"]
+        })
+        contents = by_session.get(session_data['id'], (None, None, []))[2]
+        contents.append(item["message"])
+        by_session[session_data['id']] = (session_data, item, contents)
+    
+    page_active = {}
+    reply_sessions = []
+    for session_id, (session_data, item, contents) in by_session.items():
+        page_key = (item["platform"], item.get("page_id"))
+        if page_key not in page_active:
+            page_active[page_key] = await check_page_active_status(item["platform"], item.get("page_id"), db)
+        # Kiểm tra tuần tự vì các coroutine không được dùng chung AsyncSession
+        if page_active[page_key] and await check_repply_cached(session_id, db):
+            reply_sessions.append(session_id)
+    
+    # Lưu xong mới ack event webhook: lỗi DB → consumer xử lý lại / chuyển webhook:failed
+    await save_messages_to_db(rows)
+    
+    for session_id in reply_sessions:
+        session_data, item, contents = by_session[session_id]
+        schedule_bot_response(
+            session_id,
+            "\n".join(contents),
+            lambda content, session_id=session_id, session_data=session_data, item=item: _generate_bot_response_limited(
+                content,
+                session_id,
+                session_data,
+                platform=item["platform"],
+                page_id=item.get("page_id"),
+                sender_id=item["sender_id"]
+            )
+        )
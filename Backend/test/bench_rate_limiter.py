@@ -0,0 +1,176 @@
+"""
+📊 BENCHMARK RATE LIMITER (TOKEN BUCKET)
+=========================================
+Phát lại 1 burst tin nhắn (vd: 1 page Facebook đổ về cùng lúc) vào provider giả lập:
+- Provider giả có giới hạn RPM theo key (token bucket), vượt quá trả 429
+- Chạy 2 lần: tắt limiter và bật limiter, so sánh số 429, số câu "hệ thống đang bận", độ trễ
+Chạy trên fakeredis (cần fakeredis + lupa), không gọi API thật.
+
+Chạy: python test/bench_rate_limiter.py  hoặc  python -m pytest test/bench_rate_limiter.py
+"""
+
+import asyncio
+import json
+import logging
+import os
+import random
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fakeredis import aioredis as fake_aioredis
+from config.redis_cache import redis_cache
+import llm.gpt as gpt
+import llm.help_key_health as health
+import llm.help_key_scheduler as scheduler
+import llm.help_rate_limiter as rate_limiter
+
+# ================== CẤU HÌNH ==================
+API_KEYS = ["bench-key-a", "bench-key-b"]
+MODEL_NAME = "gpt-4o-mini"
+PROVIDER_RPM = 60            # Giới hạn của provider cho mỗi key
+BURST_SIZE = 300             # Số tin nhắn trong burst
+BURST_SECONDS = 1.0          # Burst rải đều trong khoảng thời gian này
+MAX_WAIT = 3.0               # Thời gian chờ budget tối đa
+PROVIDER_LATENCY = 0.05
+PROVIDER_CLOCK_SKEW = 0.05
+
+
+class FakeRateLimitError(Exception):
+    status_code = 429
+
+
+class FakeProvider:
+    """Provider giả: token bucket RPM theo key giống cách provider thật nạp lại quota"""
+
+    def __init__(self, rpm: int):
+        self.rpm = rpm
+        self.buckets = {}
+        self.accepted = 0
+        self.rate_limited = 0
+
+    def admit(self, api_key: str) -> bool:
+        now = time.monotonic()
+        tokens, ts = self.buckets.get(api_key, (self.rpm, now))
+        tokens = min(self.rpm, tokens + (now - ts) * self.rpm / 60)
+        # Cho phép lệch đồng hồ / độ trễ mạng vài chục ms giữa limiter và provider
+        if tokens < 1 - PROVIDER_CLOCK_SKEW * self.rpm / 60:
+            self.buckets[api_key] = (tokens, now)
+            self.rate_limited += 1
+            return False
+        self.buckets[api_key] = (tokens - 1, now)
+        self.accepted += 1
+        return True
+
+
+class FakeMessage:
+    content = json.dumps({"message": "ok", "links": []})
+
+
+class FakeChoice:
+    message = FakeMessage()
+
+
+class FakeCompletion:
+    choices = [FakeChoice()]
+
+
+class FakeOpenAIClient:
+    def __init__(self, provider: FakeProvider, api_key: str):
+        self.provider = provider
+        self.api_key = api_key
+        self.chat = self
+        self.completions = self
+
+    async def create(self, **kwargs):
+        await asyncio.sleep(PROVIDER_LATENCY)
+        if not self.provider.admit(self.api_key):
+            raise FakeRateLimitError("429 Too Many Requests: rate limit exceeded")
+        return FakeCompletion()
+
+
+def _reset_state():
+    redis_cache._async_client = fake_aioredis.FakeRedis(decode_responses=True)
+    for module in (scheduler, health, rate_limiter):
+        module._scripts.clear()
+    health._health.clear()
+    for key in rate_limiter._stats:
+        rate_limiter._stats[key] = 0
+
+
+async def _handle_message(session_id: int, delay: float, latencies: list, replies: list):
+    await asyncio.sleep(delay)
+    started = time.perf_counter()
+
+    [index] = await scheduler.select_key_indexes([{
+        "session_key": scheduler.get_session_pin_key(session_id, 1, "bot"),
+        "counter_key": scheduler.get_counter_key(1, "bot"),
+        "weights": [1] * len(API_KEYS),
+        "cooldown_keys": [health.get_cooldown_key(k) for k in API_KEYS],
+        "saturated_keys": [rate_limiter.get_saturated_key(k, MODEL_NAME) for k in API_KEYS]
+    }])
+    reply = await gpt.generate_gpt_response(
+        api_key=API_KEYS[index],
+        prompt=f"Câu hỏi số {session_id}",
+        model_name=MODEL_NAME
+    )
+
+    latencies.append((time.perf_counter() - started) * 1000)
+    replies.append(json.loads(reply)["message"])
+
+
+async def run_burst(limiter_enabled: bool) -> dict:
+    _reset_state()
+    provider = FakeProvider(PROVIDER_RPM)
+    rate_limiter.LLM_RATE_LIMIT_ENABLED = limiter_enabled
+    rate_limiter.LLM_RATE_LIMITS[MODEL_NAME] = {"rpm": PROVIDER_RPM, "tpm": 0}
+    rate_limiter.LLM_RATE_LIMIT_MAX_WAIT = MAX_WAIT
+
+    original_client = gpt.get_openai_client
+    gpt.get_openai_client = lambda api_key: FakeOpenAIClient(provider, api_key)
+
+    latencies, replies = [], []
+    random.seed(42)
+    try:
+        await asyncio.gather(*[
+            _handle_message(i, random.random() * BURST_SECONDS, latencies, replies)
+            for i in range(BURST_SIZE)
+        ])
+    finally:
+        gpt.get_openai_client = original_client
+        rate_limiter.LLM_RATE_LIMITS.pop(MODEL_NAME, None)
+
+    latencies.sort()
+    return {
+        "limiter": "on" if limiter_enabled else "off",
+        "answered": replies.count("ok"),
+        "busy": replies.count(rate_limiter.RATE_LIMITED_MESSAGE),
+        "errors": len(replies) - replies.count("ok") - replies.count(rate_limiter.RATE_LIMITED_MESSAGE),
+        "provider_429": provider.rate_limited,
+        "p50_ms": round(statistics.median(latencies), 1),
+        "p99_ms": round(latencies[int(len(latencies) * 0.99) - 1], 1),
+        "limiter_stats": rate_limiter.get_rate_limiter_stats()
+    }
+
+
+def test_burst_never_exceeds_provider_limit():
+    baseline = asyncio.run(run_burst(limiter_enabled=False))
+    limited = asyncio.run(run_burst(limiter_enabled=True))
+
+    assert baseline["provider_429"] > 0
+    assert limited["provider_429"] == 0
+    assert limited["errors"] == 0
+    # Cả 2 key đều được dùng hết budget ban đầu
+    assert limited["answered"] >= PROVIDER_RPM * len(API_KEYS)
+
+
+if __name__ == "__main__":
+    # Ẩn log cooldown của từng request bị 429 khi chạy không có limiter
+    logging.disable(logging.WARNING)
+    for enabled in (False, True):
+        result = asyncio.run(run_burst(enabled))
+        print(f"\n=== Limiter {result.pop('limiter').upper()} ===")
+        for name, value in result.items():
+            print(f"  {name}: {value}")
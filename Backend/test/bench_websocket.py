@@ -0,0 +1,258 @@
+"""
+📊 BENCHMARK GỬI WEBSOCKET CHO NHIỀU ADMIN
+===========================================
+500 socket admin giả lập (vài socket chậm như trình duyệt ở mạng yếu), broadcast liên tục:
+- Gửi tuần tự (cách cũ: await send_json lần lượt từng admin)
+- Hàng đợi + writer task theo kết nối (ConnectionManager hiện tại)
+So sánh độ trễ p50 / p99 từ lúc broadcast tới lúc admin nhận được frame.
+
+Micro-benchmark mã hóa JSON cho 1 lần broadcast tới 500 admin:
+- json.dumps cho từng kết nối (cách WebSocket.send_json làm)
+- Mã hóa 1 lần bằng orjson (encode_json) rồi gửi cùng chuỗi cho mọi kết nối
+
+Micro-benchmark 10k kết nối / ngắt kết nối (ngắt theo thứ tự ngẫu nhiên như khi mất mạng hàng loạt):
+- Danh sách (cách cũ: list.append, `in` + list.remove)
+- Set / dict trong ConnectionManager hiện tại
+
+Chạy: python test/bench_websocket.py  hoặc  python -m pytest test/bench_websocket.py
+"""
+
+import asyncio
+import json
+import os
+import random
+import statistics
+import sys
+import time
+import orjson
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import config.websocket_manager as websocket_manager
+from config.websocket_manager import ConnectionManager, encode_json
+
+# ================== CẤU HÌNH ==================
+ADMIN_COUNT = 500
+SLOW_ADMIN_COUNT = 5
+SLOW_SEND_SECONDS = 0.05     # Mỗi lần gửi tới admin chậm mất 50ms
+FAST_SEND_SECONDS = 0.0
+BROADCAST_COUNT = 20
+BROADCAST_INTERVAL = 0.01
+ENCODE_ROUNDS = 20
+CHURN_CONNECTIONS = 10_000
+CHURN_SESSIONS = 10           # Widget của vài session đông khách mở nhiều tab
+
+
+class FakeAdminSocket:
+
+    def __init__(self, delay: float, latencies: list):
+        self.delay = delay
+        self.latencies = latencies
+
+    async def accept(self):
+        pass
+
+    async def send_json(self, message):
+        await asyncio.sleep(self.delay)
+        self.latencies.append((time.perf_counter() - message["sent_at"]) * 1000)
+
+    async def send_text(self, text):
+        await asyncio.sleep(self.delay)
+        self.latencies.append((time.perf_counter() - orjson.loads(text)["sent_at"]) * 1000)
+
+    async def close(self, code: int = 1000):
+        pass
+
+
+def _new_manager() -> ConnectionManager:
+    manager = object.__new__(ConnectionManager)
+    manager._initialized = False
+    manager.__init__()
+    return manager
+
+
+async def _sequential_broadcast(admins: list, message: dict):
+    # Cách gửi trước khi có hàng đợi theo kết nối
+    for admin in admins:
+        await admin.send_json(message)
+
+
+async def run_broadcast(queued: bool) -> dict:
+    websocket_manager.WS_SLOW_CONSUMER_POLICY = "coalesce"
+    fast_latencies, slow_latencies = [], []
+    manager = _new_manager()
+    for i in range(ADMIN_COUNT):
+        slow = i < SLOW_ADMIN_COUNT
+        await manager.connect_admin(FakeAdminSocket(
+            SLOW_SEND_SECONDS if slow else FAST_SEND_SECONDS,
+            slow_latencies if slow else fast_latencies
+        ))
+
+    started = time.perf_counter()
+    call_ms = []
+    for i in range(BROADCAST_COUNT):
+        message = {"id": i, "sent_at": time.perf_counter()}
+        if queued:
+            await manager.broadcast_to_admins(message)
+        else:
+            await _sequential_broadcast(manager.admins, message)
+        call_ms.append((time.perf_counter() - message["sent_at"]) * 1000)
+        await asyncio.sleep(BROADCAST_INTERVAL)
+
+    # Chờ các admin nhận hết frame
+    expected = (ADMIN_COUNT - SLOW_ADMIN_COUNT) * BROADCAST_COUNT
+    while len(fast_latencies) < expected:
+        await asyncio.sleep(0.01)
+    total_seconds = time.perf_counter() - started
+    for sender in list(manager.senders.values()):
+        sender.close()
+
+    fast_latencies.sort()
+    return {
+        "mode": "queued" if queued else "sequential",
+        "frames": len(fast_latencies) + len(slow_latencies),
+        "p50_ms": round(statistics.median(fast_latencies), 2),
+        "p99_ms": round(fast_latencies[int(len(fast_latencies) * 0.99) - 1], 2),
+        "max_ms": round(fast_latencies[-1], 2),
+        "broadcast_call_p99_ms": round(sorted(call_ms)[int(len(call_ms) * 0.99) - 1], 2),
+        "total_seconds": round(total_seconds, 2)
+    }
+
+
+def _bot_message() -> dict:
+    # Tin bot điển hình: nội dung JSON dài, links, timings, thời gian
+    return {
+        "id": 123456,
+        "chat_session_id": 42,
+        "sender_type": "bot",
+        "sender_name": "Bot",
+        "content": json.dumps({
+            "message": "Thủ tục cấp hộ chiếu phổ thông gồm tờ khai, ảnh chân dung và căn cước công dân. " * 10,
+            "links": ["https://dichvucong.gov.vn/p/home/dvc-trang-chu.html"]
+        }, ensure_ascii=False),
+        "session_name": "F-1234567890",
+        "session_status": "true",
+        "platform": "facebook",
+        "timings": {"rag_ms": 812.4, "llm_ms": 2310.7, "queue_wait_ms": 0.0},
+        "created_at": datetime.now()
+    }
+
+
+def run_serialization() -> dict:
+    message = _bot_message()
+
+    started = time.perf_counter()
+    for _ in range(ENCODE_ROUNDS):
+        for _ in range(ADMIN_COUNT):
+            json.dumps(message, separators=(",", ":"), ensure_ascii=False, default=str)
+    per_socket_ms = (time.perf_counter() - started) * 1000 / ENCODE_ROUNDS
+
+    started = time.perf_counter()
+    for _ in range(ENCODE_ROUNDS):
+        encode_json(message)
+    once_ms = (time.perf_counter() - started) * 1000 / ENCODE_ROUNDS
+
+    return {
+        "frame_bytes": len(encode_json(message).encode()),
+        "json_per_socket_ms": round(per_socket_ms, 3),
+        "orjson_once_ms": round(once_ms, 4),
+        "speedup": round(per_socket_ms / once_ms, 1)
+    }
+
+
+class ListRegistry:
+    """Cách lưu kết nối trước đây: list admin, list customer theo session"""
+
+    def __init__(self):
+        self.customers = {}
+        self.admins = []
+
+    async def connect_customer(self, websocket, session_id: int):
+        await websocket.accept()
+        if session_id not in self.customers:
+            self.customers[session_id] = []
+        self.customers[session_id].append(websocket)
+
+    async def connect_admin(self, websocket):
+        await websocket.accept()
+        self.admins.append(websocket)
+
+    def disconnect_customer(self, websocket, session_id: int):
+        if session_id in self.customers and websocket in self.customers[session_id]:
+            self.customers[session_id].remove(websocket)
+            if not self.customers[session_id]:
+                del self.customers[session_id]
+
+    def disconnect_admin(self, websocket):
+        if websocket in self.admins:
+            self.admins.remove(websocket)
+
+
+async def _churn(registry) -> float:
+    random.seed(7)
+    admins = [FakeAdminSocket(0, []) for _ in range(CHURN_CONNECTIONS)]
+    customers = [(FakeAdminSocket(0, []), i % CHURN_SESSIONS) for i in range(CHURN_CONNECTIONS)]
+    random_admins = random.sample(admins, len(admins))
+    random_customers = random.sample(customers, len(customers))
+
+    started = time.perf_counter()
+    for websocket in admins:
+        await registry.connect_admin(websocket)
+    for websocket, session_id in customers:
+        await registry.connect_customer(websocket, session_id)
+    for websocket in random_admins:
+        registry.disconnect_admin(websocket)
+    for websocket, session_id in random_customers:
+        registry.disconnect_customer(websocket, session_id)
+    elapsed_ms = (time.perf_counter() - started) * 1000
+
+    assert not registry.admins and not registry.customers
+    return elapsed_ms
+
+
+def run_registry_churn() -> dict:
+    list_ms = asyncio.run(_churn(ListRegistry()))
+    set_ms = asyncio.run(_churn(_new_manager()))
+    return {
+        "connections": CHURN_CONNECTIONS * 2,
+        "list_ms": round(list_ms, 1),
+        "set_ms": round(set_ms, 1),
+        "speedup": round(list_ms / set_ms, 1)
+    }
+
+
+def test_registry_churn_is_linear():
+    result = run_registry_churn()
+    assert result["set_ms"] * 3 < result["list_ms"]
+
+
+def test_frame_encoded_once_per_broadcast():
+    result = run_serialization()
+    assert result["speedup"] > 50
+
+
+def test_queued_broadcast_p99_not_tied_to_slow_admins():
+    sequential = asyncio.run(run_broadcast(queued=False))
+    queued = asyncio.run(run_broadcast(queued=True))
+
+    # Gửi tuần tự: admin nhanh phải chờ các admin chậm đứng trước (~5 x 50ms)
+    assert sequential["p99_ms"] >= SLOW_ADMIN_COUNT * SLOW_SEND_SECONDS * 1000 * 0.8
+    # Hàng đợi: độ trễ admin nhanh không phụ thuộc admin chậm
+    assert queued["p99_ms"] * 3 < sequential["p99_ms"]
+
+
+if __name__ == "__main__":
+    for queued in (False, True):
+        result = asyncio.run(run_broadcast(queued))
+        print(f"\n=== {result.pop('mode').upper()} ({ADMIN_COUNT} admin, {SLOW_ADMIN_COUNT} chậm) ===")
+        for name, value in result.items():
+            print(f"  {name}: {value}")
+
+    print(f"\n=== MÃ HÓA JSON 1 LẦN BROADCAST ({ADMIN_COUNT} admin) ===")
+    for name, value in run_serialization().items():
+        print(f"  {name}: {value}")
+
+    print(f"\n=== {CHURN_CONNECTIONS} ADMIN + {CHURN_CONNECTIONS} CUSTOMER KẾT NỐI / NGẮT KẾT NỐI ===")
+    for name, value in run_registry_churn().items():
+        print(f"  {name}: {value}")
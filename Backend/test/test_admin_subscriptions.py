@@ -0,0 +1,140 @@
+"""
+🧪 TEST ĐĂNG KÝ TOPIC CHO ADMIN WEBSOCKET
+=========================================
+Socket giả, không cần server thật:
+- Admin chưa đăng ký nhận mọi tin như trước
+- Đăng ký session / kênh → chỉ nhận tin của session / kênh đó
+- Đăng ký summary → nhận frame tóm tắt, không nhận frame stream
+- Ngắt kết nối → bỏ khỏi index topic
+
+Chạy: python -m pytest test/test_admin_subscriptions.py  hoặc  python test/test_admin_subscriptions.py
+"""
+
+import asyncio
+import json
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from config.websocket_manager import ConnectionManager
+
+
+class FakeWebSocket:
+
+    def __init__(self):
+        self.sent = []
+
+    async def accept(self):
+        pass
+
+    async def send_text(self, text):
+        self.sent.append(json.loads(text))
+
+
+def _new_manager() -> ConnectionManager:
+    manager = object.__new__(ConnectionManager)
+    manager._initialized = False
+    manager.__init__()
+    return manager
+
+
+def _message(session_id: int, content: str, platform: str = None) -> dict:
+    message = {
+        "id": None,
+        "chat_session_id": session_id,
+        "sender_type": "customer",
+        "content": content,
+        "session_name": f"F-{session_id}",
+        "session_status": "true",
+        "created_at": "2025-01-01T00:00:00"
+    }
+    if platform:
+        message["platform"] = platform
+    return message
+
+
+def test_topic_routing():
+
+    async def scenario():
+        manager = _new_manager()
+        legacy, by_session, by_channel, summary = (FakeWebSocket() for _ in range(4))
+        for ws in (legacy, by_session, by_channel, summary):
+            await manager.connect_admin(ws, stream=True)
+
+        ack = manager.handle_admin_subscription(by_session, {"type": "subscribe", "sessions": [1]})
+        manager.handle_admin_subscription(by_channel, {"type": "subscribe", "channels": ["facebook", "sms"]})
+        manager.handle_admin_subscription(summary, {"type": "subscribe", "summary": True})
+
+        await manager.broadcast_to_admins(_message(1, "tin web"), channel="web")
+        await manager.broadcast_to_admins(_message(2, "tin facebook", platform="facebook"))
+        await manager.broadcast_to_admins({"type": "bot_delta", "chat_session_id": 1, "delta": "x"}, stream_only=True)
+        await manager.broadcast_to_admins({"type": "session_update", "chat_session_id": 3, "session_status": "false"})
+        await asyncio.sleep(0.01)
+        return manager, ack, legacy, by_session, by_channel, summary
+
+    manager, ack, legacy, by_session, by_channel, summary = asyncio.run(scenario())
+
+    assert ack == {"type": "subscriptions", "topics": ["session:1"]}
+    assert len(legacy.sent) == 4
+    assert [m.get("content") or m["type"] for m in by_session.sent] == ["tin web", "bot_delta"]
+    # Kênh không hợp lệ bị bỏ qua
+    assert manager.admin_subscriptions[by_channel] == {"channel:facebook"}
+    assert [m["content"] for m in by_channel.sent] == ["tin facebook"]
+    assert [m["type"] for m in summary.sent] == ["session_summary", "session_summary", "session_update"]
+    assert summary.sent[1]["channel"] == "facebook" and summary.sent[1]["last_message"] == "tin facebook"
+
+
+def test_unsubscribe_and_disconnect_clean_index():
+
+    async def scenario():
+        manager = _new_manager()
+        admin = FakeWebSocket()
+        await manager.connect_admin(admin)
+        manager.handle_admin_subscription(admin, {"type": "subscribe", "sessions": [1, 2]})
+        manager.handle_admin_subscription(admin, {"type": "unsubscribe", "sessions": [1]})
+
+        await manager.broadcast_to_admins(_message(1, "a"))
+        await manager.broadcast_to_admins(_message(2, "b"))
+        await asyncio.sleep(0.01)
+        sent = list(admin.sent)
+
+        # Không có admin nào xem session 1 → không cần stream
+        has_listeners = manager.has_stream_listeners(1)
+        manager.disconnect_admin(admin)
+        return manager, sent, has_listeners
+
+    manager, sent, has_listeners = asyncio.run(scenario())
+
+    assert [m["content"] for m in sent] == ["b"]
+    assert has_listeners is False
+    assert manager.admin_topics == {} and manager.admin_subscriptions == {}
+
+
+def test_non_subscription_frame_is_ignored():
+    manager = _new_manager()
+    assert manager.handle_admin_subscription(FakeWebSocket(), {"chat_session_id": 1, "content": "hi"}) is None
+
+
+def test_invalid_session_ids_return_error_frame():
+    manager = _new_manager()
+    admin = FakeWebSocket()
+    manager.admin_subscriptions[admin] = set()
+
+    ok = manager.handle_admin_subscription(admin, {"type": "subscribe", "sessions": [1, "2"]})
+    bad = manager.handle_admin_subscription(admin, {"type": "subscribe", "sessions": [3, "abc", None, True, -1]})
+    not_list = manager.handle_admin_subscription(admin, {"type": "unsubscribe", "sessions": "1"})
+
+    assert ok == {"type": "subscriptions", "topics": ["session:1", "session:2"]}
+    assert bad["type"] == "subscription_error" and bad["invalid"] == ["abc", None, True, -1]
+    assert not_list["type"] == "subscription_error"
+    # Frame lỗi không áp dụng phần nào (session 3 không được đăng ký, session 1 không bị hủy)
+    assert manager.admin_subscriptions[admin] == {"session:1", "session:2"}
+
+
+if __name__ == "__main__":
+    test_topic_routing()
+    test_unsubscribe_and_disconnect_clean_index()
+    test_non_subscription_frame_is_ignored()
+    test_invalid_session_ids_return_error_frame()
+    print("✅ TEST HOÀN TẤT!")
@@ -0,0 +1,219 @@
+"""
+🧪 TEST GỘP TIN NHẮN THEO SESSION (DEBOUNCE)
+=============================================
+Chạy trên fakeredis (cần fakeredis + lupa), không gọi LLM thật, hàm sinh câu trả lời giả
+ghi lại nội dung nhận được:
+- Nhiều mảnh trong cửa sổ debounce → 1 lượt trả lời với nội dung đã gộp
+- Tin mới tới khi lượt trước đang sinh → hủy lượt trước, trả lời chung
+- Lượt đã có câu trả lời (committed) thì không bị hủy
+- Mảnh của cùng session tới các worker khác nhau vẫn được gộp, lượt đang sinh ở worker khác
+  không commit được và được trả lời chung
+- Redis lỗi lúc hết cửa sổ → vẫn trả lời bằng các mảnh đã nhận, không bỏ lượt
+
+Chạy: python -m pytest test/test_debounce.py  hoặc  python test/test_debounce.py
+"""
+
+import asyncio
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fakeredis import aioredis as fake_aioredis
+from config.redis_cache import redis_cache
+import helper.help_debounce as debounce
+
+WINDOW_MS = 50
+
+
+def _reset_state(window_ms: int = WINDOW_MS):
+    redis_cache._async_client = fake_aioredis.FakeRedis(decode_responses=True)
+    debounce.BOT_DEBOUNCE_MS = window_ms
+    debounce._scripts.clear()
+    debounce._timers.clear()
+    debounce._generations.clear()
+    debounce._push_tails.clear()
+    debounce._local_fragments.clear()
+    debounce._local_fragments.clear()
+    for key in debounce._stats:
+        debounce._stats[key] = 0
+
+
+def _make_run(log: list, llm_seconds: float = 0.0, commit: bool = True):
+    async def run(content: str):
+        log.append(("start", content))
+        await asyncio.sleep(llm_seconds)
+        if commit:
+            await debounce.mark_generation_committed()
+        # Lưu DB + gửi tin sau khi đã có câu trả lời
+        await asyncio.sleep(0.03)
+        log.append(("sent", content))
+    return run
+
+
+def test_fragments_within_window_are_coalesced():
+    _reset_state()
+    log = []
+
+    async def scenario():
+        for fragment in ("cho mình hỏi", "thủ tục làm hộ chiếu", "cần giấy tờ gì?"):
+            debounce.schedule_bot_response(1, fragment, _make_run(log))
+            await asyncio.sleep(WINDOW_MS / 1000 / 3)
+        await asyncio.sleep(0.2)
+
+    asyncio.run(scenario())
+
+    assert log == [
+        ("start", "cho mình hỏi\nthủ tục làm hộ chiếu\ncần giấy tờ gì?"),
+        ("sent", "cho mình hỏi\nthủ tục làm hộ chiếu\ncần giấy tờ gì?"),
+    ]
+    assert debounce.get_debounce_stats()["llm_calls_saved"] == 2
+    assert debounce.get_debounce_stats()["pending_sessions"] == 0
+
+
+def test_in_flight_generation_is_cancelled_and_merged():
+    _reset_state()
+    log = []
+
+    async def scenario():
+        debounce.schedule_bot_response(1, "giờ làm việc", _make_run(log, llm_seconds=0.2))
+        # Đợi qua cửa sổ để lượt đầu bắt đầu sinh, rồi gửi thêm tin
+        await asyncio.sleep(WINDOW_MS / 1000 + 0.05)
+        debounce.schedule_bot_response(1, "thứ 7 có làm không?", _make_run(log, llm_seconds=0.05))
+        await asyncio.sleep(0.4)
+
+    asyncio.run(scenario())
+
+    assert log == [
+        ("start", "giờ làm việc"),
+        ("start", "giờ làm việc\nthứ 7 có làm không?"),
+        ("sent", "giờ làm việc\nthứ 7 có làm không?"),
+    ]
+    assert debounce._stats["cancelled"] == 1
+
+
+def test_committed_generation_is_not_cancelled():
+    _reset_state()
+    log = []
+
+    async def scenario():
+        debounce.schedule_bot_response(1, "xin chào", _make_run(log, llm_seconds=0.0))
+        # Lượt đầu đã có câu trả lời và đang gửi thì khách nhắn thêm
+        while not any(generation.committed for generation in debounce._generations.values()):
+            await asyncio.sleep(0.005)
+        debounce.schedule_bot_response(1, "cảm ơn", _make_run(log))
+        await asyncio.sleep(0.3)
+
+    asyncio.run(scenario())
+
+    assert ("sent", "xin chào") in log and ("sent", "cảm ơn") in log
+    assert debounce._stats["cancelled"] == 0
+
+
+def test_sessions_are_independent_and_window_zero_disables():
+    _reset_state()
+    log = []
+
+    async def scenario():
+        debounce.schedule_bot_response(1, "a", _make_run(log))
+        debounce.schedule_bot_response(2, "b", _make_run(log))
+        await asyncio.sleep(0.2)
+
+    asyncio.run(scenario())
+    assert sorted(content for event, content in log if event == "sent") == ["a", "b"]
+
+    _reset_state(window_ms=0)
+    log.clear()
+
+    async def no_debounce():
+        debounce.schedule_bot_response(1, "a", _make_run(log))
+        debounce.schedule_bot_response(1, "b", _make_run(log))
+        await asyncio.sleep(0.1)
+
+    asyncio.run(no_debounce())
+    assert sorted(content for event, content in log if event == "sent") == ["a", "b"]
+
+
+def _switch_worker():
+    """Giả lập mảnh tiếp theo tới worker khác: process này không còn biết timer / lượt đang sinh"""
+    debounce._timers.clear()
+    debounce._generations.clear()
+    debounce._push_tails.clear()
+    debounce._local_fragments.clear()
+
+
+def test_fragments_on_different_workers_are_coalesced():
+    _reset_state()
+    log = []
+
+    async def scenario():
+        debounce.schedule_bot_response(1, "cho mình hỏi", _make_run(log))
+        await asyncio.sleep(WINDOW_MS / 1000 / 3)
+        _switch_worker()
+        debounce.schedule_bot_response(1, "học phí bao nhiêu?", _make_run(log))
+        await asyncio.sleep(0.2)
+
+    asyncio.run(scenario())
+
+    assert log == [
+        ("start", "cho mình hỏi\nhọc phí bao nhiêu?"),
+        ("sent", "cho mình hỏi\nhọc phí bao nhiêu?"),
+    ]
+
+
+def test_generation_on_other_worker_is_superseded_and_merged():
+    _reset_state()
+    log = []
+
+    async def scenario():
+        debounce.schedule_bot_response(1, "giờ làm việc", _make_run(log, llm_seconds=0.1))
+        await asyncio.sleep(WINDOW_MS / 1000 + 0.03)
+        # Lượt đầu đang sinh ở worker này, tin mới tới worker khác (không cancel được trực tiếp)
+        _switch_worker()
+        debounce.schedule_bot_response(1, "thứ 7 có làm không?", _make_run(log, llm_seconds=0.1))
+        await asyncio.sleep(0.4)
+
+    asyncio.run(scenario())
+
+    assert ("sent", "giờ làm việc") not in log
+    assert [event for event in log if event[0] == "sent"] == [("sent", "giờ làm việc\nthứ 7 có làm không?")]
+    assert debounce._stats["superseded"] == 1
+
+
+def test_claim_failure_answers_with_local_fragments():
+    _reset_state()
+    log = []
+
+    class BrokenRedis:
+        def register_script(self, script):
+            async def run(keys, args):
+                raise ConnectionError("Redis down")
+            return run
+
+    async def scenario():
+        debounce.schedule_bot_response(1, "giờ làm việc", _make_run(log, llm_seconds=0.1))
+        await asyncio.sleep(WINDOW_MS / 1000 + 0.03)
+        # Lượt đầu đang sinh thì có 2 mảnh mới, Redis sập trước khi hết cửa sổ
+        for fragment in ("thứ 7", "có làm không?"):
+            debounce.schedule_bot_response(1, fragment, _make_run(log))
+            await asyncio.sleep(0.01)
+        redis_cache._async_client = BrokenRedis()
+        debounce._scripts.clear()
+        await asyncio.sleep(0.2)
+
+    asyncio.run(scenario())
+
+    assert [event for event in log if event[0] == "sent"] == [("sent", "giờ làm việc\nthứ 7\ncó làm không?")]
+    assert debounce._stats["direct_fallback"] == 1
+    assert debounce._local_fragments == {}
+
+
+if __name__ == "__main__":
+    test_fragments_within_window_are_coalesced()
+    test_in_flight_generation_is_cancelled_and_merged()
+    test_committed_generation_is_not_cancelled()
+    test_sessions_are_independent_and_window_zero_disables()
+    test_fragments_on_different_workers_are_coalesced()
+    test_generation_on_other_worker_is_superseded_and_merged()
+    test_claim_failure_answers_with_local_fragments()
+    print("✅ TEST HOÀN TẤT!")
@@ -0,0 +1,149 @@
+"""
+🧪 TEST CACHE EMBEDDING CÂU HỎI (LRU + REDIS)
+==============================================
+Chạy trên fakeredis (client binary), không gọi API embedding:
+- Chuẩn hóa câu hỏi: NFC, khoảng trắng, chữ hoa/thường → cùng key; khác model → khác key
+- LRU in-process: quá EMBEDDING_CACHE_MAX_ITEMS thì bỏ key ít dùng nhất, lấy lại từ Redis
+- Vector lưu float32 bytes trên Redis, hết TTL thì miss ở cả 2 tầng
+- Redis lỗi → vẫn dùng được LRU in-process
+
+Chạy: python -m pytest test/test_embedding_cache.py  hoặc  python test/test_embedding_cache.py
+"""
+
+import asyncio
+import os
+import sys
+import unicodedata
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+from fakeredis import aioredis as fake_aioredis
+from config.redis_cache import redis_cache
+import helper.help_embedding_cache as embedding_cache
+
+MODEL = "gemini-embedding-001"
+
+
+def _reset_state(max_items: int = 100, ttl: int = 3600):
+    client = fake_aioredis.FakeRedis(decode_responses=False)
+    redis_cache._async_binary_client = client
+    embedding_cache.EMBEDDING_CACHE_ENABLED = True
+    embedding_cache.EMBEDDING_CACHE_MAX_ITEMS = max_items
+    embedding_cache.EMBEDDING_CACHE_TTL = ttl
+    embedding_cache._lru.clear()
+    for key in embedding_cache._stats:
+        embedding_cache._stats[key] = 0
+    return client
+
+
+def test_vietnamese_variants_share_one_key():
+    composed = "Cấp lại căn cước"
+    decomposed = unicodedata.normalize("NFD", composed)
+    assert composed != decomposed
+
+    variants = [composed, decomposed, "  cấp lại\tcăn   cước\n", "CẤP LẠI CĂN CƯỚC"]
+    keys = {embedding_cache.get_embedding_cache_key(text, MODEL) for text in variants}
+
+    assert len(keys) == 1
+    assert embedding_cache.normalize_query_text(decomposed) == "cấp lại căn cước"
+    # Vector của model khác không dùng chung được
+    assert embedding_cache.get_embedding_cache_key(composed, "text-embedding-3-small") not in keys
+    assert embedding_cache.get_embedding_cache_key("cấp mới căn cước", MODEL) not in keys
+
+
+def test_roundtrip_through_redis_as_float32_bytes():
+    client = _reset_state()
+    vector = [0.1, -0.25, 3.5]
+
+    async def scenario():
+        await embedding_cache.cache_embedding("Đăng ký khai sinh", MODEL, vector)
+        local = await embedding_cache.get_cached_embedding("đăng ký  khai sinh", MODEL)
+        # Worker khác: LRU trống, lấy từ Redis
+        embedding_cache._lru.clear()
+        remote = await embedding_cache.get_cached_embedding("ĐĂNG KÝ KHAI SINH", MODEL)
+        raw = await client.get(embedding_cache.get_embedding_cache_key("Đăng ký khai sinh", MODEL))
+        missing = await embedding_cache.get_cached_embedding("đăng ký kết hôn", MODEL)
+        return local, remote, raw, missing
+
+    local, remote, raw, missing = asyncio.run(scenario())
+
+    expected = np.asarray(vector, dtype=np.float32).tolist()
+    assert local == remote == expected
+    assert raw == np.asarray(vector, dtype=np.float32).tobytes() and len(raw) == 4 * len(vector)
+    assert missing is None
+    stats = embedding_cache.get_embedding_cache_stats()
+    assert (stats["local_hits"], stats["redis_hits"], stats["misses"]) == (1, 1, 1)
+
+
+def test_lru_evicts_least_recently_used():
+    _reset_state(max_items=2)
+
+    async def scenario():
+        await embedding_cache.cache_embedding("a", MODEL, [1.0])
+        await embedding_cache.cache_embedding("b", MODEL, [2.0])
+        # Dùng lại "a" → "b" thành key ít dùng nhất
+        await embedding_cache.get_cached_embedding("a", MODEL)
+        await embedding_cache.cache_embedding("c", MODEL, [3.0])
+        local_keys = list(embedding_cache._lru)
+        # "b" đã bị bỏ khỏi LRU nhưng vẫn còn trên Redis
+        b = await embedding_cache.get_cached_embedding("b", MODEL)
+        return local_keys, b
+
+    local_keys, b = asyncio.run(scenario())
+
+    key = lambda text: embedding_cache.get_embedding_cache_key(text, MODEL)
+    assert local_keys == [key("a"), key("c")]
+    assert b == [2.0]
+    stats = embedding_cache.get_embedding_cache_stats()
+    assert stats["evictions"] == 2 and stats["size"] == 2
+    assert stats["redis_hits"] == 1
+
+
+def test_entries_expire_after_ttl_in_both_tiers():
+    _reset_state(ttl=1)
+
+    async def scenario():
+        await embedding_cache.cache_embedding("giờ làm việc", MODEL, [1.0, 2.0])
+        fresh = await embedding_cache.get_cached_embedding("giờ làm việc", MODEL)
+        await asyncio.sleep(1.1)
+        expired = await embedding_cache.get_cached_embedding("giờ làm việc", MODEL)
+        return fresh, expired
+
+    fresh, expired = asyncio.run(scenario())
+
+    assert fresh == [1.0, 2.0]
+    assert expired is None
+    assert embedding_cache._stats["misses"] == 1
+    assert embedding_cache.get_embedding_cache_stats()["size"] == 0
+
+
+def test_redis_errors_fall_back_to_local_lru():
+    _reset_state()
+
+    class BrokenRedis:
+        async def get(self, key):
+            raise ConnectionError("Redis down")
+
+        async def setex(self, key, ttl, value):
+            raise ConnectionError("Redis down")
+
+    async def scenario():
+        redis_cache._async_binary_client = BrokenRedis()
+        await embedding_cache.cache_embedding("lệ phí", MODEL, [0.5])
+        cached = await embedding_cache.get_cached_embedding("lệ phí", MODEL)
+        missing = await embedding_cache.get_cached_embedding("thời hạn", MODEL)
+        return cached, missing
+
+    cached, missing = asyncio.run(scenario())
+
+    assert cached == [0.5] and missing is None
+
+
+if __name__ == "__main__":
+    test_vietnamese_variants_share_one_key()
+    test_roundtrip_through_redis_as_float32_bytes()
+    test_lru_evicts_least_recently_used()
+    test_entries_expire_after_ttl_in_both_tiers()
+    test_redis_errors_fall_back_to_local_lru()
+    print("✅ TEST HOÀN TẤT!")
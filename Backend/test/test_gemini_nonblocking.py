@@ -0,0 +1,197 @@
+"""
+🧪 TEST GEMINI KHÔNG BLOCK EVENT LOOP
+======================================
+Dùng fake client local (không gọi API thật), thay cho GenerativeServiceAsyncClient theo key:
+- generate_content / stream_generate_content ngủ bằng asyncio.sleep
+Trong lúc sinh câu trả lời chậm, 1 coroutine khác phải tiếp tục chạy đều.
+- Request gửi đúng model / prompt, response stream được ghép lại và tách phần "message"
+- Câu hỏi bị chặn vì an toàn → trả lời lỗi chung, key không bị ghi nhận lỗi
+
+Chạy: python -m pytest test/test_gemini_nonblocking.py  hoặc  python test/test_gemini_nonblocking.py
+"""
+
+import asyncio
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from google.ai import generativelanguage as glm
+import llm.gemini as gemini
+import llm.help_key_health as health
+
+SLOW_SECONDS = 1.0
+TICK_SECONDS = 0.05
+
+
+def _response(text: str) -> glm.GenerateContentResponse:
+    return glm.GenerateContentResponse(candidates=[glm.Candidate(
+        content=glm.Content(role="model", parts=[glm.Part(text=text)]),
+        finish_reason=glm.Candidate.FinishReason.STOP
+    )])
+
+
+class FakeSlowClient:
+    active = 0
+    max_active = 0
+    requests = []
+
+    async def generate_content(self, request):
+        FakeSlowClient.requests.append(request)
+        FakeSlowClient.active += 1
+        FakeSlowClient.max_active = max(FakeSlowClient.max_active, FakeSlowClient.active)
+        try:
+            await asyncio.sleep(SLOW_SECONDS)
+        finally:
+            FakeSlowClient.active -= 1
+        return _response(json.dumps({"message": "ok", "links": []}))
+
+    async def stream_generate_content(self, request):
+        FakeSlowClient.requests.append(request)
+
+        async def chunks():
+            for text in ('{"message": "Xin ', 'chào", "links', '": []}'):
+                await asyncio.sleep(0.01)
+                yield _response(text)
+        return chunks()
+
+
+def _patch_gemini():
+    original = gemini.get_gemini_async_client
+    FakeSlowClient.requests = []
+    gemini.get_gemini_async_client = lambda api_key: FakeSlowClient()
+    return original
+
+
+def _restore_gemini(original):
+    gemini.get_gemini_async_client = original
+
+
+async def _ticker(stop: asyncio.Event, ticks: list):
+    while not stop.is_set():
+        ticks.append(time.perf_counter())
+        await asyncio.sleep(TICK_SECONDS)
+
+
+async def _run_generation_with_ticker():
+    stop = asyncio.Event()
+    ticks = []
+    ticker = asyncio.create_task(_ticker(stop, ticks))
+
+    result = await gemini.generate_gemini_response(api_key="fake-key", prompt="xin chào")
+
+    stop.set()
+    await ticker
+    return result, ticks
+
+
+def test_event_loop_keeps_running_during_slow_generation():
+    original = _patch_gemini()
+    try:
+        result, ticks = asyncio.run(_run_generation_with_ticker())
+    finally:
+        _restore_gemini(original)
+
+    assert json.loads(result)["message"] == "ok"
+
+    # Loop bị block thì ticker chỉ chạy được 1-2 lần
+    expected_ticks = SLOW_SECONDS / TICK_SECONDS
+    assert len(ticks) >= expected_ticks * 0.5, f"Chỉ có {len(ticks)} tick, event loop bị block"
+
+    max_gap = max(b - a for a, b in zip(ticks, ticks[1:]))
+    assert max_gap < SLOW_SECONDS / 2, f"Khoảng dừng lớn nhất {max_gap:.2f}s, event loop bị block"
+
+
+def test_concurrency_is_capped_per_key():
+    original = _patch_gemini()
+    old_limit = gemini.GEMINI_MAX_CONCURRENCY_PER_KEY
+    gemini.GEMINI_MAX_CONCURRENCY_PER_KEY = 2
+    gemini._key_semaphores.clear()
+    FakeSlowClient.max_active = 0
+
+    async def run():
+        await asyncio.gather(*[
+            gemini.generate_gemini_response(api_key="fake-key", prompt=f"câu {i}")
+            for i in range(5)
+        ])
+
+    try:
+        asyncio.run(run())
+    finally:
+        gemini.GEMINI_MAX_CONCURRENCY_PER_KEY = old_limit
+        gemini._key_semaphores.clear()
+        _restore_gemini(original)
+
+    assert FakeSlowClient.max_active == 2
+
+
+def test_request_and_streamed_response():
+    original = _patch_gemini()
+    deltas = []
+
+    async def on_delta(delta):
+        deltas.append(delta)
+
+    async def run():
+        return await gemini.generate_gemini_response(
+            api_key="fake-key", prompt="xin chào", model_name="gemini-2.0-flash", on_delta=on_delta
+        )
+
+    try:
+        result = asyncio.run(run())
+    finally:
+        _restore_gemini(original)
+
+    request = FakeSlowClient.requests[0]
+    assert request.model == "models/gemini-2.0-flash"
+    assert request.contents[0].parts[0].text == "xin chào"
+    assert json.loads(result) == {"message": "Xin chào", "links": []}
+    assert "".join(deltas) == "Xin chào"
+
+
+def test_blocked_prompt_is_recorded_as_key_success():
+    class FakeBlockingClient:
+        async def generate_content(self, request):
+            return glm.GenerateContentResponse(prompt_feedback=glm.GenerateContentResponse.PromptFeedback(
+                block_reason=glm.GenerateContentResponse.PromptFeedback.BlockReason.SAFETY
+            ))
+
+        async def stream_generate_content(self, request):
+            async def chunks():
+                yield glm.GenerateContentResponse(candidates=[glm.Candidate(
+                    finish_reason=glm.Candidate.FinishReason.SAFETY
+                )])
+            return chunks()
+
+    async def noop_delta(delta):
+        pass
+
+    original = gemini.get_gemini_async_client
+    gemini.get_gemini_async_client = lambda api_key: FakeBlockingClient()
+    health._health.pop(health.get_key_fingerprint("blocked-key"), None)
+
+    async def run():
+        return [
+            await gemini.generate_gemini_response(api_key="blocked-key", prompt="câu hỏi bị chặn"),
+            await gemini.generate_gemini_response(api_key="blocked-key", prompt="câu hỏi bị chặn", on_delta=noop_delta)
+        ]
+
+    try:
+        results = asyncio.run(run())
+    finally:
+        gemini.get_gemini_async_client = original
+
+    assert all(json.loads(result)["message"].startswith("Xin lỗi") for result in results)
+    entry = health._health[health.get_key_fingerprint("blocked-key")]
+    assert entry["errors"] == 0 and entry["consecutive_failures"] == 0
+    assert entry["content_blocked"] == entry["successes"] == 2
+
+
+if __name__ == "__main__":
+    test_event_loop_keeps_running_during_slow_generation()
+    test_concurrency_is_capped_per_key()
+    test_request_and_streamed_response()
+    test_blocked_prompt_is_recorded_as_key_success()
+    print("✅ TEST HOÀN TẤT!")
@@ -0,0 +1,183 @@
+"""
+🧪 TEST TUẦN TỰ HÓA SINH CÂU TRẢ LỜI THEO SESSION
+==================================================
+Chạy trên fakeredis (cần fakeredis + lupa):
+- 2 lượt cùng session không chạy chồng nhau, đúng thứ tự tới, lượt sau có queue_wait_ms
+- Các session khác nhau vẫn chạy song song
+- Worker khác đang giữ Redis lock → lượt ở worker này chờ tới khi lock được trả
+- Lock hết hạn khi đang giữ: chưa ai nhận thì nhận lại, worker khác đã nhận thì lượt đang sinh bị hủy
+
+Chạy: python -m pytest test/test_session_lock.py  hoặc  python test/test_session_lock.py
+"""
+
+import asyncio
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fakeredis import aioredis as fake_aioredis
+from config.redis_cache import redis_cache
+import helper.help_session_lock as session_lock
+
+GENERATION_SECONDS = 0.1
+
+
+def _reset_state():
+    redis_cache._async_client = fake_aioredis.FakeRedis(decode_responses=True)
+    session_lock._scripts.clear()
+    session_lock._local_locks.clear()
+    session_lock._users.clear()
+    for key in session_lock._stats:
+        session_lock._stats[key] = 0
+    session_lock.BOT_SESSION_LOCK_POLL_MS = 10
+    session_lock.BOT_SESSION_LOCK_TTL_MS = 30000
+
+
+async def _generate(chat_session_id: int, name: str, log: list, waits: dict):
+    async with session_lock.session_generation_slot(chat_session_id) as queue_wait_ms:
+        waits[name] = queue_wait_ms
+        log.append(("start", name))
+        await asyncio.sleep(GENERATION_SECONDS)
+        log.append(("end", name))
+
+
+def test_same_session_runs_in_order_without_overlap():
+    _reset_state()
+    log, waits = [], {}
+
+    async def scenario():
+        tasks = [asyncio.create_task(_generate(1, name, log, waits)) for name in ("q1", "q2", "q3")]
+        await asyncio.gather(*tasks)
+
+    asyncio.run(scenario())
+
+    assert log == [("start", "q1"), ("end", "q1"), ("start", "q2"), ("end", "q2"), ("start", "q3"), ("end", "q3")]
+    assert waits["q1"] < GENERATION_SECONDS * 1000 / 2
+    assert waits["q3"] >= GENERATION_SECONDS * 1000 * 2 * 0.9
+    stats = session_lock.get_session_lock_stats()
+    assert stats["acquired"] == 3 and stats["queued"] == 2
+    # Dọn lock khi không còn lượt nào của session
+    assert session_lock._local_locks == {} and stats["active_sessions"] == 0
+
+
+def test_different_sessions_run_concurrently():
+    _reset_state()
+    log, waits = [], {}
+
+    async def scenario():
+        started = asyncio.get_running_loop().time()
+        await asyncio.gather(*[_generate(session_id, f"s{session_id}", log, waits) for session_id in (1, 2, 3)])
+        return asyncio.get_running_loop().time() - started
+
+    elapsed = asyncio.run(scenario())
+
+    assert elapsed < GENERATION_SECONDS * 2
+    assert [event for event, _ in log[:3]] == ["start"] * 3
+
+
+def test_waits_for_lock_held_by_other_worker():
+    _reset_state()
+    log, waits = [], {}
+
+    async def scenario():
+        client = await redis_cache.get_async_client()
+        key = session_lock.get_session_lock_key(1)
+        await client.set(key, "other-worker", px=10000)
+
+        async def other_worker_finishes():
+            await asyncio.sleep(GENERATION_SECONDS)
+            await client.delete(key)
+
+        await asyncio.gather(other_worker_finishes(), _generate(1, "q1", log, waits))
+        return await client.get(key)
+
+    lock_after = asyncio.run(scenario())
+
+    assert waits["q1"] >= GENERATION_SECONDS * 1000 * 0.9
+    # Lock được trả sau khi sinh xong
+    assert lock_after is None
+
+
+def test_cancelled_waiter_releases_its_place():
+    _reset_state()
+    log, waits = [], {}
+
+    async def scenario():
+        first = asyncio.create_task(_generate(1, "q1", log, waits))
+        second = asyncio.create_task(_generate(1, "q2", log, waits))
+        third = asyncio.create_task(_generate(1, "q3", log, waits))
+        await asyncio.sleep(GENERATION_SECONDS / 2)
+        # Lượt q2 bị hủy khi đang chờ (vd: debounce gộp tin)
+        second.cancel()
+        await asyncio.gather(first, third)
+
+    asyncio.run(scenario())
+
+    assert log == [("start", "q1"), ("end", "q1"), ("start", "q3"), ("end", "q3")]
+    assert session_lock._local_locks == {}
+
+
+def test_lock_taken_by_other_worker_cancels_holder():
+    _reset_state()
+    session_lock.BOT_SESSION_LOCK_TTL_MS = 90
+    log = []
+
+    async def scenario():
+        client = await redis_cache.get_async_client()
+        key = session_lock.get_session_lock_key(1)
+
+        async def generate():
+            async with session_lock.session_generation_slot(1):
+                log.append("start")
+                await asyncio.sleep(1)
+                log.append("end")
+
+        task = asyncio.create_task(generate())
+        await asyncio.sleep(0.01)
+        # Lock hết hạn (Redis chậm...) và worker khác đã nhận
+        await client.set(key, "other-worker", px=10000)
+        try:
+            await asyncio.wait_for(task, 0.5)
+        except asyncio.CancelledError:
+            pass
+        return task, await client.get(key)
+
+    task, owner = asyncio.run(scenario())
+
+    assert log == ["start"] and task.cancelled()
+    assert session_lock._stats["redis_lock_lost"] == 1
+    # Không xóa lock của worker khác
+    assert owner == "other-worker"
+
+
+def test_expired_lock_is_reacquired_when_free():
+    _reset_state()
+    session_lock.BOT_SESSION_LOCK_TTL_MS = 90
+    log = []
+
+    async def scenario():
+        client = await redis_cache.get_async_client()
+        key = session_lock.get_session_lock_key(1)
+
+        async with session_lock.session_generation_slot(1):
+            # Lock hết hạn nhưng chưa worker nào nhận
+            await client.delete(key)
+            await asyncio.sleep(0.1)
+            log.append(await client.get(key) is not None)
+        log.append(await client.get(key))
+
+    asyncio.run(scenario())
+
+    assert log == [True, None]
+    assert session_lock._stats["redis_lock_lost"] == 0
+
+
+if __name__ == "__main__":
+    test_same_session_runs_in_order_without_overlap()
+    test_different_sessions_run_concurrently()
+    test_waits_for_lock_held_by_other_worker()
+    test_cancelled_waiter_releases_its_place()
+    test_lock_taken_by_other_worker_cancels_holder()
+    test_expired_lock_is_reacquired_when_free()
+    print("✅ TEST HOÀN TẤT!")
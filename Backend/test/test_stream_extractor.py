@@ -0,0 +1,91 @@
+"""
+🧪 TEST TÁCH "message" KHI LLM ĐANG STREAM JSON
+================================================
+Không gọi LLM thật, feed JSON theo từng mảnh cắt ở mọi vị trí:
+- Escape bị cắt giữa 2 chunk (\\n, \\", \\uXXXX, cặp surrogate) vẫn giải mã đúng
+- Key "message" xuất hiện sau "links", có ```json fence, model trả text thường
+- Escape \\u sai / surrogate lẻ không làm hỏng stream
+
+Chạy: python -m pytest test/test_stream_extractor.py  hoặc  python test/test_stream_extractor.py
+"""
+
+import json
+import os
+import random
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from llm.help_stream import MessageStreamExtractor
+
+
+def _feed_all(chunks) -> str:
+    extractor = MessageStreamExtractor()
+    return "".join(extractor.feed(chunk) for chunk in chunks)
+
+
+def _split_every_way(raw: str):
+    # Từng ký tự 1, mọi điểm cắt đôi, và vài cách cắt ngẫu nhiên
+    yield list(raw)
+    for cut in range(1, len(raw)):
+        yield [raw[:cut], raw[cut:]]
+    rng = random.Random(7)
+    for _ in range(50):
+        cuts = sorted(rng.sample(range(1, len(raw)), 4))
+        yield [raw[a:b] for a, b in zip([0] + cuts, cuts + [len(raw)])]
+
+
+def test_escapes_split_across_chunks():
+    message = 'Dòng 1\nDòng "2"\t\\ cuối 😀 café / ✓'
+    raw = json.dumps({"message": message, "links": ["https://a.vn"]})
+    # ensure_ascii mặc định: emoji thành cặp surrogate, chữ có dấu thành \uXXXX
+    assert "\\ud83d\\ude00" in raw and "\\u00e9" in raw
+
+    for chunks in _split_every_way(raw):
+        assert _feed_all(chunks) == message, chunks
+
+
+def test_non_ascii_output_and_fence():
+    message = "Thủ tục làm hộ chiếu\ngồm 3 bước"
+    raw = "```json\n" + json.dumps({"message": message, "links": []}, ensure_ascii=False) + "\n```"
+
+    for chunks in _split_every_way(raw):
+        assert _feed_all(chunks) == message
+
+
+def test_message_key_after_links():
+    raw = '{"links": ["https://dichvucong.gov.vn"], "message": "Xem hướng dẫn tại link"}'
+
+    for chunks in _split_every_way(raw):
+        assert _feed_all(chunks) == "Xem hướng dẫn tại link"
+
+
+def test_plain_text_response_is_streamed_verbatim():
+    assert _feed_all(["  Xin ", "chào", " bạn"]) == "Xin chào bạn"
+
+
+def test_invalid_escapes_do_not_break_stream():
+    raw = '{"message": "a\\uZZZZb \\ud83d c \\udc00 d \\ud83d\\n e", "links": []}'
+
+    for chunks in _split_every_way(raw):
+        text = _feed_all(chunks)
+        assert text == "a\\uZZZZb � c � d �\n e"
+        # Gửi qua WebSocket được (không còn surrogate lẻ)
+        text.encode("utf-8")
+
+
+def test_nothing_emitted_after_message_ends():
+    extractor = MessageStreamExtractor()
+    assert extractor.feed('{"message": "xong"') == "xong"
+    assert extractor.feed(', "links": ["x"]}') == ""
+    assert extractor.done
+
+
+if __name__ == "__main__":
+    test_escapes_split_across_chunks()
+    test_non_ascii_output_and_fence()
+    test_message_key_after_links()
+    test_plain_text_response_is_streamed_verbatim()
+    test_invalid_escapes_do_not_break_stream()
+    test_nothing_emitted_after_message_ends()
+    print("✅ TEST HOÀN TẤT!")
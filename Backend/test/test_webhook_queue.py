@@ -0,0 +1,162 @@
+"""
+🧪 TEST HÀNG ĐỢI WEBHOOK (REDIS STREAMS)
+=========================================
+Chạy trên fakeredis (cần fakeredis + lupa), thay chat_platform bằng hàm xử lý giả:
+- Số event xử lý đồng thời không vượt quá số consumer
+- Backlog đầy → từ chối (router trả 503)
+- Event lỗi quá số lần → webhook:failed, replay đưa lại hàng đợi và xử lý được
+- Entry của consumer đã chết được nhận lại bằng XAUTOCLAIM
+
+Chạy: python -m pytest test/test_webhook_queue.py  hoặc  python test/test_webhook_queue.py
+"""
+
+import asyncio
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fakeredis import aioredis as fake_aioredis
+from config.redis_cache import redis_cache
+import helper.help_webhook_queue as webhook_queue
+
+
+def _reset_state():
+    redis_cache._async_client = fake_aioredis.FakeRedis(decode_responses=True)
+    webhook_queue._latencies.clear()
+    for key in webhook_queue._stats:
+        webhook_queue._stats[key] = 0
+    webhook_queue.WEBHOOK_BLOCK_MS = 50
+    webhook_queue.WEBHOOK_RETRY_BASE = 0.01
+    webhook_queue.WEBHOOK_MAX_ATTEMPTS = 2
+    webhook_queue.WEBHOOK_MAX_BACKLOG = 10000
+    webhook_queue.WEBHOOK_CLAIM_IDLE_MS = 60000
+
+
+async def _wait_until(predicate, timeout: float = 5.0):
+    deadline = asyncio.get_running_loop().time() + timeout
+    while not predicate():
+        assert asyncio.get_running_loop().time() < deadline, "Hết thời gian chờ hàng đợi webhook"
+        await asyncio.sleep(0.01)
+
+
+def _run_with_fake_handler(scenario, fake_handler):
+    original = webhook_queue._handle_event
+    webhook_queue._handle_event = fake_handler
+
+    async def wrapper():
+        try:
+            return await scenario()
+        finally:
+            await webhook_queue.stop_webhook_consumers()
+
+    try:
+        return asyncio.run(wrapper())
+    finally:
+        webhook_queue._handle_event = original
+
+
+def test_consumer_pool_bounds_concurrency():
+    _reset_state()
+    handled = []
+    in_flight = {"now": 0, "max": 0}
+
+    async def fake_handler(platform, body):
+        in_flight["now"] += 1
+        in_flight["max"] = max(in_flight["max"], in_flight["now"])
+        await asyncio.sleep(0.03)
+        in_flight["now"] -= 1
+        handled.append(body["update_id"])
+
+    async def scenario():
+        for update_id in range(20):
+            await webhook_queue.enqueue_webhook_event("tele", {"update_id": update_id})
+        await webhook_queue.start_webhook_consumers(concurrency=4)
+        await _wait_until(lambda: len(handled) == 20)
+        return await webhook_queue.get_webhook_queue_stats()
+
+    stats = _run_with_fake_handler(scenario, fake_handler)
+
+    assert sorted(handled) == list(range(20))
+    assert 1 < in_flight["max"] <= 4
+    assert stats["processed"] == 20 and stats["backlog"] == 0
+
+
+def test_backlog_full_rejects_new_events():
+    _reset_state()
+    webhook_queue.WEBHOOK_MAX_BACKLOG = 3
+
+    async def scenario():
+        for update_id in range(3):
+            await webhook_queue.enqueue_webhook_event("zalo", {"update_id": update_id})
+        try:
+            await webhook_queue.enqueue_webhook_event("zalo", {"update_id": 3})
+        except webhook_queue.WebhookQueueFull:
+            return True
+        return False
+
+    assert asyncio.run(scenario()) is True
+    assert webhook_queue._stats["rejected"] == 1
+
+
+def test_failed_event_goes_to_failed_stream_and_replays():
+    _reset_state()
+    handled = []
+    broken = {"on": True}
+    attempts = {"count": 0}
+
+    async def fake_handler(platform, body):
+        attempts["count"] += 1
+        if broken["on"]:
+            raise ValueError("DB down")
+        handled.append(body["entry"])
+
+    async def scenario():
+        await webhook_queue.start_webhook_consumers(concurrency=2)
+        await webhook_queue.enqueue_webhook_event("fb", {"entry": "m1"})
+        await _wait_until(lambda: webhook_queue._stats["failed"] == 1)
+        client = await redis_cache.get_async_client()
+        failed = await client.xrange(webhook_queue.WEBHOOK_FAILED_STREAM)
+
+        broken["on"] = False
+        replayed = await webhook_queue.replay_failed_webhooks()
+        await _wait_until(lambda: handled == ["m1"])
+        return failed, replayed, await webhook_queue.get_webhook_queue_stats()
+
+    failed, replayed, stats = _run_with_fake_handler(scenario, fake_handler)
+
+    assert len(failed) == 1 and "DB down" in failed[0][1]["error"]
+    assert replayed == 1
+    assert attempts["count"] == webhook_queue.WEBHOOK_MAX_ATTEMPTS + 1
+    assert stats["failed_backlog"] == 0 and stats["backlog"] == 0
+
+
+def test_pending_entry_of_dead_consumer_is_reclaimed():
+    _reset_state()
+    webhook_queue.WEBHOOK_CLAIM_IDLE_MS = 100
+    handled = []
+
+    async def fake_handler(platform, body):
+        handled.append(body["update_id"])
+
+    async def scenario():
+        client = await redis_cache.get_async_client()
+        await webhook_queue.enqueue_webhook_event("tele", {"update_id": 1})
+        await webhook_queue._ensure_group(client)
+        # Consumer của process khác đã đọc entry rồi chết
+        await client.xreadgroup(webhook_queue.WEBHOOK_GROUP, "dead-worker-0", {webhook_queue.WEBHOOK_STREAM: ">"})
+
+        await webhook_queue.start_webhook_consumers(concurrency=1)
+        await _wait_until(lambda: handled == [1])
+
+    _run_with_fake_handler(scenario, fake_handler)
+
+    assert webhook_queue._stats["reclaimed"] == 1
+
+
+if __name__ == "__main__":
+    test_consumer_pool_bounds_concurrency()
+    test_backlog_full_rejects_new_events()
+    test_failed_event_goes_to_failed_stream_and_replays()
+    test_pending_entry_of_dead_consumer_is_reclaimed()
+    print("✅ TEST HOÀN TẤT!")
@@ -0,0 +1,177 @@
+"""
+🧪 TEST BACKPLANE WEBSOCKET GIỮA CÁC WORKER (REDIS PUB/SUB)
+============================================================
+Giả lập 2 worker (2 ConnectionManager + 2 backplane) dùng chung fakeredis:
+- Tin cho admin gửi từ worker A tới được admin kết nối ở worker B
+- Tin cho customer tới đúng session ở worker khác, không gửi trùng ở worker gốc
+- Frame stream_only vẫn chỉ gửi cho socket đăng ký stream
+- Worker chỉ subscribe kênh của session đang có khách kết nối ở worker đó
+- Ghi lại độ trễ end-to-end
+
+Chạy: python -m pytest test/test_websocket_backplane.py  hoặc  python test/test_websocket_backplane.py
+"""
+
+import asyncio
+import json
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fakeredis import aioredis as fake_aioredis
+from config.redis_cache import redis_cache
+from config.websocket_manager import ConnectionManager
+from config.websocket_backplane import WebSocketBackplane
+
+
+class FakeWebSocket:
+
+    def __init__(self):
+        self.sent = []
+
+    async def accept(self):
+        pass
+
+    async def send_text(self, text):
+        self.sent.append(json.loads(text))
+
+
+def _new_manager() -> ConnectionManager:
+    # ConnectionManager là singleton → tạo instance riêng cho từng worker giả lập
+    manager = object.__new__(ConnectionManager)
+    manager._initialized = False
+    manager.__init__()
+    return manager
+
+
+async def _start_workers():
+    redis_cache._async_client = fake_aioredis.FakeRedis(decode_responses=True)
+    workers = []
+    for _ in range(2):
+        manager = _new_manager()
+        backplane = WebSocketBackplane(manager)
+        await backplane.start()
+        assert await backplane.wait_ready()
+        workers.append((manager, backplane))
+    return workers
+
+
+async def _wait_for(predicate, timeout: float = 2.0):
+    deadline = asyncio.get_running_loop().time() + timeout
+    while not predicate():
+        if asyncio.get_running_loop().time() > deadline:
+            raise AssertionError("Hết thời gian chờ tin relay")
+        await asyncio.sleep(0.01)
+
+
+def test_admin_and_customer_messages_cross_workers():
+
+    async def scenario():
+        (manager_a, backplane_a), (manager_b, backplane_b) = await _start_workers()
+        admin_a, admin_b = FakeWebSocket(), FakeWebSocket()
+        customer_b = FakeWebSocket()
+        await manager_a.connect_admin(admin_a)
+        await manager_b.connect_admin(admin_b)
+        await manager_b.connect_customer(customer_b, 7)
+
+        # Bot trả lời chạy ở worker A, khách + 1 admin kết nối ở worker B
+        await manager_a.broadcast_to_admins({"id": 1})
+        await manager_a.send_to_customer(7, {"id": 1})
+        await _wait_for(lambda: len(admin_b.sent) == 1 and len(customer_b.sent) == 1)
+        await asyncio.sleep(0.05)
+
+        stats_b = backplane_b.get_stats()
+        stats_a = backplane_a.get_stats()
+        await backplane_a.stop()
+        await backplane_b.stop()
+        return admin_a, admin_b, customer_b, stats_a, stats_b
+
+    admin_a, admin_b, customer_b, stats_a, stats_b = asyncio.run(scenario())
+
+    # Worker gốc gửi trực tiếp 1 lần, không nhận lại tin của chính mình
+    assert admin_a.sent == [{"id": 1}]
+    assert admin_b.sent == [{"id": 1}]
+    assert customer_b.sent == [{"id": 1}]
+    # Worker A không có khách của session 7 → không subscribe, chỉ nhận lại tin admin của mình
+    assert stats_a["published"] == 2 and stats_a["skipped_own"] == 1
+    assert stats_b["relayed"] == 2
+    assert stats_b["latency_ms"]["p50"] is not None and stats_b["latency_ms"]["p50"] >= 0
+
+
+def test_stream_only_and_unknown_session_on_remote_worker():
+
+    async def scenario():
+        (manager_a, backplane_a), (manager_b, backplane_b) = await _start_workers()
+        legacy_admin, stream_admin = FakeWebSocket(), FakeWebSocket()
+        await manager_b.connect_admin(legacy_admin)
+        await manager_b.connect_admin(stream_admin, stream=True)
+
+        await manager_a.broadcast_to_admins({"type": "bot_delta"}, stream_only=True)
+        # Session không có khách nào kết nối ở worker B
+        await manager_a.send_to_customer(99, {"id": 2})
+        await _wait_for(lambda: len(stream_admin.sent) == 1)
+        await asyncio.sleep(0.05)
+
+        stats_b = backplane_b.get_stats()
+        await backplane_a.stop()
+        await backplane_b.stop()
+        return legacy_admin, stream_admin, stats_b, manager_a
+
+    legacy_admin, stream_admin, stats_b, manager_a = asyncio.run(scenario())
+
+    assert stream_admin.sent == [{"type": "bot_delta"}]
+    assert legacy_admin.sent == []
+    # Worker B không subscribe session 99 nên không nhận tin đó
+    assert stats_b["skipped_no_socket"] == 0 and stats_b["relayed"] == 1
+    # Dừng backplane → manager quay lại chỉ gửi trong worker
+    assert manager_a.backplane is None
+
+
+def test_session_channel_follows_local_customer_sockets():
+
+    async def scenario():
+        (manager_a, backplane_a), (manager_b, backplane_b) = await _start_workers()
+        client = redis_cache._async_client
+
+        async def subscribers():
+            return dict(await client.pubsub_numsub("ws:session:7"))["ws:session:7"]
+
+        first_tab, second_tab = FakeWebSocket(), FakeWebSocket()
+        await manager_b.connect_customer(first_tab, 7)
+        await manager_b.connect_customer(second_tab, 7)
+        after_connect = await subscribers()
+
+        manager_b.disconnect_customer(first_tab, 7)
+        await asyncio.sleep(0.05)
+        # Vẫn còn 1 tab → giữ subscribe
+        after_first_close = await subscribers()
+
+        manager_b.disconnect_customer(second_tab, 7)
+        # Khách mở lại ngay trước khi unsubscribe nền chạy xong
+        reopened = FakeWebSocket()
+        await manager_b.connect_customer(reopened, 7)
+        await asyncio.sleep(0.05)
+        after_reopen = await subscribers()
+        await manager_a.send_to_customer(7, {"id": 1})
+        await _wait_for(lambda: reopened.sent == [{"id": 1}])
+
+        manager_b.disconnect_customer(reopened, 7)
+        await asyncio.sleep(0.05)
+        after_close = await subscribers()
+        stats_b = backplane_b.get_stats()
+
+        await backplane_a.stop()
+        await backplane_b.stop()
+        return after_connect, after_first_close, after_reopen, after_close, stats_b
+
+    after_connect, after_first_close, after_reopen, after_close, stats_b = asyncio.run(scenario())
+
+    assert (after_connect, after_first_close, after_reopen, after_close) == (1, 1, 1, 0)
+    assert stats_b["subscribed_sessions"] == 0 and stats_b["subscribe_errors"] == 0
+
+
+if __name__ == "__main__":
+    test_admin_and_customer_messages_cross_workers()
+    test_stream_only_and_unknown_session_on_remote_worker()
+    test_session_channel_follows_local_customer_sockets()
+    print("✅ TEST HOÀN TẤT!")
@@ -0,0 +1,127 @@
+"""
+🧪 TEST HEARTBEAT + NGẮT KẾT NỐI WEBSOCKET KHÔNG PHẢN HỒI
+==========================================================
+Socket giả, chu kỳ heartbeat rút ngắn:
+- Kết nối ?heartbeat=1 nhận ping, trả lời pong thì được giữ, im lặng thì bị ngắt
+- Socket đã đóng (gửi lỗi) bị bỏ ngay ở lần ping
+- Client cũ (không heartbeat) không nhận frame ping
+- Thống kê số kết nối customer / admin / theo session
+
+Chạy: python -m pytest test/test_websocket_heartbeat.py  hoặc  python test/test_websocket_heartbeat.py
+"""
+
+import asyncio
+import json
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import config.websocket_manager as websocket_manager
+from config.websocket_manager import ConnectionManager
+
+INTERVAL = 0.05
+
+
+class FakeWebSocket:
+
+    def __init__(self, closed: bool = False):
+        self.closed = closed
+        self.sent = []
+        self.close_code = None
+
+    async def accept(self):
+        pass
+
+    async def send_text(self, text):
+        if self.closed:
+            raise RuntimeError("socket closed")
+        self.sent.append(json.loads(text))
+
+    async def close(self, code: int = 1000):
+        self.close_code = code
+
+
+def _new_manager() -> ConnectionManager:
+    websocket_manager.WS_HEARTBEAT_INTERVAL = INTERVAL
+    websocket_manager.WS_IDLE_TIMEOUT = INTERVAL * 3
+    manager = object.__new__(ConnectionManager)
+    manager._initialized = False
+    manager.__init__()
+    return manager
+
+
+def test_idle_and_dead_sockets_are_evicted():
+
+    async def scenario():
+        manager = _new_manager()
+        alive, idle, dead = FakeWebSocket(), FakeWebSocket(), FakeWebSocket(closed=True)
+        legacy = FakeWebSocket()
+        await manager.connect_customer(alive, 1, heartbeat=True)
+        await manager.connect_customer(idle, 1, heartbeat=True)
+        await manager.connect_admin(dead, heartbeat=True)
+        await manager.connect_admin(legacy)
+
+        # Chỉ "alive" trả lời pong sau mỗi ping
+        for _ in range(8):
+            await asyncio.sleep(INTERVAL / 2)
+            assert manager.handle_heartbeat(alive, {"type": "pong"}) is True
+        stats = manager.get_connection_stats()
+        await manager.stop_heartbeat()
+        return manager, alive, idle, dead, legacy, stats
+
+    manager, alive, idle, dead, legacy, stats = asyncio.run(scenario())
+
+    assert manager.customers == {1: {alive}}
+    assert manager.admins == {legacy}
+    assert idle.close_code == websocket_manager.IDLE_CLOSE_CODE
+    assert any(frame["type"] == "ping" for frame in alive.sent)
+    assert legacy.sent == []
+    assert stats["idle_evicted"] == 1
+    assert stats["customers"] == 1 and stats["admins"] == 1
+    assert stats["sockets_per_session"] == {1: 1}
+    assert manager.get_send_stats()["send_errors"] == 1
+
+
+def test_client_ping_gets_pong_and_enables_heartbeat():
+
+    async def scenario():
+        manager = _new_manager()
+        client = FakeWebSocket()
+        await manager.connect_customer(client, 5)
+        handled = manager.handle_heartbeat(client, {"type": "ping"})
+        not_heartbeat = manager.handle_heartbeat(client, {"chat_session_id": 5, "content": "hi"})
+        await asyncio.sleep(0.01)
+        tracked = client in manager.last_seen
+        await manager.stop_heartbeat()
+        return client, handled, not_heartbeat, tracked
+
+    client, handled, not_heartbeat, tracked = asyncio.run(scenario())
+
+    assert handled is True and not_heartbeat is False
+    assert client.sent == [{"type": "pong"}]
+    assert tracked
+
+
+def test_connection_gauges():
+
+    async def scenario():
+        manager = _new_manager()
+        for session_id, count in ((1, 3), (2, 1)):
+            for _ in range(count):
+                await manager.connect_customer(FakeWebSocket(), session_id, stream=True)
+        await manager.connect_admin(FakeWebSocket())
+        return manager.get_connection_stats()
+
+    stats = asyncio.run(scenario())
+
+    assert stats["customers"] == 4 and stats["customer_sessions"] == 2
+    assert stats["admins"] == 1 and stats["stream_sockets"] == 4
+    assert list(stats["sockets_per_session"].items()) == [(1, 3), (2, 1)]
+
+
+if __name__ == "__main__":
+    test_idle_and_dead_sockets_are_evicted()
+    test_client_ping_gets_pong_and_enables_heartbeat()
+    test_connection_gauges()
+    print("✅ TEST HOÀN TẤT!")
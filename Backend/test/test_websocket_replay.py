@@ -0,0 +1,164 @@
+"""
+🧪 TEST GỬI LẠI FRAME WEBSOCKET KHI CUSTOMER KẾT NỐI LẠI
+=========================================================
+Chạy trên fakeredis (cần fakeredis + lupa), socket giả:
+- Frame gửi cho customer có session_seq tăng dần, frame stream không đánh số
+- Kết nối lại với since=<seq> → nhận đúng các frame bị lỡ, theo thứ tự, trước frame mới
+- Buffer đã bị cắt / since không hợp lệ → frame replay_gap
+- Session chưa từng có widget kết nối / kênh Facebook, Telegram, Zalo → không đánh số, không lưu
+
+Chạy: python -m pytest test/test_websocket_replay.py  hoặc  python test/test_websocket_replay.py
+"""
+
+import asyncio
+import json
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fakeredis import aioredis as fake_aioredis
+from config.redis_cache import redis_cache
+from config.websocket_manager import ConnectionManager
+import config.websocket_replay as websocket_replay
+from config.websocket_replay import WebSocketReplayBuffer
+
+
+class FakeWebSocket:
+
+    def __init__(self):
+        self.sent = []
+
+    async def accept(self):
+        pass
+
+    async def send_text(self, text):
+        self.sent.append(json.loads(text))
+
+
+async def _start_manager():
+    redis_cache._async_client = fake_aioredis.FakeRedis(decode_responses=True)
+    manager = object.__new__(ConnectionManager)
+    manager._initialized = False
+    manager.__init__()
+    replay = WebSocketReplayBuffer(manager)
+    await replay.start()
+    return manager, replay
+
+
+async def _open_widget_once(manager, session_id: int):
+    # Widget từng kết nối rồi offline → frame của session được lưu lại
+    websocket = FakeWebSocket()
+    await manager.connect_customer(websocket, session_id)
+    manager.disconnect_customer(websocket, session_id)
+
+
+def test_reconnect_replays_missed_frames_in_order():
+
+    async def scenario():
+        manager, replay = await _start_manager()
+        first = FakeWebSocket()
+        await manager.connect_customer(first, 1, stream=True)
+        await manager.send_to_customer(1, {"id": 1, "content": "xin chào"})
+        await manager.send_to_customer(1, {"type": "bot_delta", "seq": 0, "delta": "Chào"}, stream_only=True)
+        await asyncio.sleep(0.01)
+        manager.disconnect_customer(first, 1)
+
+        # Mất mạng: 2 frame gửi khi widget đang offline
+        await manager.send_to_customer(1, {"id": 2, "content": "bot trả lời"})
+        await manager.send_to_customer(1, {"type": "session_update", "chat_session_id": 1})
+
+        second = FakeWebSocket()
+        last_seq = first.sent[0]["session_seq"]
+        await manager.connect_customer(second, 1, since=last_seq)
+        await manager.send_to_customer(1, {"id": 3, "content": "tin mới"})
+        await asyncio.sleep(0.01)
+        return first, second, replay.get_stats()
+
+    first, second, stats = asyncio.run(scenario())
+
+    assert first.sent[0]["session_seq"] == 1
+    # Frame stream giữ nguyên seq của stream, không có session_seq
+    assert "session_seq" not in first.sent[1] and first.sent[1]["seq"] == 0
+    assert [frame["session_seq"] for frame in second.sent] == [2, 3, 4]
+    assert [frame.get("id") for frame in second.sent] == [2, None, 3]
+    assert stats["replayed_frames"] == 2 and stats["gaps"] == 0
+
+
+def test_replay_does_not_duplicate_frames_sent_during_replay():
+
+    async def scenario():
+        manager, replay = await _start_manager()
+        await _open_widget_once(manager, 1)
+        for i in range(3):
+            await manager.send_to_customer(1, {"id": i})
+
+        client = FakeWebSocket()
+        original = replay.frames_since
+
+        async def slow_frames_since(session_id, since):
+            # Frame mới tới trong lúc đang đọc buffer
+            await manager.send_to_customer(1, {"id": 3})
+            return await original(session_id, since)
+
+        replay.frames_since = slow_frames_since
+        await manager.connect_customer(client, 1, since=1)
+        await asyncio.sleep(0.01)
+        return client
+
+    client = asyncio.run(scenario())
+
+    assert [frame["session_seq"] for frame in client.sent] == [2, 3, 4]
+
+
+def test_gap_when_buffer_trimmed_or_since_ahead():
+
+    async def scenario():
+        manager, replay = await _start_manager()
+        await _open_widget_once(manager, 1)
+        websocket_replay.WS_REPLAY_MAX_FRAMES = 2
+        try:
+            for i in range(5):
+                await manager.send_to_customer(1, {"id": i})
+        finally:
+            websocket_replay.WS_REPLAY_MAX_FRAMES = 200
+
+        trimmed, ahead, current = FakeWebSocket(), FakeWebSocket(), FakeWebSocket()
+        await manager.connect_customer(trimmed, 1, since=1)
+        await manager.connect_customer(ahead, 1, since=99)
+        await manager.connect_customer(current, 1, since=5)
+        await asyncio.sleep(0.01)
+        return trimmed, ahead, current
+
+    trimmed, ahead, current = asyncio.run(scenario())
+
+    assert trimmed.sent == [{"type": "replay_gap", "chat_session_id": 1, "since": 1, "latest_seq": 5}]
+    assert ahead.sent[0]["type"] == "replay_gap"
+    assert current.sent == []
+
+
+def test_sessions_without_widget_are_not_recorded():
+
+    async def scenario():
+        manager, replay = await _start_manager()
+        # Session Facebook: chưa từng có widget kết nối
+        await manager.send_to_customer(2, {"id": 1}, channel="facebook")
+        await manager.send_to_customer(2, {"id": 2})
+        # Session web đã có widget nhưng frame gửi kèm kênh khác web → bỏ qua trước khi gọi Redis
+        await _open_widget_once(manager, 3)
+        await manager.send_to_customer(3, {"id": 3}, channel="telegram")
+        keys = await redis_cache._async_client.keys("ws:*")
+        return sorted(keys), replay.get_stats()
+
+    keys, stats = asyncio.run(scenario())
+
+    assert keys == ["ws:seq:3"]
+    assert stats["recorded"] == 0 and stats["skipped"] == 1
+
+
+if __name__ == "__main__":
+    test_reconnect_replays_missed_frames_in_order()
+    test_replay_does_not_duplicate_frames_sent_during_replay()
+    test_gap_when_buffer_trimmed_or_since_ahead()
+    test_sessions_without_widget_are_not_recorded()
+    print("✅ TEST HOÀN TẤT!")
@@ -0,0 +1,170 @@
+"""
+🧪 TEST HÀNG ĐỢI GỬI WEBSOCKET THEO KẾT NỐI
+============================================
+Socket giả, không cần server thật:
+- 1 admin chậm không làm chậm các admin khác, thứ tự frame trong từng kết nối được giữ
+- Policy coalesce: frame bot_delta cùng stream được gộp khi client chậm
+- Hàng đợi đầy / gửi lỗi → kết nối bị ngắt và bỏ khỏi danh sách
+- 1 tin gửi nhiều kết nối chỉ mã hóa JSON 1 lần, datetime → ISO 8601
+
+Chạy: python -m pytest test/test_websocket_send_queue.py  hoặc  python test/test_websocket_send_queue.py
+"""
+
+import asyncio
+import json
+import os
+import sys
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import config.websocket_manager as websocket_manager
+from config.websocket_manager import ConnectionManager
+
+
+class FakeWebSocket:
+
+    def __init__(self, delay: float = 0.0, fail: bool = False):
+        self.delay = delay
+        self.fail = fail
+        self.sent = []
+        self.close_code = None
+
+    async def accept(self):
+        pass
+
+    async def send_text(self, text):
+        if self.fail:
+            raise RuntimeError("connection reset")
+        await asyncio.sleep(self.delay)
+        self.sent.append(json.loads(text))
+
+    async def close(self, code: int = 1000):
+        self.close_code = code
+
+
+def _new_manager(policy: str = "coalesce", queue_size: int = 256) -> ConnectionManager:
+    websocket_manager.WS_SLOW_CONSUMER_POLICY = policy
+    websocket_manager.WS_SEND_QUEUE_SIZE = queue_size
+    manager = object.__new__(ConnectionManager)
+    manager._initialized = False
+    manager.__init__()
+    return manager
+
+
+def _delta(seq: int, text: str) -> dict:
+    return {"type": "bot_delta", "chat_session_id": 1, "stream_id": "s1", "seq": seq, "delta": text}
+
+
+def test_slow_admin_does_not_delay_others():
+
+    async def scenario():
+        manager = _new_manager()
+        slow, fast = FakeWebSocket(delay=0.3), FakeWebSocket()
+        await manager.connect_admin(slow)
+        await manager.connect_admin(fast)
+
+        started = asyncio.get_running_loop().time()
+        for i in range(3):
+            await manager.broadcast_to_admins({"id": i})
+        broadcast_seconds = asyncio.get_running_loop().time() - started
+        await asyncio.sleep(0.05)
+        return manager, slow, fast, broadcast_seconds
+
+    manager, slow, fast, broadcast_seconds = asyncio.run(scenario())
+
+    assert broadcast_seconds < 0.05
+    assert fast.sent == [{"id": 0}, {"id": 1}, {"id": 2}]
+    assert len(slow.sent) < 3
+
+
+def test_bot_delta_frames_are_coalesced_for_slow_consumer():
+
+    async def scenario():
+        manager = _new_manager()
+        customer = FakeWebSocket(delay=0.05)
+        await manager.connect_customer(customer, 1, stream=True)
+
+        await manager.send_to_customer(1, {"id": "question"})
+        for seq, text in enumerate(["Xin ", "chào ", "anh ", "chị"]):
+            await manager.send_to_customer(1, _delta(seq, text), stream_only=True)
+        await manager.send_to_customer(1, {"id": "answer"})
+        await asyncio.sleep(0.3)
+        return manager, customer
+
+    manager, customer = asyncio.run(scenario())
+
+    assert customer.sent == [
+        {"id": "question"},
+        _delta(3, "Xin chào anh chị"),
+        {"id": "answer"},
+    ]
+    assert manager.get_send_stats()["coalesced"] == 3
+
+
+def test_full_queue_disconnects_slow_consumer():
+
+    async def scenario():
+        manager = _new_manager(policy="drop", queue_size=2)
+        slow, fast = FakeWebSocket(delay=0.1), FakeWebSocket()
+        await manager.connect_customer(slow, 1)
+        await manager.connect_customer(fast, 1)
+
+        for i in range(5):
+            await manager.send_to_customer(1, {"id": i})
+            await asyncio.sleep(0.005)
+        await asyncio.sleep(0.2)
+        return manager, slow, fast
+
+    manager, slow, fast = asyncio.run(scenario())
+
+    assert len(fast.sent) == 5
+    assert slow.close_code == websocket_manager.SLOW_CONSUMER_CLOSE_CODE
+    assert manager.customers[1] == {fast}
+    assert slow not in manager.senders
+    assert manager.get_send_stats()["slow_consumers_dropped"] == 1
+
+
+def test_failed_send_removes_admin():
+
+    async def scenario():
+        manager = _new_manager()
+        broken = FakeWebSocket(fail=True)
+        await manager.connect_admin(broken, stream=True)
+        await manager.broadcast_to_admins({"id": 1})
+        await asyncio.sleep(0.01)
+        return manager, broken
+
+    manager, broken = asyncio.run(scenario())
+
+    assert manager.admins == set()
+    assert broken not in manager.stream_sockets
+    assert manager.get_send_stats()["send_errors"] == 1
+
+
+def test_frame_encoded_once_for_all_recipients():
+
+    async def scenario():
+        manager = _new_manager()
+        admins = [FakeWebSocket() for _ in range(3)]
+        for admin in admins:
+            await manager.connect_admin(admin)
+        before = websocket_manager.encode_stats["frames"]
+        await manager.broadcast_to_admins({"id": 1, "content": "Xin chào", "created_at": datetime(2025, 1, 2, 3, 4, 5, 678)})
+        await asyncio.sleep(0.01)
+        return admins, websocket_manager.encode_stats["frames"] - before
+
+    admins, encoded = asyncio.run(scenario())
+
+    assert encoded == 1
+    for admin in admins:
+        assert admin.sent == [{"id": 1, "content": "Xin chào", "created_at": "2025-01-02T03:04:05.000678"}]
+
+
+if __name__ == "__main__":
+    test_slow_admin_does_not_delay_others()
+    test_bot_delta_frames_are_coalesced_for_slow_consumer()
+    test_full_queue_disconnects_slow_consumer()
+    test_failed_send_removes_admin()
+    test_frame_encoded_once_for_all_recipients()
+    print("✅ TEST HOÀN TẤT!")
@@ -112,6 +112,50 @@ export const useClientChat = () => {
             return; // Không thêm vào messages
           }
 
+          if ((data as any).type === "bot_delta") {
+            // Bot đang trả lời: nối phần mới vào tin tạm có cùng stream_id
+            setisBotActive(false);
+            setMessages((prevMessages) => {
+              const index = prevMessages.findIndex(
+                (message) => message.stream_id === data.stream_id
+              );
+              if (index === -1) {
+                return [
+                  ...prevMessages,
+                  {
+                    id: Date.now(),
+                    chat_session_id: data.chat_session_id,
+                    sender_type: "bot",
+                    content: JSON.stringify({ message: data.delta, links: [] }),
+                    created_at: new Date().toISOString(),
+                    stream_id: data.stream_id,
+                  },
+                ];
+              }
+              const streamed = JSON.parse(prevMessages[index].content).message;
+              const updated = [...prevMessages];
+              updated[index] = {
+                ...updated[index],
+                content: JSON.stringify({
+                  message: streamed + data.delta,
+                  links: [],
+                }),
+              };
+              return updated;
+            });
+            return;
+          }
+
+          if ((data as any).type === "bot_cancel") {
+            // Lượt trả lời bị hủy (khách gửi thêm tin) → bỏ phần đã stream
+            setMessages((prevMessages) =>
+              prevMessages.filter(
+                (message) => message.stream_id !== data.stream_id
+              )
+            );
+            return;
+          }
+
           if (data.sender_type === "bot") {
             setisBotActive(false);
             setIsWaitingBot(false);
@@ -173,7 +217,20 @@ export const useClientChat = () => {
             created_at: data.created_at || new Date().toISOString(),
             id: data.id || Date.now(),
           };
-          setMessages((prevMessages) => [...prevMessages, normalizedMessage]);
+          setMessages((prevMessages) => {
+            // Tin bot cuối cùng của lượt stream thay thế tin tạm
+            const index = data.stream_id
+              ? prevMessages.findIndex(
+                  (message) => message.stream_id === data.stream_id
+                )
+              : -1;
+            if (index === -1) {
+              return [...prevMessages, normalizedMessage];
+            }
+            const updated = [...prevMessages];
+            updated[index] = normalizedMessage;
+            return updated;
+          });
         };
 
         connectCustomerSocket(handleNewMessage);
@@ -11,6 +11,15 @@ type OnMessageCallback = (data: any) => void;
 let socketCustomer: WebSocket | null = null;
 let socketAdmin: WebSocket | null = null;
 
+// Server gửi {"type":"ping"} định kỳ cho kết nối có ?heartbeat=1, không trả lời pong sẽ bị ngắt
+const handleHeartbeat = (socket: WebSocket, data: any): boolean => {
+  if (data?.type === "ping") {
+    socket.send(JSON.stringify({ type: "pong" }));
+    return true;
+  }
+  return data?.type === "pong";
+};
+
 export const connectCustomerSocket = (onMessage: OnMessageCallback): void => {
   if (socketCustomer) return;
 
@@ -20,8 +29,9 @@ export const connectCustomerSocket = (onMessage: OnMessageCallback): void => {
     return;
   }
 
+  // stream=1: nhận frame bot_delta khi bot đang trả lời (hiện dần câu trả lời)
   socketCustomer = new WebSocket(
-    `${VITE_URL_WS}/chat/ws/customer?sessionId=${sessionId}`
+    `${VITE_URL_WS}/chat/ws/customer?sessionId=${sessionId}&heartbeat=1&stream=1`
   );
 
   socketCustomer.onopen = () => {
@@ -31,6 +41,7 @@ export const connectCustomerSocket = (onMessage: OnMessageCallback): void => {
   socketCustomer.onmessage = (event: MessageEvent) => {
     try {
       const data: MessageData = JSON.parse(event.data);
+      if (socketCustomer && handleHeartbeat(socketCustomer, data)) return;
       console.log("Customer nhận tin nhắn:", data);
       onMessage(data);
     } catch (error) {
@@ -56,7 +67,7 @@ export const connectAdminSocket = (
     return socketAdmin;
   }
 
-  socketAdmin = new WebSocket(`${VITE_URL_WS}/chat/ws/admin`);
+  socketAdmin = new WebSocket(`${VITE_URL_WS}/chat/ws/admin?heartbeat=1`);
 
   socketAdmin.onopen = () => {
     console.log("Admin WebSocket connected");
@@ -65,6 +76,7 @@ export const connectAdminSocket = (
     try {
       // Parse dữ liệu có thể là BackendSessionData hoặc MessageData
       const data: any = JSON.parse(event.data);
+      if (socketAdmin && handleHeartbeat(socketAdmin, data)) return;
       console.log("Admin nhận được data:", data);
 
       // Gửi thẳng dữ liệu về hook để xử lý
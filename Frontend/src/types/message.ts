@@ -9,6 +9,7 @@ export interface MessageData {
   session_status?: string; // Thêm thuộc tính để kiểm tra trạng thái session
   isOptimistic?: boolean; // Flag để đánh dấu tin nhắn tạm thời
   optimisticId?: string; // Unique ID để match optimistic message với real message
+  stream_id?: string; // Câu trả lời bot đang stream (bot_delta), tin cuối cùng stream_id thay thế tin tạm
   // Bổ sung các trường khác nếu cần
 }
 export interface SendMessagePayload {